@@ -1,6 +1,6 @@
 from .linkedin import LinkedInPost
-from .nlpservice import sized_text, teaser_text
+from .nlpservice import descriptions, sized_text, teaser_text
 from .publisher import Publisher
 from .records import Records
 
-__all__ = ["Publisher", "teaser_text", "sized_text", "Records", "LinkedInPost"]
+__all__ = ["Publisher", "teaser_text", "sized_text", "descriptions", "Records", "LinkedInPost"]
@@ -0,0 +1,90 @@
+"""
+Fit the information about a session into a token budget before it is sent to the LLM.
+
+Tokens are counted with `tiktoken` if it is installed, otherwise estimated with four characters per token.
+Fields are kept by priority: title and abstract first, then the speakers with their biographies shortened
+evenly, the description gets what is left.
+"""
+from pytube import logger
+
+try:
+    import tiktoken
+except ImportError:  # optional, the estimate is good enough for budgeting
+    tiktoken = None
+
+_encoding = None
+
+
+def encoding():
+    global _encoding  # noqa: PLW0603
+    if _encoding is None and tiktoken is not None:
+        _encoding = tiktoken.get_encoding('cl100k_base')
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens of a text, used for all token budgets: rate limits, input compaction and output lengths"""
+    if enc := encoding():
+        return len(enc.encode(text))
+    return len(text) // 4 + 1
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Shorten a text to about `max_tokens`, at a word boundary if possible"""
+    if max_tokens <= 0:
+        return ''
+    if count_tokens(text) <= max_tokens:
+        return text
+    if enc := encoding():
+        cut = enc.decode(enc.encode(text)[:max_tokens])
+    else:
+        cut = text[:max_tokens * 4]
+    head, _, _ = cut.rpartition(' ')
+    return f'{(head or cut).rstrip()}…'
+
+
+def share(lengths: list[int], budget: int) -> list[int]:
+    """Split a budget over items of the given lengths: short items keep their length, long ones share the rest"""
+    allocation = [0] * len(lengths)
+    remaining = budget
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    for i, idx in enumerate(order):
+        allocation[idx] = min(lengths[idx], max(0, remaining) // (len(order) - i))
+        remaining -= allocation[idx]
+    return allocation
+
+
+def render_info(title: str, speakers: list[tuple[str, str | None, str | None]], abstract: str, description: str) -> str:
+    """The input of the description prompts, speakers as (name, job, biography)"""
+    speakers_text = '\n'.join([f"{name} ({job}\nbiography:\n{bio})" for name, job, bio in speakers])
+    return f"title:{title}\nspeaker(s):\n{speakers_text}\ndescription:\n{abstract}\n{description}"
+
+
+def compact_info(title: str, speakers: list[tuple[str, str | None, str | None]], abstract: str, description: str,
+                 budget: int | None = None) -> tuple[str, int]:
+    """
+    The information about a session within `budget` tokens.
+    :param speakers: (name, job, biography) of each speaker
+    :param budget: max. input tokens, None or 0 for no limit
+    :return: the text and the number of tokens saved
+    """
+    full = render_info(title, speakers, abstract, description)
+    total = count_tokens(full)
+    if not budget or total <= budget:
+        return full, 0
+    without_bios = [(name, job, '') for name, job, _ in speakers]
+    available = budget - count_tokens(render_info(title, without_bios, abstract, ''))
+    if available <= 0:
+        # title and abstract alone exceed the budget
+        abstract = truncate_tokens(abstract, max(0, count_tokens(abstract) + available))
+        text = render_info(title, without_bios, abstract, '')
+    else:
+        bios = [bio or '' for _, _, bio in speakers]
+        bio_tokens = share([count_tokens(bio) for bio in bios], available)
+        bios = [truncate_tokens(bio, tokens) for bio, tokens in zip(bios, bio_tokens, strict=True)]
+        description = truncate_tokens(description, available - sum(bio_tokens))
+        text = render_info(title, [(name, job, bio) for (name, job, _), bio in zip(speakers, bios, strict=True)],
+                           abstract, description)
+    saved = total - count_tokens(text)
+    logger.debug(f'Compacted session info from {total} to {total - saved} tokens')
+    return text, saved
@@ -0,0 +1,348 @@
+"""
+Download engine for video recordings.
+
+A fixed number of workers is fed from a priority queue, so thread and memory overhead depend on the
+number of workers and not on the number of talks in the manifest.
+Connections to a single host can be limited independently of the number of workers.
+
+Files are downloaded to a `.part` file first, interrupted transfers are resumed via HTTP range requests.
+The final file only appears once size (and checksum, if known) have been verified.
+Response bodies are read into one large, reused buffer per transfer instead of many small chunks.
+Large files can be split into byte ranges that are fetched in parallel into a preallocated file.
+"""
+import hashlib
+import itertools
+import json
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+from urllib.parse import urlparse
+
+import requests
+from handlers.ratelimit import TokenBucket
+from pydantic import BaseModel, Field
+
+from pytube import logger
+
+
+class LinkExpiredError(RuntimeError):
+    """The download link was rejected, it needs to be resolved again."""
+
+
+class DownloadSummary(BaseModel):
+    """Outcome of a download run."""
+    downloaded: list[str] = Field(default_factory=list, description='pretalx IDs downloaded in this run.')
+    skipped: list[str] = Field(default_factory=list, description='pretalx IDs skipped, e.g. already downloaded.')
+    failed: dict[str, str] = Field(default_factory=dict, description='pretalx ID: error message.')
+    bytes_downloaded: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Average throughput in MB/s over the whole run."""
+        if not self.elapsed:
+            return 0.0
+        return self.bytes_downloaded / self.elapsed / 1024 ** 2
+
+    def log(self) -> None:
+        logger.info(f'Downloaded {len(self.downloaded)}, skipped {len(self.skipped)}, failed {len(self.failed)} '
+                    f'in {self.elapsed:.0f}s: {self.bytes_downloaded / 1024 ** 3:.2f} GB, '
+                    f'{self.throughput:.1f} MB/s')
+        for pretalx_id, error in self.failed.items():
+            logger.error(f'Failed {pretalx_id}: {error}')
+
+
+class DownloadEngine:
+    """
+    Run download jobs on a fixed-size worker pool.
+
+    The worker is called as `worker(record, idx, total, engine)` and returns the number of bytes downloaded,
+    or `None` if the record was skipped. Any exception counts as a failure of that record.
+    Workers should wrap their network transfer in `engine.host_slot(url)` to respect the per-host limit.
+    """
+
+    def __init__(self, worker: Callable[..., int | None], max_workers: int = 3, max_per_host: int = 3,
+                 priority: Callable[[dict], Any] | None = None):
+        """
+        :param worker: the function processing a single record
+        :param max_workers: number of worker threads
+        :param max_per_host: maximum number of concurrent transfers per host
+        :param priority: key function for a record, lower values are downloaded first
+        """
+        self.worker = worker
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.priority = priority or (lambda record: 0)  # noqa: ARG005
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._counter = itertools.count()  # keeps the queue stable for equal priorities
+        self._host_slots: dict[str, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+        self.summary = DownloadSummary()
+
+    @contextmanager
+    def host_slot(self, url: str):
+        """Hold one of the connection slots of the host of `url`."""
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.setdefault(host, threading.Semaphore(self.max_per_host))
+        with slot:
+            yield
+
+    def submit(self, record: dict, idx: int, total: int) -> None:
+        self._queue.put((self.priority(record), next(self._counter), (record, idx, total)))
+
+    def _work(self) -> None:
+        while True:
+            try:
+                *_, (record, idx, total) = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            pretalx_id = record.get('pretalx_id', str(idx))
+            try:
+                size = self.worker(record, idx, total, self)
+            except Exception as e:
+                with self._lock:
+                    self.summary.failed[pretalx_id] = str(e)
+                logger.error(f'Failed to download {pretalx_id}: {e}')
+                continue
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                if size is None:
+                    self.summary.skipped.append(pretalx_id)
+                else:
+                    self.summary.downloaded.append(pretalx_id)
+                    self.summary.bytes_downloaded += size
+
+    def run(self, records: Iterable[dict] | None = None) -> DownloadSummary:
+        """Download all submitted records (and `records`, if given) and return a summary."""
+        if records is not None:
+            records = list(records)
+            for idx, record in enumerate(records, 1):
+                self.submit(record, idx, len(records))
+        start = time.monotonic()
+        workers = [threading.Thread(target=self._work, name=f'download-{i}', daemon=True)
+                   for i in range(min(self.max_workers, self._queue.qsize()))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.summary.elapsed = time.monotonic() - start
+        self.summary.log()
+        return self.summary
+
+
+class ThroughputMeter:
+    """Log the throughput of a transfer periodically and when it is done.
+    Can be shared by the segments of a file downloaded in parallel."""
+
+    def __init__(self, name: str, log_interval: float = 10.0):
+        self.name = name
+        self.log_interval = log_interval
+        self.bytes = 0
+        self.start = self._last_log = time.monotonic()
+        self._bytes_at_last_log = 0
+        self._lock = threading.Lock()
+
+    def update(self, n: int) -> None:
+        with self._lock:
+            self.bytes += n
+            now = time.monotonic()
+            if now - self._last_log < self.log_interval:
+                return
+            rate = (self.bytes - self._bytes_at_last_log) / (now - self._last_log) / 1024 ** 2
+            self._last_log, self._bytes_at_last_log = now, self.bytes
+        logger.info(f'{self.name}: {self.bytes / 1024 ** 2:.0f} MB, {rate:.1f} MB/s')
+
+    @property
+    def throughput(self) -> float:
+        """Average throughput in MB/s"""
+        elapsed = time.monotonic() - self.start
+        return self.bytes / elapsed / 1024 ** 2 if elapsed else 0.0
+
+    def done(self) -> None:
+        logger.info(f'{self.name}: {self.bytes / 1024 ** 2:.0f} MB in {time.monotonic() - self.start:.0f}s, '
+                    f'{self.throughput:.1f} MB/s')
+
+
+def stream_to_file(response: requests.Response, f, buffer_size: int = 8 * 1024 ** 2,
+                   meter: ThroughputMeter | None = None, limiter: TokenBucket | None = None) -> int:
+    """
+    Copy the body of a streamed response to an open file.
+    The body is read into a single preallocated buffer that is reused for the whole transfer,
+    so a multi-GB file takes a few hundred writes instead of millions.
+    :param limiter: bandwidth limit in bytes per second, shared by all transfers
+    :return: bytes written
+    """
+    buffer = memoryview(bytearray(buffer_size))
+    raw = response.raw
+    raw.decode_content = True
+    written = 0
+    while n := raw.readinto(buffer):
+        f.write(buffer[:n])
+        written += n
+        if meter:
+            meter.update(n)
+        if limiter:
+            limiter.consume(n)
+    return written
+
+
+def part_path(target: Path) -> Path:
+    """The temporary file a download is written to until it is complete."""
+    return target.with_name(f'{target.name}.part')
+
+
+def progress_path(part: Path) -> Path:
+    """The sidecar file tracking the completed ranges of a segmented download."""
+    return part.with_name(f'{part.name}.json')
+
+
+def file_md5(path: Path, block_size: int = 8 * 1024 ** 2) -> str:
+    md5 = hashlib.md5()  # checksum as provided by Vimeo, not for security
+    with path.open('rb') as f:
+        while block := f.read(block_size):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def verify_part(part: Path, size: int | None = None, md5: str | None = None) -> None:
+    """Check a completed `.part` file against the expected size and MD5 checksum.
+    Incomplete files are kept to be resumed, corrupt files are deleted.
+    """
+    actual = part.stat().st_size
+    if size is not None and actual < size:
+        raise RuntimeError(f'Incomplete download {part.name}: {actual} of {size} bytes')
+    if size is not None and actual > size:
+        part.unlink()
+        raise RuntimeError(f'Corrupt download {part.name}: {actual} > {size} bytes, deleted')
+    if md5 and file_md5(part) != md5.lower():
+        part.unlink()
+        raise RuntimeError(f'Corrupt download {part.name}: checksum mismatch, deleted')
+
+
+def download_file(url: str, target: Path, size: int | None = None, md5: str | None = None,  # noqa: PLR0913
+                  timeout: int = 60, buffer_size: int = 8 * 1024 ** 2, limiter: TokenBucket | None = None) -> int:
+    """
+    Resumable download of `url` to `target`.
+    Data is written to a `.part` file that is resumed via a range request if it exists.
+    The `.part` file is renamed to `target` once it is verified.
+    :param url: the download link
+    :param target: path of the final file
+    :param size: expected file size in bytes, if known
+    :param md5: expected MD5 checksum, if known
+    :param timeout: connect/read timeout in seconds
+    :param buffer_size: read buffer size in bytes
+    :param limiter: bandwidth limit in bytes per second, shared by all transfers
+    :return: bytes transferred by this call
+    """
+    part = part_path(target)
+    part.parent.mkdir(parents=True, exist_ok=True)
+    progress_file = progress_path(part)
+    if progress_file.exists():
+        # preallocated by a segmented download, its size says nothing about the data written
+        part.unlink(missing_ok=True)
+        progress_file.unlink()
+    offset = part.stat().st_size if part.exists() else 0
+    transferred = 0
+    if size is None or offset < size:
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 206 and response.headers.get(  # noqa: PLR2004
+                    'Content-Range', '').startswith(f'bytes {offset}-'):
+                mode = 'ab'
+                logger.info(f'Resuming {target.name} at {offset / 1024 ** 2:.0f} MB')
+            elif response.status_code == 200:  # noqa: PLR2004
+                # no resume possible, start from scratch
+                mode = 'wb'
+            elif response.status_code == 416 and offset:  # noqa: PLR2004
+                # nothing left to download
+                mode = None
+            elif response.status_code in (403, 410):  # noqa: PLR2004
+                raise LinkExpiredError(f'Download link of {target.name} rejected: {response.status_code}')
+            else:
+                raise RuntimeError(f'Failed to download {target.name}: {response.status_code}')
+            if mode:
+                meter = ThroughputMeter(target.name)
+                with part.open(mode) as f:
+                    transferred = stream_to_file(response, f, buffer_size=buffer_size, meter=meter,
+                                                 limiter=limiter)
+                meter.done()
+    verify_part(part, size=size, md5=md5)
+    part.replace(target)
+    return transferred
+
+
+def byte_ranges(size: int, segments: int) -> list[tuple[int, int]]:
+    """Split `size` bytes into `segments` inclusive (start, end) ranges as used in HTTP range requests."""
+    step = -(-size // segments)
+    return [(start, min(start + step, size) - 1) for start in range(0, size, step)]
+
+
+def download_file_segmented(url: str, target: Path, size: int, md5: str | None = None,  # noqa: PLR0913
+                            segments: int = 4, timeout: int = 60, buffer_size: int = 8 * 1024 ** 2,
+                            limiter: TokenBucket | None = None) -> int:
+    """
+    Download `url` to `target` in `segments` byte ranges fetched in parallel.
+    The ranges are written at their offsets into a `.part` file preallocated to `size`.
+    Completed ranges are tracked in a `.part.json` sidecar file, so an interrupted download only fetches
+    the missing ranges on the next run.
+    The `.part` file is renamed to `target` once it is verified.
+    :return: bytes transferred by this call
+    """
+    part = part_path(target)
+    progress_file = progress_path(part)
+    if part.exists() and not progress_file.exists():
+        # left over from a single stream download, resume that instead
+        return download_file(url, target, size=size, md5=md5, timeout=timeout, buffer_size=buffer_size,
+                             limiter=limiter)
+
+    ranges = byte_ranges(size, segments)
+    done: set[int] = set()
+    if progress_file.exists():
+        progress = json.loads(progress_file.read_text())
+        if progress['ranges'] == [list(r) for r in ranges]:
+            done = set(progress['done'])
+    if not done:
+        part.parent.mkdir(parents=True, exist_ok=True)
+        # mark the file as segmented before preallocating it, so it is never resumed as a single stream
+        progress_file.write_text(json.dumps({'ranges': ranges, 'done': []}))
+        with part.open('wb') as f:
+            f.truncate(size)
+    lock = threading.Lock()
+    meter = ThroughputMeter(target.name)
+
+    def fetch(idx: int) -> int:
+        start, end = ranges[idx]
+        headers = {'Range': f'bytes={start}-{end}'}
+        with requests.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code in (403, 410):  # noqa: PLR2004
+                raise LinkExpiredError(f'Download link of {target.name} rejected: {response.status_code}')
+            if response.status_code != 206 or not response.headers.get(  # noqa: PLR2004
+                    'Content-Range', '').startswith(f'bytes {start}-{end}/'):
+                raise RuntimeError(f'Range request failed for {target.name}: {response.status_code}')
+            with part.open('r+b') as f:
+                f.seek(start)
+                written = stream_to_file(response, f, buffer_size=buffer_size, meter=meter, limiter=limiter)
+        if written != end - start + 1:
+            raise RuntimeError(f'Incomplete range {start}-{end} of {target.name}: {written} bytes')
+        with lock:
+            done.add(idx)
+            progress_file.write_text(json.dumps({'ranges': ranges, 'done': sorted(done)}))
+        return written
+
+    todo = [idx for idx in range(len(ranges)) if idx not in done]
+    with ThreadPoolExecutor(max_workers=segments, thread_name_prefix=f'{target.stem[:6]}-range') as pool:
+        # let all ranges finish even if one fails, so a retry only fetches the failed ones
+        futures = [pool.submit(fetch, idx) for idx in todo]
+        transferred = sum(future.result() for future in futures)
+    meter.done()
+    verify_part(part, size=size, md5=md5)
+    part.replace(target)
+    progress_file.unlink()
+    return transferred
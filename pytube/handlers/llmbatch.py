@@ -0,0 +1,170 @@
+"""
+Bulk generation with the OpenAI Batch API.
+
+All pending requests are written to one JSONL file in the batch input format, uploaded and processed by OpenAI
+within 24 hours at a lower price. The results are downloaded as JSONL and ingested later, see
+`Records.prepare_description_batch`, `submit_description_batch` and `ingest_description_batch`.
+
+`run_locally` is a stand-in for the API that answers the requests of the input file with any function.
+"""
+import json
+from collections.abc import Callable, Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+
+from openai import OpenAI
+
+from pytube import conf, logger
+
+
+class BatchJob:
+    """
+    A batch of chat completions in a working directory: `requests.jsonl` (input), `results.jsonl` (output),
+    `batch.json` with the state of the job and `ingested.txt` with the custom IDs of the results ingested so far.
+    """
+    endpoint = '/v1/chat/completions'
+
+    def __init__(self, directory: Path | None = None):
+        """:param directory: the working directory, defaults to `llm_batch` in the work dir"""
+        self.directory = directory or conf.dirs.work_dir / 'llm_batch'
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.requests_path = self.directory / 'requests.jsonl'
+        self.results_path = self.directory / 'results.jsonl'
+        self.state_path = self.directory / 'batch.json'
+        self.ingested_path = self.directory / 'ingested.txt'
+        self.state: dict = json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+
+    def save(self) -> None:
+        tmp = self.state_path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.state, indent=4))
+        tmp.replace(self.state_path)
+
+    def pending(self) -> bool:
+        """A batch was submitted and its results are not downloaded or not all ingested yet"""
+        if not self.state.get('batch_id'):
+            return False
+        if not self.results_path.exists():
+            return True
+        ingested = self.ingested()
+        return any(text is not None and custom_id not in ingested for custom_id, text in self.results(log=False))
+
+    def write(self, requests: dict[str, dict], model: str, force: bool = False) -> int:
+        """
+        Start a new batch with the requests {custom ID: parameters of the chat completion}.
+        :param force: replace a submitted batch whose results are not ingested yet, they are lost
+        :return: number of requests
+        """
+        if self.pending() and not force:
+            raise RuntimeError(f'Batch {self.state["batch_id"]} in {self.directory} is not ingested yet, '
+                               'ingest its results first or use force=True')
+        with self.requests_path.open('w') as f:
+            for custom_id, body in requests.items():
+                line = {'custom_id': custom_id, 'method': 'POST', 'url': self.endpoint, 'body': {'model': model, **body}}
+                f.write(json.dumps(line) + '\n')
+        self.results_path.unlink(missing_ok=True)
+        self.ingested_path.unlink(missing_ok=True)
+        self.state = {'created_at': datetime.now(UTC).isoformat(), 'requests': len(requests)}
+        self.save()
+        logger.info(f'Wrote {len(requests)} requests to {self.requests_path}')
+        return len(requests)
+
+    def submit(self, client: OpenAI) -> str:
+        """Upload the requests and create the batch, a batch is only submitted once.
+        :return: the batch ID
+        """
+        if batch_id := self.state.get('batch_id'):
+            logger.info(f'Batch {batch_id} already submitted')
+            return batch_id
+        with self.requests_path.open('rb') as f:
+            input_file = client.files.create(file=f, purpose='batch')
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=self.endpoint, completion_window='24h')
+        self.state.update(batch_id=batch.id, input_file_id=input_file.id, status=batch.status)
+        self.save()
+        logger.info(f'Submitted batch {batch.id} with {self.state.get("requests")} requests')
+        return batch.id
+
+    def download(self, client: OpenAI) -> bool:
+        """Check the batch and download the results once it is completed.
+        :return: True if results are available
+        """
+        if self.results_path.exists():
+            return True
+        if not self.state.get('batch_id'):
+            raise RuntimeError(f'No batch submitted in {self.directory}, submit the requests first')
+        batch = client.batches.retrieve(self.state['batch_id'])
+        self.state['status'] = batch.status
+        self.save()
+        if batch.status != 'completed':
+            logger.info(f'Batch {batch.id} is {batch.status}')
+            return False
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.append(client.files.content(file_id).text.rstrip('\n'))
+        # written at once, a partial download is never taken for the results
+        tmp = self.results_path.with_suffix('.tmp')
+        tmp.write_text('\n'.join(line for line in lines if line) + '\n')
+        tmp.replace(self.results_path)
+        return True
+
+    def requests(self) -> Iterator[dict]:
+        with self.requests_path.open() as f:
+            for line in f:
+                yield json.loads(line)
+
+    def results(self, log: bool = True) -> Iterator[tuple[str, str | None]]:
+        """(custom ID, response text) of the results, the text is None for failed requests
+        :param log: log the errors of failed requests
+        """
+        with self.results_path.open() as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                response = result.get('response') or {}
+                if result.get('error') or response.get('status_code') != 200:  # noqa: PLR2004
+                    if log:
+                        logger.error(f'Request {result["custom_id"]} failed: {result.get("error") or response}')
+                    yield result['custom_id'], None
+                    continue
+                yield result['custom_id'], response['body']['choices'][0]['message']['content']
+
+    def ingested(self) -> set[str]:
+        if not self.ingested_path.exists():
+            return set()
+        return set(self.ingested_path.read_text().split())
+
+    def ingest(self, func: Callable[[str, str], None]) -> int:
+        """
+        Hand each result not ingested yet to `func(custom ID, text)`, progress is saved after each result.
+        Failed requests are not marked as ingested.
+        :return: number of results ingested
+        """
+        ingested = self.ingested()
+        count = 0
+        with self.ingested_path.open('a') as log:
+            for custom_id, text in self.results():
+                if custom_id in ingested or text is None:
+                    continue
+                func(custom_id, text)
+                log.write(f'{custom_id}\n')
+                log.flush()
+                ingested.add(custom_id)
+                count += 1
+        logger.info(f'Ingested {count} batch results, {len(ingested)} of {self.state.get("requests")} in total')
+        return count
+
+    def run_locally(self, func: Callable[[dict], str]) -> None:
+        """Stand-in for the Batch API: answer each request with `func(body)` and write the results file."""
+        with self.results_path.open('w') as f:
+            for i, request in enumerate(self.requests()):
+                result = {
+                    'id': f'batch_req_{i}',
+                    'custom_id': request['custom_id'],
+                    'response': {'status_code': 200, 'body': {'choices': [{'message': {
+                        'role': 'assistant', 'content': func(request['body'])}}]}},
+                    'error': None,
+                }
+                f.write(json.dumps(result) + '\n')
+        self.state.update(batch_id='local', status='completed')
+        self.save()
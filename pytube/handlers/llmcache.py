@@ -0,0 +1,74 @@
+"""
+Disk cache of LLM responses.
+
+A response is keyed by a hash of everything that determines it: model, messages (system prompt and input text),
+max_tokens and temperature. Re-runs with unchanged inputs, e.g. after a crash or `add_descriptions(replace=True)`,
+do not call the API again. The least recently used entries are evicted beyond a size limit.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from pytube import conf, logger
+
+
+def request_key(**params) -> str:
+    """Hash of the request parameters, independent of their order"""
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+
+class ResponseCache:
+    """Responses by request key in a SQLite file, with LRU eviction by total size."""
+
+    def __init__(self, path: Path | None = None, max_mb: float | None = None):
+        """
+        :param path: the database file, defaults to `llm_cache.sqlite` in the work dir
+        :param max_mb: evict the least recently used responses beyond this size, defaults to `openai.cache_max_mb`
+        """
+        self.path = path or conf.dirs.work_dir / 'llm_cache.sqlite'
+        self.max_bytes = (conf.openai.cache_max_mb if max_mb is None else max_mb) * 1024 ** 2
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, used_at REAL NOT NULL)""")
+            self._db.execute('CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)')
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> str | None:
+        with self._lock, self._db:
+            row = self._db.execute('SELECT response FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute('UPDATE responses SET used_at = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        size = len(response.encode())
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO responses (key, response, size, used_at) VALUES (?, ?, ?, ?)',
+                             (key, response, size, time.time()))
+            self._evict()
+
+    def _evict(self) -> None:
+        total = self._db.execute('SELECT coalesce(sum(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._db.execute('SELECT key, size FROM responses ORDER BY used_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute('DELETE FROM responses WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        logger.info(f'Evicted {evicted} cached LLM responses')
+
+    def clear(self) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM responses')
@@ -0,0 +1,157 @@
+"""
+Change set between two runs of `process_sheets`.
+
+Each run merges the talks added, removed or changed since the previous manifest into the pending changes of
+each stage in `manifest_changes.json`, so later stages (downloads, video metadata) can process the delta instead
+of the whole manifest. Changes stay pending until the stage acknowledges the talks it has processed, runs of
+`process_sheets` in between do not lose them.
+"""
+import json
+from collections.abc import Iterable
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pandas as pd
+from pydantic import BaseModel
+
+from pytube import conf, logger
+
+# the stages processing the manifest, each with its own pending changes
+STAGES = ('downloads', 'video_metadata')
+
+
+class ManifestChanges(BaseModel):
+    """pretalx IDs by kind of change"""
+    added: list[str] = []
+    removed: list[str] = []
+    changed: list[str] = []
+    created_at: str = ""
+
+    @property
+    def updated(self) -> set[str]:
+        """Talks to (re)process: added or changed"""
+        return {*self.added, *self.changed}
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed or self.changed)
+
+    def merge(self, newer: 'ManifestChanges') -> 'ManifestChanges':
+        """The pending changes followed by the `newer` ones, e.g. a talk added and removed again is dropped"""
+        kinds = {pretalx_id: 'added' for pretalx_id in self.added}
+        kinds |= {pretalx_id: 'removed' for pretalx_id in self.removed}
+        kinds |= {pretalx_id: 'changed' for pretalx_id in self.changed}
+        for pretalx_id in newer.added:
+            kinds[pretalx_id] = 'added'
+        for pretalx_id in newer.changed:
+            if kinds.get(pretalx_id) != 'added':
+                kinds[pretalx_id] = 'changed'
+        for pretalx_id in newer.removed:
+            if kinds.get(pretalx_id) == 'added':
+                # never processed, nothing to undo
+                del kinds[pretalx_id]
+            else:
+                kinds[pretalx_id] = 'removed'
+        return ManifestChanges(
+            **{kind: [pretalx_id for pretalx_id, k in kinds.items() if k == kind]
+               for kind in ('added', 'removed', 'changed')},
+            created_at=newer.created_at or self.created_at,
+        )
+
+    def without(self, processed: set[str]) -> 'ManifestChanges':
+        """The changes left after the `processed` talks, removed talks are not processed by any stage and dropped"""
+        return ManifestChanges(
+            added=[pretalx_id for pretalx_id in self.added if pretalx_id not in processed],
+            changed=[pretalx_id for pretalx_id in self.changed if pretalx_id not in processed],
+            created_at=self.created_at,
+        )
+
+    def log(self) -> None:
+        logger.info(f'Manifest changes: {len(self.added)} added, {len(self.removed)} removed, '
+                    f'{len(self.changed)} changed')
+
+
+def diff_manifest(previous: pd.DataFrame, current: pd.DataFrame,
+                  tracked: tuple[str, ...] = ('title', 'vimeo_link')) -> ManifestChanges:
+    """
+    Compare two manifests by pretalx ID.
+    :param previous: the manifest of the last run, may be empty
+    :param current: the new manifest
+    :param tracked: columns that mark a talk as changed
+    """
+    columns = ['pretalx_id', *tracked]
+    if previous.empty:
+        previous = pd.DataFrame(columns=columns)
+    # a talk listed twice is taken from its last row, as later rows overwrite earlier ones downstream
+    old = previous[columns].astype(str).drop_duplicates('pretalx_id', keep='last')
+    new = current[columns].astype(str).drop_duplicates('pretalx_id', keep='last')
+    merged = old.merge(new, on='pretalx_id', how='outer', suffixes=('_old', ''), indicator=True)
+    both = merged[merged['_merge'] == 'both']
+    changed = pd.Series(False, index=both.index)
+    for column in tracked:
+        changed |= both[f'{column}_old'] != both[column]
+    return ManifestChanges(
+        added=merged.loc[merged['_merge'] == 'right_only', 'pretalx_id'].tolist(),
+        removed=merged.loc[merged['_merge'] == 'left_only', 'pretalx_id'].tolist(),
+        changed=both.loc[changed, 'pretalx_id'].tolist(),
+        created_at=datetime.now(UTC).isoformat(),
+    )
+
+
+def changes_path() -> Path:
+    return conf.dirs.work_dir / 'manifest_changes.json'
+
+
+def load_pending() -> dict[str, ManifestChanges] | None:
+    """The pending changes by stage, None if no change set was recorded yet"""
+    path = changes_path()
+    if not path.exists():
+        return None
+    data = json.loads(path.read_text())
+    if 'added' in data:
+        # a single change set of an earlier version, pending for all stages
+        return {stage: ManifestChanges.model_validate(data) for stage in STAGES}
+    return {stage: ManifestChanges.model_validate(changes) for stage, changes in data.items()}
+
+
+def save_pending(pending: dict[str, ManifestChanges]) -> None:
+    path = changes_path()
+    tmp = path.with_suffix('.tmp')
+    tmp.write_text(json.dumps({stage: changes.model_dump() for stage, changes in pending.items()}, indent=4))
+    tmp.replace(path)
+
+
+def save_changes(changes: ManifestChanges) -> None:
+    """Merge the changes of a `process_sheets` run into the pending changes of each stage"""
+    pending = load_pending() or {}
+    save_pending({stage: pending.get(stage, ManifestChanges()).merge(changes) for stage in STAGES})
+
+
+def load_changes(stage: str) -> ManifestChanges | None:
+    """The changes not processed by a stage yet, None if unknown"""
+    pending = load_pending()
+    if pending is None:
+        return None
+    return pending.get(stage, ManifestChanges())
+
+
+def acknowledge(stage: str, processed: Iterable[str]) -> None:
+    """Mark talks as processed by a stage, they are no longer pending for it"""
+    pending = load_pending()
+    if pending is None:
+        return
+    pending[stage] = pending.get(stage, ManifestChanges()).without(set(processed))
+    save_pending(pending)
+
+
+def read_manifest(stage: str | None = None) -> list[dict]:
+    """
+    The talks in `manifest.json`.
+    :param stage: only talks added or changed and not acknowledged by this stage yet, see `acknowledge`;
+    all talks if None or no change set is available
+    """
+    manifest = json.loads((conf.dirs.work_dir / 'manifest.json').read_text())
+    if stage and (changes := load_changes(stage)) is not None:
+        updated = changes.updated
+        manifest = [talk for talk in manifest if talk['pretalx_id'] in updated]
+        logger.info(f'Processing {len(manifest)} added or changed talks of the manifest in {stage}')
+    return manifest
@@ -1,14 +1,84 @@
+import json
+import threading
+
+import openai
+from handlers.compaction import count_tokens
+from handlers.llmcache import ResponseCache, request_key
+from handlers.ratelimit import TokenBucket, backoff, parse_retry_after
 from openai import OpenAI
 
-from pytube import conf
+from pytube import conf, logger
 
 client = OpenAI(api_key=conf.openai.api_key)
 
+# shared by all threads generating texts, the limits of the OpenAI account per minute
+requests_limit = TokenBucket(conf.openai.requests_per_minute / 60, capacity=conf.openai.requests_per_minute)
+tokens_limit = TokenBucket(conf.openai.tokens_per_minute / 60, capacity=conf.openai.tokens_per_minute)
 
-def teaser_text(text, max_tokens=50, temperature=0.7):
-    """A call to watch with a super short teaser"""
+
+def retry_after(error: openai.APIStatusError) -> float | None:
+    return parse_retry_after(error.response.headers.get('retry-after'))
+
+
+def retryable(error: openai.APIError) -> bool:
+    """Rate limits, server errors and connection problems are worth a retry"""
+    return not isinstance(error, openai.APIStatusError) or error.status_code == 429 or error.status_code >= 500  # noqa: PLR2004
+
+
+MODEL = "gpt-3.5-turbo"  # Use GPT-4 or GPT-3.5-turbo
+
+_cache: ResponseCache | None = None
+_cache_lock = threading.Lock()
+
+
+def response_cache() -> ResponseCache:
+    """The cache of responses, opened on first use"""
+    global _cache  # noqa: PLW0603
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+
+@backoff(openai.APIError, retries=conf.openai.retries, retry_if=retryable,
+         retry_after=lambda e: retry_after(e) if isinstance(e, openai.APIStatusError) else None)
+def create(messages: list[dict], max_tokens: int, temperature: float, response_format: dict | None = None) -> str:
+    """A chat completion within the rate limits, retried with backoff on 429 and server errors"""
+    requests_limit.consume(1)
+    tokens_limit.consume(sum(count_tokens(m['content']) for m in messages) + max_tokens)
     response = client.chat.completions.create(
-        model="gpt-3.5-turbo",  # Use GPT-4 or GPT-3.5-turbo
+        model=MODEL,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        response_format=response_format or openai.NOT_GIVEN,
+    )
+    return response.choices[0].message.content
+
+
+def complete(messages: list[dict], max_tokens: int, temperature: float, use_cache: bool | None = None,
+             response_format: dict | None = None) -> str:
+    """
+    A chat completion, answered from the response cache if the same request was made before.
+    :param use_cache: False to bypass the cache, the new response is cached anyway; defaults to `openai.cache`
+    :param response_format: e.g. {"type": "json_object"} for a JSON response
+    """
+    use_cache = conf.openai.cache if use_cache is None else use_cache
+    params = {'model': MODEL, 'messages': messages, 'max_tokens': max_tokens, 'temperature': temperature}
+    if response_format:
+        params['response_format'] = response_format
+    key = request_key(**params)
+    if use_cache and (cached := response_cache().get(key)) is not None:
+        return cached
+    text = create(messages, max_tokens, temperature, response_format)
+    if text is not None:
+        response_cache().put(key, text)
+    return text
+
+
+def teaser_text(text, max_tokens=50, temperature=0.7, use_cache=None):
+    """A call to watch with a super short teaser"""
+    gtp_text = complete(
         messages=[
             {"role": "system",
              "content": conf.prompts.teaser},
@@ -16,22 +86,96 @@ def teaser_text(text, max_tokens=50, temperature=0.7):
         ],
         max_tokens=max_tokens,
         temperature=temperature,
+        use_cache=use_cache,
     )
-    gtp_text = response.choices[0].message.content
     return gtp_text
 
 
-def sized_text(text, max_tokens=100, temperature=0.9):
-    response = client.chat.completions.create(
-        model="gpt-3.5-turbo",  # Use GPT-4 or GPT-3.5-turbo
+def sized_text(text, max_tokens=100, temperature=0.9, use_cache=None):
+    gtp_text = complete(
         messages=[
             {"role": "system",
-             "content": conf.prompts.description.format({"max_tokens": max_tokens})
+             "content": conf.prompts.description.format(max_tokens=max_tokens)
              },
             {"role": "user", "content": text},
         ],
         max_tokens=max_tokens,
         temperature=temperature,
+        use_cache=use_cache,
     )
-    gtp_text = response.choices[0].message.content
     return gtp_text
+
+
+# the texts of `descriptions`: (prompt, default max_tokens, temperature)
+TEXTS = {
+    'teaser': (lambda _: conf.prompts.teaser, 50, 0.7),
+    'short': (lambda max_tokens: conf.prompts.description.format(max_tokens=max_tokens), 100, 0.9),
+    'long': (lambda max_tokens: conf.prompts.description.format(max_tokens=max_tokens), 300, 0.9),
+}
+# a generated text may exceed its token budget by this factor, longer texts are requested again separately
+LENGTH_TOLERANCE = 1.3
+
+
+def valid_text(text, max_tokens: int) -> bool:
+    return isinstance(text, str) and bool(text.strip()) and count_tokens(text) <= max_tokens * LENGTH_TOLERANCE
+
+
+def text_request(name: str, text: str, max_tokens: int | None = None) -> dict:
+    """The parameters of `complete` for a single text of `TEXTS`"""
+    prompt, default, temperature = TEXTS[name]
+    max_tokens = max_tokens or default
+    return {
+        'messages': [
+            {"role": "system", "content": prompt(max_tokens)},
+            {"role": "user", "content": text},
+        ],
+        'max_tokens': max_tokens,
+        'temperature': temperature,
+    }
+
+
+def descriptions_request(text: str, max_tokens: dict[str, int]) -> dict:
+    """The parameters of `complete` for several texts of `TEXTS` in one JSON response"""
+    instructions = '\n'.join(f'"{name}": {TEXTS[name][0](tokens).strip()}' for name, tokens in max_tokens.items())
+    system = (f"Answer with a JSON object with the keys {', '.join(max_tokens)}. "
+              f"The value of each key is a text written according to these instructions:\n{instructions}")
+    return {
+        'messages': [
+            {"role": "system", "content": system},
+            {"role": "user", "content": text},
+        ],
+        # the texts plus some JSON syntax
+        'max_tokens': int(sum(max_tokens.values()) * LENGTH_TOLERANCE) + 50,
+        'temperature': 0.8,
+        'response_format': {"type": "json_object"},
+    }
+
+
+def parse_descriptions(content: str | None, max_tokens: dict[str, int]) -> dict[str, str]:
+    """The valid texts of a `descriptions_request` response, invalid or missing ones are left out"""
+    try:
+        response = json.loads(content or '{}')
+    except json.JSONDecodeError as e:
+        logger.warning(f'Invalid JSON response: {e}')
+        return {}
+    if not isinstance(response, dict):
+        return {}
+    return {name: response[name].strip() for name, tokens in max_tokens.items()
+            if valid_text(response.get(name), tokens)}
+
+
+def descriptions(text, max_tokens: dict[str, int] | None = None, use_cache=None) -> dict[str, str]:
+    """
+    Teaser, short and long text in a single request with a JSON response, the input is sent only once.
+    Texts missing in the response or not within their length are requested again one by one.
+    :param text: the information about the talk
+    :param max_tokens: {text: max_tokens} of the texts to generate, keys from `TEXTS`, default all texts
+    :return: {text: generated text}
+    """
+    max_tokens = max_tokens or {name: default for name, (_, default, _) in TEXTS.items()}
+    texts = parse_descriptions(complete(**descriptions_request(text, max_tokens), use_cache=use_cache), max_tokens)
+    for name, tokens in max_tokens.items():
+        if name not in texts:
+            logger.info(f'Requesting the {name} text separately')
+            texts[name] = complete(**text_request(name, text, tokens), use_cache=use_cache)
+    return texts
@@ -2,10 +2,10 @@ import datetime
 import json
 import random
 from collections import defaultdict
-from collections.abc import Mapping
 from pathlib import Path
 
 from handlers import LinkedInPost
+from handlers.store import get_store
 from handlers.youtube import YT, PrepareVideoMetadata
 from models.sessions import SessionRecord
 from models.video import YoutubeVideoResource
@@ -30,6 +30,7 @@ class Publisher:
         self.pretalx_youtube_id_map = self.video_meta.pretalx_youtube_id_map
         self.pretalx_youtube_channel_map = self.video_meta.pretalx_youtube_channel_map
         self.youtube_pretalx_id_map = {v: k for k, v in self.pretalx_youtube_id_map.items()}
+        self.store = get_store()
 
         self.linked_in_to_post = conf.dirs.work_dir / 'linked_in_to_post'
         self.linked_in_to_post.mkdir(exist_ok=True, parents=True)
@@ -70,7 +71,7 @@ class Publisher:
             body=body
         )
         try:
-            response = request.execute()
+            response = self.youtube_client.quota.execute(request, "videos.update")
             logger.info(f"Video successfully published: {video_id}")
             return response
         except Exception as e:
@@ -78,24 +79,25 @@ class Publisher:
             return
 
     @property
-    def unpublished_videos(self) -> Mapping:
-        """ Unpublished video records paths."""
-        return self.youtube_client.video_records_path_updated.glob("*.json")
+    def unpublished_videos(self) -> list[str]:
+        """ Unpublished video records pretalx IDs."""
+        return self.store.keys('video_records', state='video_records_updated')
 
     @property
     def all_unpublished_video_records(self) -> list[YoutubeVideoResource]:
         """ All unpublished video records."""
-        return [YoutubeVideoResource.model_validate_json(video.read_text()) for video in self.unpublished_videos]
+        return [YoutubeVideoResource.model_validate(data)
+                for _, data in self.store.items('video_records', state='video_records_updated')]
 
     @property
     def all_unpublished_video_ids(self) -> list[str]:
         """ All unpublished video IDs."""
-        return [video.stem for video in self.unpublished_videos]
+        return self.unpublished_videos
 
     @property
     def all_unpublished_videos(self) -> dict[str, str]:
         """ All unpublished videos pretalx_id: youtube_id."""
-        return {video.stem: self.pretalx_youtube_channel_map.get(video.stem) for video in self.unpublished_videos}
+        return {pretalx_id: self.pretalx_youtube_channel_map.get(pretalx_id) for pretalx_id in self.unpublished_videos}
 
     @property
     def all_unpublished_videos_by_channel(self) -> dict[str, list[str]]:
@@ -116,8 +118,7 @@ class Publisher:
             return
         pretalx_id = random.choice(population)
         video_id = self.pretalx_youtube_id_map.get(pretalx_id)
-        record_path = self.video_meta.records_path / f"{pretalx_id}.json"
-        record = SessionRecord.model_validate_json(record_path.read_text())
+        record = SessionRecord.model_validate(self.store.get('records', pretalx_id))
 
         res = self.release_on_youtube_now(video_id, record.youtube_title, record.youtube_description, "28")
 
@@ -125,10 +126,9 @@ class Publisher:
         logger.info(f"Video {pretalx_id} released on YouTube.")
 
         record.youtube_online_metadata = res
-        record_path.write_text(record.model_dump_json(indent=4))
+        self.store.put('records', pretalx_id, record.model_dump(mode='json'))
         logger.info(f"Updated record for video {pretalx_id}.")
-        (self.youtube_client.video_records_path_updated / f"{pretalx_id}.json").rename(
-            self.youtube_client.video_records_path_published / f"{pretalx_id}.json")
+        self.store.set_state('video_records', pretalx_id, 'video_published')
 
         self.prepare_linkedin_post(record)
         self.prepare_email_speakers(record)
@@ -219,14 +219,19 @@ class Publisher:
     @property
     def scheduled_videos(self) -> list[YoutubeVideoResource]:
         """ All videos with a publishing date set"""
-        all_unpublished_videos = self.all_unpublished_video_records
-        return [x for x in all_unpublished_videos if x.status.publish_at]
+        return [YoutubeVideoResource.model_validate(data)
+                for _, data in self.store.find('video_records', state='video_records_updated', scheduled=True)]
 
     @property
     def recently_released(self) -> list[YoutubeVideoResource]:
         """ Recently released videos."""
+        return self.due_videos()
+
+    def due_videos(self, channel: str | None = None) -> list[YoutubeVideoResource]:
+        """ Scheduled videos with a publishing date in the past, e.g. of the destination channel."""
         now = datetime.datetime.now(datetime.UTC)
-        return [x for x in self.scheduled_videos if x.status.publish_at < now]
+        found = self.store.find('video_records', state='video_records_updated', channel=channel, due_before=now)
+        return [YoutubeVideoResource.model_validate(data) for _, data in found]
 
     def process_recent_video_releases(self):
         """Confirm the release status of videos that should be published by now according to the video records.
@@ -247,12 +252,10 @@ class Publisher:
                 continue
             pretalx_id = self.youtube_pretalx_id_map[youtube_video_status["id"]]
             logger.info(f"Video {pretalx_id} is now public, preparing posts and emails.")
-            video_record_path = self.video_meta.video_records_path.parent / "video_records_updated" / f"{pretalx_id}.json"
-            video_record = YoutubeVideoResource.model_validate_json(video_record_path.read_text())
+            video_record = YoutubeVideoResource.model_validate(self.store.get('video_records', pretalx_id))
             video_record.status.privacy_status = youtube_video_status["status"]["privacyStatus"]
-            video_record_path.write_text(video_record.model_dump_json(indent=4))
-            record_path = self.video_meta.records_path / f"{pretalx_id}.json"
-            record = SessionRecord.model_validate_json(record_path.read_text())
+            self.store.put('video_records', pretalx_id, video_record.model_dump(mode='json'))
+            record = SessionRecord.model_validate(self.store.get('records', pretalx_id))
             self.prepare_linkedin_post(record)
             self.prepare_email_speakers(record)
-            video_record_path.rename(self.youtube_client.video_records_path_published / record_path.name)
+            self.store.set_state('video_records', pretalx_id, 'video_published')
@@ -0,0 +1,209 @@
+"""
+Accounting of the YouTube Data API quota.
+
+Every request costs units of the daily quota of the Google Cloud project, e.g. 100 for a `search().list` page,
+50 for a `videos().update` and 1 for other `list` calls. The quota resets at midnight Pacific Time.
+`QuotaLedger` checks the remaining units before a request and records its cost in an append-only JSON lines log
+per day and project, so consecutive runs on the same day share the budget.
+`QuotaScheduler` runs queued operations by priority within the remaining units and defers the rest.
+"""
+import heapq
+import json
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+from pytube import conf, logger
+
+# units per request, see https://developers.google.com/youtube/v3/determine_quota_cost
+COSTS = {
+    'search.list': 100,
+    'videos.list': 1,
+    'videos.update': 50,
+    'channels.list': 1,
+    'playlistItems.list': 1,
+    'playlistItems.insert': 50,
+    'playlistItems.delete': 50,
+}
+RESET_TIMEZONE = ZoneInfo('America/Los_Angeles')
+
+
+class QuotaExceededError(Exception):
+    """The request does not fit into the remaining quota of the day"""
+
+
+def quota_day(now: datetime | None = None) -> str:
+    """The quota day of a time, days start at midnight Pacific Time"""
+    return (now or datetime.now(UTC)).astimezone(RESET_TIMEZONE).date().isoformat()
+
+
+def next_reset(now: datetime | None = None) -> datetime:
+    """The next quota reset in UTC"""
+    local = (now or datetime.now(UTC)).astimezone(RESET_TIMEZONE)
+    midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), tzinfo=RESET_TIMEZONE)
+    return midnight.astimezone(UTC)
+
+
+class QuotaLedger:
+    """
+    Units used per project, day and method, e.g. {('my-project', '2025-04-24'): {'videos.update': 500}}.
+    Thread-safe, each charge is a single appended line.
+    """
+
+    def __init__(self, path: Path | None = None, project: str | None = None, daily_limit: int | None = None):
+        """
+        :param path: the log file, defaults to `youtube_quota.jsonl` in the work dir
+        :param project: the Google Cloud project the quota belongs to, defaults to `youtube.project`
+        :param daily_limit: units per day, defaults to `youtube.daily_quota`
+        """
+        self.path = path or conf.dirs.work_dir / 'youtube_quota.jsonl'
+        self.project = project or conf.youtube.project
+        self.daily_limit = conf.youtube.daily_quota if daily_limit is None else daily_limit
+        self._usage: dict[tuple[str, str], dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+                usage = self._usage.setdefault((entry['project'], entry['day']), {})
+                usage[entry['method']] = usage.get(entry['method'], 0) + entry['units']
+
+    def usage(self, day: str | None = None) -> dict[str, int]:
+        """Units used per method on a day of this project, defaults to today"""
+        return dict(self._usage.get((self.project, day or quota_day()), {}))
+
+    def used(self, day: str | None = None) -> int:
+        return sum(self.usage(day).values())
+
+    def remaining(self) -> int:
+        return max(0, self.daily_limit - self.used())
+
+    def affordable(self, method: str) -> int:
+        """Number of requests of a method the remaining quota allows"""
+        return self.remaining() // COSTS[method]
+
+    def charge(self, method: str, count: int = 1, units: int | None = None) -> None:
+        """Record the cost of `count` requests, `units` overrides the cost per method"""
+        units = COSTS.get(method, 0) * count if units is None else units
+        day = quota_day()
+        line = json.dumps({'project': self.project, 'day': day, 'method': method, 'count': count, 'units': units,
+                           'at': datetime.now(UTC).isoformat()}) + '\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('a') as f:
+                f.write(line)
+            usage = self._usage.setdefault((self.project, day), {})
+            usage[method] = usage.get(method, 0) + units
+
+    def check(self, method: str, count: int = 1) -> None:
+        """:raises QuotaExceededError: if the requests do not fit into the remaining quota"""
+        if COSTS[method] * count > self.remaining():
+            raise QuotaExceededError(f'{count} {method} need {COSTS[method] * count} units, {self.remaining()} of '
+                                     f'{self.daily_limit} left until {next_reset().isoformat()}')
+
+    def exhausted(self) -> None:
+        """YouTube reported the quota as exceeded, e.g. used by another client of the project: nothing is left today"""
+        if remaining := self.remaining():
+            self.charge('quotaExceeded', units=remaining)
+
+    def execute(self, request, method: str):
+        """Execute an API request within the quota and record its cost, failed requests are charged too."""
+        self.check(method)
+        self.charge(method)
+        try:
+            return request.execute()
+        except Exception as e:
+            if 'quotaExceeded' in str(e):
+                self.exhausted()
+                raise QuotaExceededError(f'Quota of project {self.project} exceeded at YouTube: {e}') from e
+            raise
+
+
+_ledgers: dict[Path, QuotaLedger] = {}
+_ledgers_lock = threading.Lock()
+
+
+def quota_ledger() -> QuotaLedger:
+    """The ledger of the configured work dir, shared by all clients in the process so they see each other's usage"""
+    path = conf.dirs.work_dir / 'youtube_quota.jsonl'
+    with _ledgers_lock:
+        if path not in _ledgers:
+            _ledgers[path] = QuotaLedger(path)
+        return _ledgers[path]
+
+
+@dataclass(order=True)
+class Operation:
+    priority: int
+    seq: int
+    name: str = field(compare=False)
+    units: int = field(compare=False)
+    func: Callable[[], object] = field(compare=False)
+
+
+class QuotaScheduler:
+    """
+    Run queued operations, e.g. metadata updates, status checks or playlist syncs, by priority within the
+    remaining quota. Operations that do not fit stay queued for the next quota reset.
+    Lower priority values run first, operations of the same priority in the order they were added.
+    An operation stopped by `QuotaExceededError` is deferred and runs again, so it must be safe to repeat.
+    """
+
+    def __init__(self, ledger: QuotaLedger):
+        self.ledger = ledger
+        self._queue: list[Operation] = []
+        self._seq = 0
+
+    def add(self, name: str, units: int, func: Callable[[], object], priority: int = 0) -> None:
+        """
+        :param units: the estimated cost of the operation, it only runs if these units are left
+        """
+        heapq.heappush(self._queue, Operation(priority, self._seq, name, units, func))
+        self._seq += 1
+
+    def __len__(self):
+        return len(self._queue)
+
+    def run(self, wait: bool = False) -> list[str]:
+        """
+        Run all operations that fit into the remaining quota.
+        :param wait: sleep until the next quota reset and continue with the deferred operations
+        :return: names of the deferred operations
+        """
+        while True:
+            deferred = []
+            while self._queue:
+                operation = heapq.heappop(self._queue)
+                if operation.units > self.ledger.remaining():
+                    deferred.append(operation)
+                    continue
+                logger.info(f'Running {operation.name} ({operation.units} units)')
+                try:
+                    operation.func()
+                except QuotaExceededError as e:
+                    logger.warning(f'{operation.name} stopped: {e}')
+                    deferred.append(operation)
+                except Exception as e:
+                    logger.error(f'{operation.name} failed: {e}')
+            for operation in deferred:
+                heapq.heappush(self._queue, operation)
+            if not deferred:
+                return []
+            reset = next_reset()
+            logger.info(f'Deferred {len(deferred)} operations ({sum(o.units for o in deferred)} units) '
+                        f'until the quota reset at {reset.isoformat()}')
+            if not wait:
+                return [operation.name for operation in sorted(self._queue)]
+            time.sleep(max(0.0, (reset - datetime.now(UTC)).total_seconds()) + 60)
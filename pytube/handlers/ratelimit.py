@@ -0,0 +1,118 @@
+"""
+Rate limiting shared between worker threads and retries with exponential backoff.
+"""
+import functools
+import random
+import threading
+import time
+from collections.abc import Callable
+from email.utils import parsedate_to_datetime
+
+from pytube import logger
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, e.g. bytes per second for all download workers together.
+
+    Consumers may take more tokens than available, they wait until the debt is paid off.
+    This keeps large reads possible while the average rate stays at `rate`.
+    The rate can be changed at any time, a rate of `None` or 0 disables the limit.
+    """
+
+    def __init__(self, rate: float | None, capacity: float | None = None):
+        """
+        :param rate: tokens per second, None or 0 for no limit
+        :param capacity: maximum burst, defaults to one second worth of tokens
+        """
+        self._lock = threading.Lock()
+        self._capacity = capacity
+        self._rate: float | None = None
+        self._tokens = 0.0
+        self._updated = time.monotonic()
+        self.rate = rate
+
+    @property
+    def rate(self) -> float | None:
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate: float | None) -> None:
+        with self._lock:
+            self._refill()
+            self._rate = rate or None
+            self._tokens = min(self._tokens, self.capacity)
+
+    @property
+    def capacity(self) -> float:
+        if self._capacity is not None:
+            return self._capacity
+        return self._rate or 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if self._rate:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    def consume(self, tokens: float) -> float:
+        """Take `tokens`, blocks until they are available.
+        :return: seconds waited
+        """
+        with self._lock:
+            if not self._rate:
+                return 0.0
+            self._refill()
+            self._tokens -= tokens
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Seconds to wait according to a Retry-After header, given in seconds or as HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0, retry_after: float | None = None) -> float:
+    """Exponential backoff with full jitter, but never shorter than the server asked for."""
+    return max(random.uniform(0, min(cap, base * 2 ** attempt)), retry_after or 0.0)
+
+
+def backoff(retry_on: type[Exception] | tuple[type[Exception], ...], retries: int = 5, base: float = 1.0,  # noqa: PLR0913
+            cap: float = 60.0, retry_after: Callable[[Exception], float | None] | None = None,
+            retry_if: Callable[[Exception], bool] | None = None):
+    """
+    Decorator: retry on `retry_on` exceptions with jittered exponential backoff.
+    :param retries: retries after the first attempt
+    :param base: delay of the first retry in seconds (before jitter)
+    :param cap: maximum delay in seconds (before Retry-After)
+    :param retry_after: extracts the server's Retry-After in seconds from an exception
+    :param retry_if: only retry exceptions for which this returns True, e.g. 429 and 5xx
+    """
+    def decorator(func):
+        name = getattr(func, '__name__', repr(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(retries + 1):
+                try:
+                    return func(*args, **kwargs)
+                except retry_on as e:
+                    if attempt == retries or (retry_if and not retry_if(e)):
+                        raise
+                    delay = backoff_delay(attempt, base, cap, retry_after(e) if retry_after else None)
+                    logger.warning(f'{name} failed ({e}), retry {attempt + 1}/{retries} in {delay:.1f}s')
+                    time.sleep(delay)
+        return wrapper
+    return decorator
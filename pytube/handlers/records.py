@@ -6,18 +6,72 @@ This file can be used for multiple use cases like:
 - Create posts on Social Media
 - etc.
 """
+import hashlib
 import json
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import suppress
 from pathlib import Path
+from typing import Any
 
-from handlers import sized_text, teaser_text
+from handlers import descriptions, sized_text, teaser_text
+from handlers.compaction import compact_info
+from handlers.llmbatch import BatchJob
+from handlers.nlpservice import (
+    MODEL,
+    client,
+    descriptions_request,
+    parse_descriptions,
+    text_request,
+)
+from handlers.store import get_store
 from httpx import QueryParams
 from models.sessions import Organization, PretalxSession, SessionRecord, SpeakerInfo
+from pydantic import BaseModel
 from pytanis import PretalxClient
 from pytanis.pretalx.types import Submission
 
 from pytube import conf, logger
 
+# (attribute, question ID, conversion of the answer)
+Setters = list[tuple[str, int, Callable[[Any], Any]]]
+
+
+def answer_index(answers: list[dict] | None) -> dict[int, Any]:
+    """ {question ID: answer} of the answers to custom questions in pretalx, the first answer per question counts"""
+    index = {}
+    for x in answers or []:
+        qid = x.get("question", {}).get("id", -1)
+        if qid in index:
+            continue
+        answer = x["answer"]
+        index[qid] = answer.strip() if isinstance(answer, str) else answer
+    return index
+
+
+def compile_qmap(qmap: dict[str, int] | None, model: type[BaseModel]) -> Setters:
+    """ The entries of the questions map that apply to `model`, with the conversion of the answer"""
+    converters = {'company': lambda answer: Organization(name=answer)}
+    return [(attr, qid, converters.get(attr, lambda answer: answer))
+            for attr, qid in (qmap or {}).items() if attr in model.model_fields]
+
+
+def enrich(obj: BaseModel, setters: Setters, answers: dict[int, Any]) -> BaseModel:
+    """ Set the attributes of `obj` from the answers to custom questions, invalid answers are ignored"""
+    for attr, qid, convert in setters:
+        answer = answers.get(qid)
+        if answer:
+            with suppress(Exception):
+                setattr(obj, attr, convert(answer))
+    return obj
+
+
+def source_hash(data: dict, speakers: list[dict], qmap: dict[str, int] | None) -> str:
+    """ Hash of everything a record is created from: the submission, its speakers and the questions map"""
+    source = json.dumps({'session': data, 'speakers': speakers, 'qmap': qmap or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(source.encode()).hexdigest()
+
 
 class Records:
     """
@@ -32,13 +86,17 @@ class Records:
      - etc.
 
      The first step is to load all confirmed sessions from pretalx and store them in a JSON file:
-     - load_all_confirmed_sessions(), load_all_speakers()
+     - load_all_confirmed_sessions(), load_all_speakers() or both concurrently with load_all()
      This information is also used by other scripts in this module, e.g., to organize the video recordings.
 
      Further steps are optional and can be executed in any order. These steps will add or change the metadata on file:
         - adding teaser, short and long texts
         - extracting LinkedIn, GitHub and X profile URLs
     """
+    confirmed_sessions_map_file = 'confirmed_sessions_map.json'
+    speakers_map_file = 'speaker_map.json'
+    # generated texts {name in `nlpservice.TEXTS`: (attribute, max_tokens)}
+    description_texts = {'teaser': ('sm_teaser_text', 50), 'short': ('sm_short_text', 100), 'long': ('sm_long_text', 300)}
 
     def __init__(self, qmap: dict[str, int] | None = None, *, reload=False):
         """
@@ -50,6 +108,12 @@ class Records:
         :param reload:
         """
         self.qmap: dict[str, int] | None = qmap
+        self.speaker_setters: Setters = compile_qmap(qmap, SpeakerInfo)
+        self.record_setters: Setters = compile_qmap(qmap, SessionRecord)
+        self._speaker_answers: dict[str, dict[int, Any]] = {}
+        # input tokens saved by compacting the session info, see `description_info`
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
         self.reload: bool = reload
         self.pretalx_client = PretalxClient()
         self._tracks_map: dict = {}
@@ -58,18 +122,32 @@ class Records:
 
         self.records: Path = conf.dirs.work_dir / 'records'
         self.records.mkdir(parents=True, exist_ok=True)
+        self.store = get_store()
+
+    def load_all(self) -> None:
+        """
+        Load confirmed sessions and speakers from pretalx at the same time.
+        Files are written on a thread pool and the maps are built from the loaded data in the same pass.
+        """
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='pretalx') as pool:
+            sessions = pool.submit(self.load_all_confirmed_sessions)
+            speakers = pool.submit(self.load_all_speakers)
+            sessions.result()
+            speakers.result()
 
     def load_all_confirmed_sessions(self) -> None:
         """ Load all confirmed talks from pretalx and store it into a single JSON file stored in `_tmp/pretalx`"""
         logger.info('Loading all confirmed sessions')
         the_dir = conf.dirs.work_dir / 'pretalx'
         the_dir.mkdir(parents=True, exist_ok=True)
-        if not self.reload and (conf.dirs.work_dir / 'confirmed_sessions_map.json').exists():
+        if not self.reload and (conf.dirs.work_dir / self.confirmed_sessions_map_file).exists():
             logger.info('Confirmed sessions already loaded, skipping')
             return
         subs_count, subs = self.pretalx_client.submissions(
             conf.pretalx.event_slug,
             params=QueryParams(**{'questions': 'all', 'state': 'confirmed'}))
+        # resolve the pagination in this thread
+        subs = list(subs)
         logger.info(f'Loaded {subs_count} confirmed sessions')
 
         logger.info('Writing confirmed sessions to disk')
@@ -77,10 +155,10 @@ class Records:
             logger.info('Reloading confirmed sessions, deleting all existing files')
             for x in the_dir.glob('*.json'):
                 x.unlink()
-        for sub in subs:
-            (the_dir / f'{sub.code}.json').write_text(sub.model_dump_json(indent=4))
+        self._confirmed_sessions_map = self.write_all(the_dir, subs)
         logger.info(f'Done: wrote {subs_count} confirmed sessions to disk')
-        self.create_confirmed_sessions_map()
+        self.write_map(self.confirmed_sessions_map_file, self._confirmed_sessions_map)
+        logger.info('Created confirmed sessions map')
 
     def load_all_speakers(self) -> None:
         """ Load all speakers from pretalx and store it into a single JSON file stored in `_tmp/pretalx_speakers`"""
@@ -93,62 +171,103 @@ class Records:
         subs_count, subs = self.pretalx_client.speakers(
             conf.pretalx.event_slug,
             params=QueryParams(**{'questions': 'all'}))
+        subs = list(subs)
         logger.info(f'Loaded {subs_count} speakers')
         logger.info('Writing speakers to disk')
         if self.reload:
             logger.info('Reloading speakers, deleting all existing files')
             for x in the_dir.glob('*.json'):
                 x.unlink()
-        for sub in subs:
-            (conf.dirs.work_dir / 'pretalx_speakers' / f'{sub.code}.json').write_text(sub.model_dump_json(indent=4))
+        self._speakers_map = self.write_all(the_dir, subs)
         logger.info(f'Done: wrote {subs_count} speakers to disk')
-        self.create_speaker_map()
+        self.write_map(self.speakers_map_file, self._speakers_map)
+        logger.info('Created confirmed speakers map')
+
+    @classmethod
+    def write_all(cls, the_dir: Path, items: list[BaseModel], max_workers: int = 8) -> dict[str, dict]:
+        """
+        Write one JSON file per pretalx submission or speaker on a thread pool.
+        :return: the map {code: data} as it is read back from the files
+        """
+        def write(item: BaseModel) -> tuple[str, dict]:
+            text = item.model_dump_json(indent=4)
+            (the_dir / f'{item.code}.json').write_text(text)
+            return item.code, json.loads(text)
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='records') as pool:
+            return dict(pool.map(write, items))
+
+    @classmethod
+    def write_map(cls, name: str, data: dict) -> None:
+        with (conf.dirs.work_dir / name).open('w') as f:
+            json.dump(data, f, indent=4)
+
+    @classmethod
+    def read_dir(cls, the_dir: Path) -> dict[str, dict]:
+        """ {code: data} of all JSON files in a directory"""
+        data_map = {}
+        for x in the_dir.glob('*.json'):
+            data = json.loads(x.read_text())
+            data_map[data['code']] = data
+        return data_map
 
     @classmethod
     def create_confirmed_sessions_map(cls) -> None:
         """ Create a mapping of all confirmed sessions form the data loaded via `load_all_confirmed_sessions`"""
-        the_dir = conf.dirs.work_dir / 'pretalx'
-        confirmed_map = {}
-        for x in the_dir.glob('*.json'):
-            data = json.load(x.open())
-            confirmed_map[data['code']] = data
+        confirmed_map = cls.read_dir(conf.dirs.work_dir / 'pretalx')
         if not confirmed_map:
             logger.error('No confirmed sessions found, did you run `load_all_confirmed_sessions`?')
-        json.dump(confirmed_map, (conf.dirs.work_dir / 'confirmed_map.json').open('w'), indent=4)
+        cls.write_map(cls.confirmed_sessions_map_file, confirmed_map)
         logger.info('Created confirmed sessions map')
 
     @classmethod
     def create_speaker_map(cls) -> None:
-        """ Create a mapping of all confirmed sessions form the data loaded via `load_all_confirmed_sessions`"""
-        the_dir = conf.dirs.work_dir / 'pretalx_speakers'
-        confirmed_map = {}
-        for x in the_dir.glob('*.json'):
-            data = json.load(x.open())
-            confirmed_map[data['code']] = data
-        if not confirmed_map:
+        """ Create a mapping of all speakers form the data loaded via `load_all_speakers`"""
+        speaker_map = cls.read_dir(conf.dirs.work_dir / 'pretalx_speakers')
+        if not speaker_map:
             logger.error('No speakers found, did you run `load_all_speakers`?')
-        json.dump(confirmed_map, (conf.dirs.work_dir / 'speaker_map.json').open('w'), indent=4)
+        cls.write_map(cls.speakers_map_file, speaker_map)
         logger.info('Created confirmed speakers map')
 
     @property
     def confirmed_sessions_map(self) -> dict:
         if not self._confirmed_sessions_map:
-            self._confirmed_sessions_map = json.load((conf.dirs.work_dir / 'confirmed_sessions_map.json').open())
+            self._confirmed_sessions_map = json.load((conf.dirs.work_dir / self.confirmed_sessions_map_file).open())
         return self._confirmed_sessions_map
 
     @property
     def speakers_map(self) -> dict:
         if not self._speakers_map:
-            self._speakers_map = json.load((conf.dirs.work_dir / 'speaker_map.json').open())
+            self._speakers_map = json.load((conf.dirs.work_dir / self.speakers_map_file).open())
         return self._speakers_map
 
-    def create_records(self) -> None:
-        """ Create records for all confirmed sessions"""
+    def speaker_answers(self, code: str) -> dict[int, Any]:
+        """ Answers of a speaker by question ID, indexed once as speakers may have multiple sessions"""
+        if code not in self._speaker_answers:
+            self._speaker_answers[code] = answer_index(self.speakers_map[code].get('answers'))
+        return self._speaker_answers[code]
+
+    def create_records(self, force: bool = False) -> dict[str, int]:
+        """ Create records for all confirmed sessions, records of unchanged sessions are kept as they are.
+        :param force: recreate all records
+        :return: number of records by outcome: created, updated, skipped
+        """
+        counts = {'created': 0, 'updated': 0, 'skipped': 0}
         for code, data in self.confirmed_sessions_map.items():
-            self.create_record(code, data)
+            counts[self.create_record(code, data, force=force)] += 1
+        logger.info(f'Records: {counts["created"]} created, {counts["updated"]} updated, '
+                    f'{counts["skipped"]} unchanged and skipped')
+        return counts
 
-    def create_record(self, code: str, data: dict) -> None:
-        """ Create a record for a single session exclusively from pretalx data."""
+    def create_record(self, code: str, data: dict, force: bool = False) -> str:
+        """ Create a record for a single session exclusively from pretalx data.
+        The record is only rewritten if the pretalx data or the questions map changed since it was created.
+        :return: 'created', 'updated' or 'skipped'
+        """
+        digest = source_hash(data, [self.speakers_map[x['code']] for x in data['speakers']], self.qmap)
+        existing = self.store.get('records', code)
+        if existing and existing.get('source_hash') == digest and not force:
+            return 'skipped'
         p_session = PretalxSession(
             pretalx_id=data['code'],
             title=data['title'],
@@ -156,30 +275,10 @@ class Records:
             speakers=[x['code'] for x in data['speakers']]
         )
 
-        def get_answer_via_id(answers: list[dict], answer_id: int):
-            # answer_id is always > 0
-            rec: list[dict[str, str]] = [x for x in answers if x.get("question", {}).get("id", -1) == answer_id]
-            if rec:
-                answer = rec[0]["answer"]
-                if isinstance(answer, str):
-                    answer = answer.strip()
-                return answer
-
-        def add_attr(obj, qmap):
-            for attr, qid in qmap.items():
-                answer = get_answer_via_id(speaker['answers'], qid)
-                if answer:
-                    if attr == 'company':
-                        answer = Organization(name=answer)
-                    with suppress(Exception):
-                        setattr(obj, attr, answer)
-            return obj
-
         speakers = []
-        for speaker in [self.speakers_map[x] for x in p_session.speakers]:
-            s = SpeakerInfo.model_validate(speaker)
-            s = add_attr(s, self.qmap)
-            speakers.append(s)
+        for speaker_code in p_session.speakers:
+            s = SpeakerInfo.model_validate(self.speakers_map[speaker_code])
+            speakers.append(enrich(s, self.speaker_setters, self.speaker_answers(speaker_code)))
 
         record = SessionRecord(
             pretalx_session=p_session,
@@ -192,27 +291,115 @@ class Records:
             sm_teaser_text='',
             sm_short_text='',
             sm_long_text='',
+            source_hash=digest,
         )
-        add_attr(record, self.qmap)
-        (self.records / f'{code}.json').write_text(record.model_dump_json(indent=4))
-
-    def add_descriptions(self, replace=False) -> None:
-        """ Add descriptions to all confirmed sessions """
-        for x in self.records.glob('*.json'):
-            try:
-                data = SessionRecord.model_validate_json(x.read_text())
-            except Exception as e:
-                jdata = json.load(x.open())
-                logger.error(f'Error adding descriptions to {jdata["pretalx_id"]}: {e}')
-                return
-            # noinspection PyUnresolvedReferences
-            speakers = '\n'.join([f"{x.name} ({x.job}\nbiography:\n{x.biography})" for x in data.speakers])
-            info = f"title:{data.title}\nspeaker(s):\n{speakers}\ndescription:\n{data.abstract}\n{data.description}"
-            if not data.sm_teaser_text or replace:
-                data.sm_teaser_text = teaser_text(info, max_tokens=50)
-            if not data.sm_short_text or replace:
-                data.sm_short_text = sized_text(info, max_tokens=100)
-            if not data.sm_long_text or replace:
-                data.sm_long_text = sized_text(info, max_tokens=300)
-            (self.records / f'{data.pretalx_id}.json').write_text(data.model_dump_json(indent=4))
-            logger.info(f'Added descriptions to {data.pretalx_id}')
+        enrich(record, self.record_setters, answer_index(data.get('answers')))
+        self.store.put('records', code, record.model_dump(mode='json'))
+        return 'updated' if existing else 'created'
+
+    def add_descriptions(self, replace=False, max_workers: int | None = None, use_cache: bool | None = None) -> None:
+        """ Add descriptions to all confirmed sessions.
+        Records are generated in parallel within the rate limits of `nlpservice` and saved as each completes.
+        :param replace: regenerate existing texts, unchanged inputs are answered from the response cache
+        :param max_workers: records generated at the same time, defaults to `openai.max_workers`
+        :param use_cache: False to request new texts even for unchanged inputs, defaults to `openai.cache`
+        """
+        with ThreadPoolExecutor(max_workers=max_workers or conf.openai.max_workers,
+                                thread_name_prefix='descriptions') as pool:
+            futures = {pool.submit(self.add_description, code, record, replace, use_cache): code
+                       for code, record in self.store.items('records')}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'Error adding descriptions to {futures[future]}: {e}')
+        self.log_tokens_saved()
+
+    def log_tokens_saved(self) -> None:
+        with self._lock:
+            saved, self.tokens_saved = self.tokens_saved, 0
+        logger.info(f'Compaction saved about {saved} input tokens')
+
+    def add_description(self, code: str, record: dict, replace=False, use_cache: bool | None = None) -> None:
+        """ Generate the missing texts of a record and save it"""
+        data = SessionRecord.model_validate(record)
+        missing = self.missing_texts(data, replace)
+        if not missing:
+            logger.debug(f'{code} has all descriptions')
+            return
+        if conf.openai.single_call:
+            info = self.description_info(data, missing)
+            for name, text in descriptions(info, max_tokens=missing, use_cache=use_cache).items():
+                setattr(data, self.description_texts[name][0], text)
+        else:
+            for name, tokens in missing.items():
+                generate = teaser_text if name == 'teaser' else sized_text
+                text = generate(self.description_info(data, [name]), max_tokens=tokens, use_cache=use_cache)
+                setattr(data, self.description_texts[name][0], text)
+        self.store.put('records', code, data.model_dump(mode='json'))
+        logger.info(f'Added descriptions to {code}')
+
+    def description_info(self, data: SessionRecord, texts: Iterable[str] = ()) -> str:
+        """ The information about a session the texts are generated from.
+        :param texts: the texts generated from it, the information is compacted to the largest input budget
+        of these texts in `openai.input_budget`
+        """
+        budgets = [conf.openai.input_budget.get(name, 0) for name in texts]
+        budget = 0 if not budgets or 0 in budgets else max(budgets)
+        # noinspection PyUnresolvedReferences
+        info, saved = compact_info(data.title, [(x.name, x.job, x.biography) for x in data.speakers],
+                                   data.abstract, data.description, budget=budget)
+        with self._lock:
+            self.tokens_saved += saved
+        return info
+
+    @classmethod
+    def missing_texts(cls, data: SessionRecord, replace=False) -> dict[str, int]:
+        """ {text: max_tokens} of the texts to generate for a record"""
+        return {name: tokens for name, (attr, tokens) in cls.description_texts.items()
+                if not getattr(data, attr) or replace}
+
+    def prepare_description_batch(self, replace=False, job: BatchJob | None = None, force=False) -> BatchJob:
+        """ Write the requests for all missing texts into a new batch job file, see `llmbatch`
+        :param force: replace a submitted batch that is not ingested yet
+        """
+        job = job or BatchJob()
+        requests = {}
+        for code, record in self.store.items('records'):
+            data = SessionRecord.model_validate(record)
+            if not (missing := self.missing_texts(data, replace)):
+                continue
+            if conf.openai.single_call:
+                requests[f'{code}:descriptions'] = descriptions_request(self.description_info(data, missing), missing)
+            else:
+                for name, tokens in missing.items():
+                    requests[f'{code}:{name}'] = text_request(name, self.description_info(data, [name]), tokens)
+        job.write(requests, model=MODEL, force=force)
+        self.log_tokens_saved()
+        return job
+
+    @classmethod
+    def submit_description_batch(cls, job: BatchJob | None = None) -> str:
+        """ Upload the batch job file to OpenAI, results are available within 24 hours"""
+        return (job or BatchJob()).submit(client)
+
+    def ingest_description_batch(self, job: BatchJob | None = None) -> int:
+        """ Add the texts of a completed batch to the records, can be run repeatedly and resumed after a crash
+        :return: number of results ingested, 0 if the batch is not completed yet
+        """
+        job = job or BatchJob()
+        if not job.download(client):
+            return 0
+
+        def ingest(custom_id: str, text: str) -> None:
+            code, name = custom_id.rsplit(':', 1)
+            data = SessionRecord.model_validate(self.store.get('records', code))
+            if name == 'descriptions':
+                texts = parse_descriptions(text, {name: tokens for name, (_, tokens) in self.description_texts.items()})
+            else:
+                texts = {name: text}
+            for text_name, value in texts.items():
+                setattr(data, self.description_texts[text_name][0], value)
+            self.store.put('records', code, data.model_dump(mode='json'))
+
+        return job.ingest(ingest)
@@ -0,0 +1,87 @@
+"""
+Local cache of the Google Sheets with the video links.
+
+All worksheets are stored in a single Parquet file and loaded back with one read.
+Fetch time and source revision (Drive modifiedTime) are kept per spreadsheet to refresh only stale ones.
+"""
+import json
+import threading
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+from pytube import conf, logger
+
+
+class SheetCache:
+    """
+    Worksheets by (worksheet name, room), as used by `load_sheets`.
+    Columns are stored by position and renamed on load, worksheets may have different headers.
+    """
+
+    def __init__(self, path: Path | None = None, max_age: timedelta | None = None):
+        """
+        :param path: the Parquet file, metadata is stored next to it as JSON
+        :param max_age: sheets fetched more recently are fresh without asking Google for changes
+        """
+        self.path = path or conf.dirs.work_dir / 'sheets/sheets.parquet'
+        self.meta_path = self.path.with_suffix('.json')
+        self.max_age = max_age if max_age is not None else timedelta(minutes=conf.spreadsheets.max_age_minutes)
+        self.meta: dict[str, dict] = {}
+        self.sheets: dict[tuple[str, str], pd.DataFrame] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        if not (self.path.exists() and self.meta_path.exists()):
+            return
+        self.meta = json.loads(self.meta_path.read_text())
+        data = pd.read_parquet(self.path)
+        for (day, room), df in data.groupby(['_day', '_room'], sort=False):
+            columns = self.meta.get(room, {}).get('columns', {}).get(day)
+            if columns is None:
+                continue
+            df = df.drop(columns=['_day', '_room']).iloc[:, :len(columns)]  # noqa: PLW2901
+            df.columns = columns
+            self.sheets[(day, room)] = df.reset_index(drop=True)
+
+    def save(self) -> None:
+        with self._lock:
+            frames = []
+            for (day, room), df in self.sheets.items():
+                frame = df.copy()
+                frame.columns = [f'c{i}' for i in range(len(df.columns))]
+                frames.append(frame.astype('string').assign(_day=day, _room=room))
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            if frames:
+                pd.concat(frames, ignore_index=True).to_parquet(self.path, index=False)
+            self.meta_path.write_text(json.dumps(self.meta, indent=4))
+
+    def is_fresh(self, room: str, days: list[str], modified_time: str | None = None) -> bool:
+        """
+        :param room: the spreadsheet
+        :param days: the worksheets required
+        :param modified_time: the current revision at the source, if known
+        """
+        meta = self.meta.get(room)
+        if not meta or any((day, room) not in self.sheets for day in days):
+            return False
+        if modified_time is not None:
+            return modified_time == meta.get('modified_time')
+        return datetime.now(UTC) - datetime.fromisoformat(meta['fetched_at']) < self.max_age
+
+    def touch(self, room: str, modified_time: str | None = None) -> None:
+        """The spreadsheet did not change at the source."""
+        with self._lock:
+            self.meta[room].update(fetched_at=datetime.now(UTC).isoformat(), modified_time=modified_time)
+        logger.info(f'{room} unchanged since {modified_time}')
+
+    def update(self, room: str, sheets: dict[str, pd.DataFrame], modified_time: str | None = None) -> None:
+        """Store freshly fetched worksheets {worksheet name: data} of a spreadsheet."""
+        with self._lock:
+            meta = self.meta.setdefault(room, {'columns': {}})
+            meta.update(fetched_at=datetime.now(UTC).isoformat(), modified_time=modified_time)
+            for day, df in sheets.items():
+                meta['columns'][day] = [str(c) for c in df.columns]
+                self.sheets[(day, room)] = df
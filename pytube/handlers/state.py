@@ -0,0 +1,91 @@
+"""
+Processing state of the recordings, shared by the download and organizer scripts.
+
+The state is kept as an append-only JSON lines log that is replayed into a dict on load.
+Lookups are O(1), each update is a single appended line and safe to write from multiple threads.
+"""
+import json
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+
+from pytube import conf, logger
+
+
+class ProcessedState:
+    """
+    Track which recordings have been downloaded, verified and copied to their upload channel.
+    States are stored per pretalx ID as {state: {"at": timestamp, **info}}.
+    """
+    states = ('downloaded', 'verified', 'copied')
+
+    def __init__(self, path: Path | None = None):
+        """
+        :param path: the log file, defaults to `downloads/state.jsonl` in the video dir.
+        A `processed.txt` next to it (the previous format) is imported as 'copied' on first use.
+        """
+        self.path = path or conf.dirs.video_dir / 'downloads/state.jsonl'
+        self._state: dict[str, dict[str, dict]] = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self) -> None:
+        legacy = self.path.parent / 'processed.txt'
+        if not self.path.exists() and legacy.exists():
+            logger.info(f'Importing {legacy.name} into {self.path.name}')
+            for pretalx_id in legacy.read_text().splitlines():
+                if pretalx_id.strip():
+                    self.mark(pretalx_id.strip(), 'copied')
+            return
+        if not self.path.exists():
+            return
+        with self.path.open() as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash, the state change is simply lost
+                    continue
+                if 'cleared' in entry:
+                    for state in entry['cleared']:
+                        self._state.get(entry['pretalx_id'], {}).pop(state, None)
+                    continue
+                self._state.setdefault(entry.pop('pretalx_id'), {})[entry.pop('state')] = entry
+
+    def mark(self, pretalx_id: str, state: str, **info) -> None:
+        """Record a state change, `info` must be JSON serializable."""
+        if state not in self.states:
+            raise ValueError(f'Unknown state {state}, must be one of {self.states}')
+        entry = {'at': datetime.now(UTC).isoformat(), **info}
+        line = json.dumps({'pretalx_id': pretalx_id, 'state': state, **entry}) + '\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # a single write in append mode, lines of concurrent writers do not interleave
+            with self.path.open('a') as f:
+                f.write(line)
+            self._state.setdefault(pretalx_id, {})[state] = entry
+
+    def clear(self, pretalx_id: str, *states: str) -> None:
+        """Undo state changes, e.g. of a download that failed verification, so it is processed again."""
+        if unknown := set(states) - set(self.states):
+            raise ValueError(f'Unknown states {unknown}, must be one of {self.states}')
+        line = json.dumps({'pretalx_id': pretalx_id, 'cleared': list(states),
+                           'at': datetime.now(UTC).isoformat()}) + '\n'
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open('a') as f:
+                f.write(line)
+            for state in states:
+                self._state.get(pretalx_id, {}).pop(state, None)
+
+    def has(self, pretalx_id: str, state: str) -> bool:
+        return state in self._state.get(pretalx_id, {})
+
+    def get(self, pretalx_id: str) -> dict[str, dict]:
+        return self._state.get(pretalx_id, {})
+
+    def __contains__(self, pretalx_id: str) -> bool:
+        return pretalx_id in self._state
+
+    def __iter__(self):
+        return iter(list(self._state))
@@ -0,0 +1,312 @@
+"""
+Storage of the session and video records.
+
+`JsonDirStore` is the original layout, one `indent=4` JSON file per record and a directory per collection.
+`SqliteStore` keeps all records in one database with indexed columns for channel, YouTube ID, state and
+publishing date, so queries like "scheduled videos of a channel due now" do not scan and parse every file.
+Both export to and import from the JSON layout, see `migrate`.
+"""
+import json
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections.abc import Iterator
+from datetime import UTC, datetime
+from pathlib import Path
+
+from pytube import conf, logger
+
+# collection: (base dir in `conf.dirs`, directory)
+# the raw pretalx downloads in `pretalx` and `pretalx_speakers` are caches of the API and stay plain files
+COLLECTIONS = {
+    'records': ('work_dir', 'records'),
+    'video_records': ('video_dir', 'youtube'),
+}
+# video records move through these states, each is a directory in the JSON layout
+VIDEO_STATES = ('video_records', 'video_records_updated', 'video_published')
+
+
+def utc_iso(value: datetime | str | None) -> str | None:
+    """Normalize a datetime to a UTC ISO string, comparable as text"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.astimezone(UTC).isoformat()
+
+
+def index_values(collection: str, data: dict) -> dict[str, str | None]:
+    """The indexed fields of a record, `state` is set by the store"""
+    return {
+        'channel': data.get('youtube_channel') or None,
+        'youtube_id': data.get('youtube_video_id') or (data.get('id') if collection == 'video_records' else None),
+        'publish_at': utc_iso((data.get('status') or {}).get('publish_at')),
+    }
+
+
+class RecordStore(ABC):
+    """
+    Records by collection and pretalx ID, stored as JSON serializable dicts.
+    Video records have a state, one of `VIDEO_STATES`.
+    """
+
+    @abstractmethod
+    def get(self, collection: str, key: str) -> dict | None:
+        ...
+
+    @abstractmethod
+    def put(self, collection: str, key: str, data: dict, state: str | None = None, **index) -> None:
+        """
+        Insert or replace a record.
+        :param state: the state of a video record, unchanged if None
+        :param index: values of indexed fields not in the data, e.g. the `channel` of a video record
+        """
+
+    @abstractmethod
+    def delete(self, collection: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    def set_state(self, collection: str, key: str, state: str) -> None:
+        ...
+
+    @abstractmethod
+    def state(self, collection: str, key: str) -> str | None:
+        ...
+
+    @abstractmethod
+    def keys(self, collection: str, state: str | None = None) -> list[str]:
+        ...
+
+    @abstractmethod
+    def find(self, collection: str, *, channel: str | None = None, youtube_id: str | None = None,  # noqa: PLR0913
+             state: str | None = None, due_before: datetime | None = None,
+             scheduled: bool = False) -> list[tuple[str, dict]]:
+        """
+        Records matching all given conditions, ordered by publishing date.
+        :param due_before: publishing date before this time
+        :param scheduled: only records with a publishing date
+        :return: [(pretalx ID, data)]
+        """
+
+    def items(self, collection: str, state: str | None = None) -> Iterator[tuple[str, dict]]:
+        for key in self.keys(collection, state):
+            data = self.get(collection, key)
+            if data is not None:
+                yield key, data
+
+    def export_json(self, root: Path | None = None) -> None:
+        """Write all records in the JSON layout, below `root` instead of the configured dirs if given"""
+        target = JsonDirStore(root)
+        for collection in COLLECTIONS:
+            for key, data in self.items(collection):
+                target.put(collection, key, data, state=self.state(collection, key))
+
+
+def migrate(source: RecordStore, target: RecordStore) -> int:
+    """Copy all records, e.g. `migrate(JsonDirStore(), SqliteStore())`.
+    :return: number of records copied
+    """
+    count = 0
+    for collection in COLLECTIONS:
+        for key, data in source.items(collection):
+            index = {}
+            if collection == 'video_records' and 'youtube_channel' not in data:
+                # video records do not know their channel, the session record does
+                index['channel'] = (source.get('records', key) or {}).get('youtube_channel') or None
+            target.put(collection, key, data, state=source.state(collection, key), **index)
+            count += 1
+    logger.info(f'Migrated {count} records')
+    return count
+
+
+class JsonDirStore(RecordStore):
+    """One JSON file per record, the state of a video record is its directory. Queries scan all files."""
+
+    def __init__(self, root: Path | None = None):
+        """:param root: base directory of all collections, defaults to the configured `work_dir` and `video_dir`"""
+        self.root = root
+
+    def path(self, collection: str, state: str | None = None) -> Path:
+        base, name = COLLECTIONS[collection]
+        path = (self.root / name) if self.root else (conf.dirs[base] / name)
+        if collection == 'video_records':
+            return path / (state or VIDEO_STATES[0])
+        return path
+
+    def _file(self, collection: str, key: str) -> Path | None:
+        states = VIDEO_STATES if collection == 'video_records' else (None,)
+        for state in states:
+            file = self.path(collection, state) / f'{key}.json'
+            if file.exists():
+                return file
+        return None
+
+    def get(self, collection: str, key: str) -> dict | None:
+        file = self._file(collection, key)
+        return json.loads(file.read_text()) if file else None
+
+    def state(self, collection: str, key: str) -> str | None:
+        if collection != 'video_records':
+            return None
+        file = self._file(collection, key)
+        return file.parent.name if file else None
+
+    def put(self, collection: str, key: str, data: dict, state: str | None = None, **_) -> None:
+        existing = self._file(collection, key)
+        if collection == 'video_records':
+            state = state or (existing.parent.name if existing else VIDEO_STATES[0])
+        file = self.path(collection, state) / f'{key}.json'
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(json.dumps(data, indent=4, ensure_ascii=False))
+        if existing and existing != file:
+            existing.unlink()
+
+    def delete(self, collection: str, key: str) -> None:
+        if file := self._file(collection, key):
+            file.unlink()
+
+    def set_state(self, collection: str, key: str, state: str) -> None:
+        file = self._file(collection, key)
+        if file is None:
+            raise KeyError(f'{collection}/{key}')
+        target = self.path(collection, state)
+        target.mkdir(parents=True, exist_ok=True)
+        file.rename(target / file.name)
+
+    def keys(self, collection: str, state: str | None = None) -> list[str]:
+        if collection != 'video_records':
+            return sorted(x.stem for x in self.path(collection).glob('*.json'))
+        states = [state] if state else VIDEO_STATES
+        return sorted(x.stem for s in states for x in self.path(collection, s).glob('*.json'))
+
+    def find(self, collection: str, *, channel: str | None = None, youtube_id: str | None = None,  # noqa: PLR0913
+             state: str | None = None, due_before: datetime | None = None,
+             scheduled: bool = False) -> list[tuple[str, dict]]:
+        due = utc_iso(due_before)
+        found = []
+        for key, data in self.items(collection, state):
+            index = index_values(collection, data)
+            if channel and not index['channel'] and collection == 'video_records':
+                index['channel'] = (self.get('records', key) or {}).get('youtube_channel')
+            if ((channel and index['channel'] != channel) or (youtube_id and index['youtube_id'] != youtube_id)
+                    or ((scheduled or due) and not index['publish_at']) or (due and index['publish_at'] >= due)):
+                continue
+            found.append((index['publish_at'] or '', key, data))
+        return [(key, data) for _, key, data in sorted(found, key=lambda x: x[:2])]
+
+
+class SqliteStore(RecordStore):
+    """All records in a single SQLite database, indexed by channel, YouTube ID, state and publishing date."""
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS records (
+            collection TEXT NOT NULL,
+            key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            channel TEXT,
+            youtube_id TEXT,
+            state TEXT,
+            publish_at TEXT,
+            updated_at TEXT NOT NULL,
+            PRIMARY KEY (collection, key)
+        );
+        CREATE INDEX IF NOT EXISTS records_channel ON records (collection, channel, state, publish_at);
+        CREATE INDEX IF NOT EXISTS records_state ON records (collection, state, publish_at);
+        CREATE INDEX IF NOT EXISTS records_youtube_id ON records (youtube_id);
+    """
+
+    def __init__(self, path: Path | None = None):
+        """:param path: the database file, defaults to `records.sqlite` in the work dir"""
+        self.path = path or conf.dirs.work_dir / 'records.sqlite'
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # each write is its own transaction, committed or rolled back by `with self._db`
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(self.schema)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def get(self, collection: str, key: str) -> dict | None:
+        row = self._db.execute('SELECT data FROM records WHERE collection = ? AND key = ?',
+                               (collection, key)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def state(self, collection: str, key: str) -> str | None:
+        row = self._db.execute('SELECT state FROM records WHERE collection = ? AND key = ?',
+                               (collection, key)).fetchone()
+        return row[0] if row else None
+
+    def put(self, collection: str, key: str, data: dict, state: str | None = None, **index) -> None:
+        values = {**index_values(collection, data), **{k: v for k, v in index.items() if v is not None}}
+        if collection == 'video_records' and state is None:
+            state = self.state(collection, key) or VIDEO_STATES[0]
+        with self._lock, self._db:
+            # keep an indexed value set explicitly before, e.g. the channel of a video record
+            self._db.execute(
+                """INSERT INTO records (collection, key, data, channel, youtube_id, state, publish_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (collection, key) DO UPDATE SET
+                       data = excluded.data,
+                       channel = coalesce(excluded.channel, channel),
+                       youtube_id = coalesce(excluded.youtube_id, youtube_id),
+                       state = excluded.state,
+                       publish_at = excluded.publish_at,
+                       updated_at = excluded.updated_at""",
+                (collection, key, json.dumps(data), values['channel'], values['youtube_id'], state,
+                 values['publish_at'], datetime.now(UTC).isoformat()))
+
+    def delete(self, collection: str, key: str) -> None:
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM records WHERE collection = ? AND key = ?', (collection, key))
+
+    def set_state(self, collection: str, key: str, state: str) -> None:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                'UPDATE records SET state = ?, updated_at = ? WHERE collection = ? AND key = ?',
+                (state, datetime.now(UTC).isoformat(), collection, key))
+            if not cursor.rowcount:
+                raise KeyError(f'{collection}/{key}')
+
+    def keys(self, collection: str, state: str | None = None) -> list[str]:
+        if state:
+            rows = self._db.execute('SELECT key FROM records WHERE collection = ? AND state = ? ORDER BY key',
+                                    (collection, state))
+        else:
+            rows = self._db.execute('SELECT key FROM records WHERE collection = ? ORDER BY key', (collection,))
+        return [row[0] for row in rows]
+
+    def items(self, collection: str, state: str | None = None) -> Iterator[tuple[str, dict]]:
+        sql, params = 'SELECT key, data FROM records WHERE collection = ?', [collection]
+        if state:
+            sql, params = f'{sql} AND state = ?', [*params, state]
+        for key, data in self._db.execute(f'{sql} ORDER BY key', params).fetchall():
+            yield key, json.loads(data)
+
+    def find(self, collection: str, *, channel: str | None = None, youtube_id: str | None = None,  # noqa: PLR0913
+             state: str | None = None, due_before: datetime | None = None,
+             scheduled: bool = False) -> list[tuple[str, dict]]:
+        conditions, params = ['collection = ?'], [collection]
+        for column, value in (('channel', channel), ('youtube_id', youtube_id), ('state', state)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if scheduled or due_before:
+            conditions.append('publish_at IS NOT NULL')
+        if due_before:
+            conditions.append('publish_at < ?')
+            params.append(utc_iso(due_before))
+        rows = self._db.execute(
+            f'SELECT key, data FROM records WHERE {" AND ".join(conditions)} ORDER BY publish_at, key', params)
+        return [(key, json.loads(data)) for key, data in rows.fetchall()]
+
+
+def get_store() -> RecordStore:
+    """The backend configured in `records.backend`"""
+    if conf.records.backend == 'sqlite':
+        return SqliteStore()
+    return JsonDirStore()
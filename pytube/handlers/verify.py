@@ -0,0 +1,146 @@
+"""
+Integrity checks of downloaded and copied recordings before they go to YouTube.
+
+Files are hashed on a thread pool while downloads continue (hashlib releases the GIL for large blocks).
+Digests are kept in a sidecar manifest and reused as long as size and mtime of a file are unchanged.
+"""
+import json
+import threading
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from handlers.downloads import file_md5
+
+from pytube import conf, logger
+
+
+class IntegrityError(RuntimeError):
+    """A file does not match its expected size or checksum."""
+
+
+class Verifier:
+    """
+    Compute and check MD5 digests of recordings, the checksum Vimeo provides for its downloads.
+    """
+
+    def __init__(self, manifest: Path | None = None, max_workers: int = 2, block_size: int = 8 * 1024 ** 2):
+        """
+        :param manifest: the digest sidecar file, defaults to `digests.json` in the video dir
+        :param max_workers: number of files hashed in parallel
+        :param block_size: read size while hashing
+        """
+        self.manifest = manifest or conf.dirs.video_dir / 'digests.json'
+        self.block_size = block_size
+        self._digests: dict[str, dict] = json.loads(self.manifest.read_text()) if self.manifest.exists() else {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='verify')
+        self._futures: list[Future] = []
+
+    def _key(self, path: Path) -> str:
+        path = path.resolve()
+        root = self.manifest.parent.resolve()
+        return str(path.relative_to(root)) if path.is_relative_to(root) else str(path)
+
+    def save(self) -> None:
+        with self._lock:
+            # other processes or instances may have added digests in the meantime
+            if self.manifest.exists():
+                self._digests = {**json.loads(self.manifest.read_text()), **self._digests}
+            tmp = self.manifest.with_suffix('.tmp')
+            tmp.write_text(json.dumps(self._digests, indent=4))
+            tmp.replace(self.manifest)
+
+    def known_digest(self, path: Path) -> str | None:
+        """The digest on file, if size and mtime of the file did not change since it was computed."""
+        entry = self._digests.get(self._key(path))
+        stat = path.stat()
+        if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['md5']
+        return None
+
+    def add(self, path: Path, md5: str) -> None:
+        """Record a digest computed elsewhere, e.g. while downloading."""
+        stat = path.stat()
+        with self._lock:
+            self._digests[self._key(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'md5': md5}
+        self.save()
+
+    def digest(self, path: Path) -> str:
+        """MD5 of a file, computed only if unknown or the file changed."""
+        if md5 := self.known_digest(path):
+            return md5
+        md5 = file_md5(path, block_size=self.block_size)
+        self.add(path, md5)
+        return md5
+
+    def verify(self, path: Path, size: int | None = None, md5: str | None = None) -> str:
+        """
+        Check a file against the expected size and digest.
+        :return: the digest of the file
+        :raises IntegrityError: if the file does not match
+        """
+        actual_size = path.stat().st_size
+        if size is not None and actual_size != size:
+            raise IntegrityError(f'{path.name}: size {actual_size} != {size}')
+        digest = self.digest(path)
+        if md5 and digest != md5.lower():
+            raise IntegrityError(f'{path.name}: checksum {digest} != {md5}')
+        return digest
+
+    def verify_copy(self, src: Path, dst: Path) -> str:
+        """Check that `dst` is an identical copy of `src`."""
+        return self.verify(dst, size=src.stat().st_size, md5=self.digest(src))
+
+    def quarantine(self, path: Path) -> Path | None:
+        """Move a file that failed verification to `quarantine/` in the video dir, so it is fetched again.
+        :return: the new location, None if the file does not exist
+        """
+        if not path.exists():
+            return None
+        key = Path(self._key(path))
+        target = self.manifest.parent / 'quarantine' / (path.name if key.is_absolute() else key)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        path.replace(target)
+        logger.warning(f'Moved {path.name} to {target.parent}')
+        return target
+
+    def submit(self, func: Callable[..., str], *args, on_success: Callable[[str], None] | None = None,
+               on_failure: Callable[[Exception], None] | None = None, **kwargs) -> Future:
+        """
+        Run `verify` or `verify_copy` on the pool, e.g. `submit(verifier.verify, path, size=size)`.
+        :param on_success: called with the digest if the file is ok
+        :param on_failure: called with the error if the file is not ok, failures are logged in any case
+        """
+        def task() -> str:
+            # callbacks run in the task, so `wait` returns only after they are done
+            try:
+                digest = func(*args, **kwargs)
+            except Exception as e:
+                logger.error(f'Verification failed: {e}')
+                if on_failure:
+                    on_failure(e)
+                raise
+            if on_success:
+                on_success(digest)
+            return digest
+
+        future = self._pool.submit(task)
+        with self._lock:
+            self._futures.append(future)
+        return future
+
+    def wait(self) -> tuple[int, int]:
+        """Wait for all submitted checks.
+        :return: number of files ok, failed
+        """
+        with self._lock:
+            futures, self._futures = self._futures, []
+        ok = failed = 0
+        for future in futures:
+            if future.exception() is None:
+                ok += 1
+            else:
+                failed += 1
+        logger.info(f'Verified {ok} files, {failed} failed')
+        return ok, failed
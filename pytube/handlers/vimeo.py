@@ -0,0 +1,159 @@
+"""
+Local catalog of the videos in the Vimeo account.
+
+The catalog is synced by paging through `/me/videos` with a `fields` filter, so a few requests replace one
+metadata request per talk. It is cached on disk and synced incrementally via the modification time.
+
+Download links in the catalog are signed and expire, `DownloadLinkResolver` refreshes them right before use.
+"""
+import json
+import threading
+from datetime import UTC, datetime, timedelta
+from pathlib import Path
+
+from vimeo import VimeoClient
+
+from pytube import conf, logger
+
+
+def video_id_from_uri(uri: str) -> str:
+    """'/videos/938668780' -> '938668780'"""
+    return uri.rstrip('/').split('/')[-1]
+
+
+class VimeoCatalog:
+    """
+    Video metadata by Vimeo video ID, limited to the fields required for downloading.
+    """
+    fields = 'uri,download,modified_time'
+
+    def __init__(self, client: VimeoClient, path: Path | None = None):
+        """
+        :param client: an authenticated Vimeo client
+        :param path: the cache file, defaults to `vimeo/catalog.json` in the video dir
+        """
+        self.client = client
+        self.path = path or conf.dirs.video_dir / 'vimeo/catalog.json'
+        self.synced_at: str | None = None
+        # the newest modification time of the last complete sync, videos fetched one by one do not count
+        self.watermark: str | None = None
+        self.videos: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            data = json.loads(self.path.read_text())
+            self.synced_at = data['synced_at']
+            self.watermark = data.get('watermark')
+            self.videos = data['videos']
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps({'synced_at': self.synced_at, 'watermark': self.watermark, 'videos': self.videos},
+                                  indent=4))
+        tmp.replace(self.path)
+
+    def sync(self, full: bool = False, per_page: int = 100) -> int:
+        """
+        Fetch all videos modified since the last sync.
+        Videos are requested by modification time, newest first, paging stops at the first video modified before
+        the newest one of the last complete sync.
+        :param full: page through the whole account regardless of the cache
+        :param per_page: page size, max. 100
+        :return: number of new or changed videos
+        """
+        url = f'/me/videos?fields={self.fields}&per_page={per_page}&sort=modified_time&direction=desc'
+        watermark = None if full or not self.watermark else datetime.fromisoformat(self.watermark)
+        changed, pages, newest = 0, 0, None
+        while url:
+            response = self.client.get(url)
+            response.raise_for_status()
+            page = response.json()
+            pages += 1
+            reached_known = False
+            with self._lock:
+                for video in page['data']:
+                    modified = datetime.fromisoformat(video['modified_time'])
+                    if watermark and modified < watermark:
+                        reached_known = True
+                        break
+                    newest = max(newest or modified, modified)
+                    video_id = video_id_from_uri(video['uri'])
+                    if self.videos.get(video_id, {}).get('modified_time') == video['modified_time']:
+                        continue
+                    self.videos[video_id] = video
+                    changed += 1
+            url = None if reached_known else page.get('paging', {}).get('next')
+        with self._lock:
+            self.synced_at = datetime.now(UTC).isoformat()
+            if newest and (watermark is None or newest > watermark):
+                self.watermark = newest.isoformat()
+            self.save()
+        logger.info(f'Synced Vimeo catalog: {changed} new or changed videos in {pages} requests, '
+                    f'{len(self.videos)} videos in total')
+        return changed
+
+    def fetch(self, video_id: str) -> dict:
+        """Fetch a single video from the API and update the catalog."""
+        response = self.client.get(f'/videos/{video_id}?fields={self.fields}')
+        response.raise_for_status()
+        video = response.json()
+        with self._lock:
+            self.videos[video_id] = video
+            self.save()
+        return video
+
+    def get(self, video_id: str) -> dict:
+        """Metadata of a video, from the catalog if available."""
+        video = self.videos.get(video_id)
+        if video is None:
+            logger.info(f'Video {video_id} not in catalog, fetching')
+            video = self.fetch(video_id)
+        return video
+
+
+def pick_download(video: dict, renditions: list[str]) -> dict | None:
+    """The download entry of the first available rendition in order of preference."""
+    by_rendition = {x['rendition']: x for x in video.get('download') or []}
+    for rendition in renditions:
+        if rendition in by_rendition:
+            return by_rendition[rendition]
+    return None
+
+
+class DownloadLinkResolver:
+    """
+    Resolve the download entry (link, size, md5, expiry) of a video from the catalog.
+    Links about to expire are refreshed from the API, so queued downloads starting late do not fail.
+    """
+
+    def __init__(self, catalog: VimeoCatalog, renditions: list[str] | None = None, refresh_margin: int | None = None):
+        """
+        :param catalog: the catalog acting as cache of the links
+        :param renditions: renditions in order of preference, e.g. ['1080p', '720p', 'source']
+        :param refresh_margin: refresh links expiring within this many seconds
+        """
+        self.catalog = catalog
+        self.renditions = list(renditions or conf.vimeo.renditions)
+        self.refresh_margin = timedelta(
+            seconds=conf.vimeo.link_refresh_margin if refresh_margin is None else refresh_margin)
+
+    def expires_soon(self, download: dict) -> bool:
+        if not download.get('expires'):
+            return False
+        expires = datetime.fromisoformat(download['expires'])
+        return expires - datetime.now(UTC) < self.refresh_margin
+
+    def resolve(self, video_id: str, refresh: bool = False) -> dict | None:
+        """
+        :param video_id: the Vimeo video ID
+        :param refresh: always fetch a fresh link, e.g. after a download was rejected
+        :return: the download entry or None if no configured rendition is available
+        """
+        download = None if refresh else pick_download(self.catalog.get(video_id), self.renditions)
+        if download is None or self.expires_soon(download):
+            download = pick_download(self.catalog.fetch(video_id), self.renditions)
+        if download is None:
+            logger.error(f'No download in renditions {self.renditions} for video {video_id}')
+        elif download['rendition'] != self.renditions[0]:
+            logger.warning(f'Video {video_id}: {self.renditions[0]} not available, using {download["rendition"]}')
+        return download
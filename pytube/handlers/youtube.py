@@ -2,9 +2,8 @@ import json
 import platform
 import random
 import warnings
-from collections.abc import Generator
+from collections.abc import Callable, Generator, Iterable
 from datetime import UTC, datetime, timedelta
-from pathlib import Path
 
 import google_auth_oauthlib.flow
 import googleapiclient.discovery
@@ -13,6 +12,9 @@ from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from handlers.manifest import acknowledge, read_manifest
+from handlers.quota import COSTS, QuotaExceededError, QuotaLedger, next_reset, quota_ledger
+from handlers.store import get_store
 from jinja2 import Environment, PackageLoader, select_autoescape
 from models.sessions import SessionRecord
 from models.video import BaseRecordingDetails, VideoSnippet, YouTubeMetadata, YoutubeVideoResource
@@ -49,6 +51,11 @@ class YT:
                 self._youtube = self.get_authenticated_service()
         return self._youtube
 
+    @property
+    def quota(self) -> QuotaLedger:
+        """ The quota used today, every request is checked and recorded, see `handlers.quota`"""
+        return quota_ledger()
+
     def get_authenticated_service(self):
         """ Authentication to access the channel information
         - Users need to authenticate via a web interface
@@ -105,7 +112,7 @@ class YT:
             part="id",
             mine=True
         )
-        response = request.execute()
+        response = self.quota.execute(request, "channels.list")
         return response["items"][0]["id"]
 
     # Function to list all videos in the channel
@@ -124,14 +131,14 @@ class YT:
             order="date",
             forMine=True
         )
-        response = request.execute()
+        response = self.quota.execute(request, "search.list")
 
         while request is not None and max_pages:
             videos.extend(response["items"])
             max_pages -= 1
             request = self.youtube.search().list_next(request, response)
-            if request:
-                response = request.execute()
+            if request and max_pages:
+                response = self.quota.execute(request, "search.list")
 
         return videos
 
@@ -151,24 +158,24 @@ class YT:
             maxResults=50,
             playlistId=playlist_id
         )
-        response = request.execute()
+        response = self.quota.execute(request, "playlistItems.list")
         while request is not None:
             videos.extend(response['items'])
             request = self.youtube.playlistItems().list_next(request, response)
             if request:
-                response = request.execute()
+                response = self.quota.execute(request, "playlistItems.list")
         return videos
 
-    def update_video_metadata(self, video_id,  # noqa: PLR0913
-                              title=None,
-                              description=None,
-                              tags=None,
-                              category_id=None,
-                              privacy_status=None,
-                              publish_date=None
-                              ):
-
-        # Prepare the request body
+    @classmethod
+    def video_update_body(cls, video_id,  # noqa: PLR0913
+                          title=None,
+                          description=None,
+                          tags=None,
+                          category_id=None,
+                          privacy_status=None,
+                          publish_date=None
+                          ) -> dict:
+        """ The request body of `videos().update` """
         body = {
             "id": video_id,
             "snippet": {},
@@ -189,23 +196,77 @@ class YT:
             # required by YouTube
             body["status"]["privacyStatus"] = 'private'
             if isinstance(publish_date, str):
-                publish_date = datetime.strptime(publish_date, '%Y-%m-%dT%H:%M:%S%z')
-            elif isinstance(publish_date, datetime):
-                publish_date = publish_date.strftime('%Y-%m-%dT%H:%M:%S%z')
-            else:
+                publish_date = datetime.fromisoformat(publish_date)
+            elif not isinstance(publish_date, datetime):
                 raise ValueError("Publish date must be a string or datetime object")
-            body["status"]["publishAt"] = publish_date
+            body["status"]["publishAt"] = publish_date.strftime('%Y-%m-%dT%H:%M:%S%z')
+        return body
+
+    def update_video_metadata(self, video_id,  # noqa: PLR0913
+                              title=None,
+                              description=None,
+                              tags=None,
+                              category_id=None,
+                              privacy_status=None,
+                              publish_date=None
+                              ):
+        body = self.video_update_body(video_id, title=title, description=description, tags=tags,
+                                      category_id=category_id, privacy_status=privacy_status,
+                                      publish_date=publish_date)
 
         # Update video metadata
         request = self.youtube.videos().update(
             part="snippet,status",
             body=body
         )
-        response = request.execute()
+        response = self.quota.execute(request, "videos.update")
 
         print(f"Updated video metadata for video ID: {video_id}")
         return response
 
+    def update_videos_metadata(self, bodies: dict[str, dict],
+                               callback: Callable[[str, dict | None, Exception | None], None],
+                               batch_size: int | None = None):
+        """ Update the metadata of many videos with batch requests, one HTTP round trip per batch.
+        :param bodies: {request ID: body of `videos().update`}, see `video_update_body`
+        :param callback: called with (request ID, response, exception) for each video, the exception is None on success
+        and a `QuotaExceededError` for videos deferred to the next quota reset
+        :param batch_size: videos per batch request, defaults to `youtube.batch_size`
+        """
+        batch_size = batch_size or conf.youtube.batch_size
+        items = list(bodies.items())
+
+        def result(request_id: str, response: dict | None, exception: Exception | None):
+            if exception is not None and "quotaExceeded" in str(exception):
+                self.quota.exhausted()
+                exception = QuotaExceededError(f"Quota exceeded at YouTube, deferred until "
+                                               f"{next_reset().isoformat()}: {exception}")
+            callback(request_id, response, exception)
+
+        affordable = self.quota.affordable("videos.update")
+        if affordable < len(items):
+            # deferred to the next quota reset instead of failing halfway
+            error = QuotaExceededError(f"Quota left for {affordable} of {len(items)} video updates, "
+                                       f"deferred until {next_reset().isoformat()}")
+            logger.warning(str(error))
+            for request_id, _ in items[affordable:]:
+                callback(request_id, None, error)
+            items = items[:affordable]
+        for start in range(0, len(items), batch_size):
+            chunk = items[start:start + batch_size]
+            batch = self.youtube.new_batch_http_request(callback=result)
+            for request_id, body in chunk:
+                batch.add(self.youtube.videos().update(part="snippet,status", body=body), request_id=request_id)
+            self.quota.charge("videos.update", count=len(chunk))
+            try:
+                batch.execute()
+            except Exception as e:
+                # the whole batch failed, e.g. a network error, report it for each video
+                logger.error(f"Batch request of {len(chunk)} video updates failed: {e}")
+                for request_id, _ in chunk:
+                    callback(request_id, None, e)
+            logger.info(f"Sent {start + len(chunk)} of {len(items)} video updates")
+
     def check_macos_sequoia(self):
         if self.youtube_offline:
             # does not apply when using a service account
@@ -225,9 +286,23 @@ class YT:
             part="status",
             id=video_ids
         )
-        response = request.execute()
+        response = self.quota.execute(request, "videos.list")
         return response
 
+    def list_videos(self, video_ids: list[str], part: str = "snippet,status") -> dict[str, dict]:
+        """ The current resources of videos, 50 IDs per `videos().list` call.
+        :return: {video ID: resource}, videos not found are missing
+        """
+        videos = {}
+        for start in range(0, len(video_ids), 50):
+            request = self.youtube.videos().list(
+                part=part,
+                id=",".join(video_ids[start:start + 50])
+            )
+            response = self.quota.execute(request, "videos.list")
+            videos.update({item["id"]: item for item in response.get("items", [])})
+        return videos
+
     def get_youtube_ids_for_uploads(self, youtube_channel: str):
         """ Save the YouTube video ids for the uploads to the channel to file.
         This file is required for the metadata management to map the pretalx id with the YouTube video id.
@@ -265,6 +340,21 @@ class YT:
         json.dump(pretalx_yt_map, (conf.dirs.video_dir / "pretalx_yt_map.json").open("w"), indent=4)
 
 
+def changed_fields(body: dict, current: dict) -> list[str]:
+    """ The fields of an update body that differ from the current resource at YouTube, e.g. ['snippet.title'] """
+    changed = []
+    for part in ("snippet", "status"):
+        for field, value in body.get(part, {}).items():
+            current_value = current.get(part, {}).get(field)
+            if field == "publishAt" and value and current_value:
+                same = datetime.fromisoformat(value) == datetime.fromisoformat(current_value)
+            else:
+                same = value == current_value
+            if not same:
+                changed.append(f"{part}.{field}")
+    return changed
+
+
 class PrepareVideoMetadata:
     # noinspection GrazieInspection
     """ This class adds YouTube specific metadata to the records created by the records.py script
@@ -290,6 +380,7 @@ class PrepareVideoMetadata:
         self.records_path = conf.dirs.work_dir / 'records'
         self.video_records_path = conf.dirs.video_dir / 'youtube/video_records'
         self.video_records_path.mkdir(parents=True, exist_ok=True)
+        self.store = get_store()
         # default values
 
     @property
@@ -333,10 +424,16 @@ class PrepareVideoMetadata:
         )
         self._template = env.get_template(self.template_file)
 
-    def make_all_video_metadata(self):
-        manifest = json.load((conf.dirs.work_dir / "manifest.json").open())
-        for video in manifest:
-            self.make_video_metadata(video)
+    def make_all_video_metadata(self, changed_only: bool = False):
+        """
+        :param changed_only: only talks added or changed since the video metadata was last made
+        """
+        processed = []
+        for video in read_manifest('video_metadata' if changed_only else None):
+            if self.make_video_metadata(video):
+                processed.append(video['pretalx_id'])
+        # talks without a YouTube video yet stay pending
+        acknowledge('video_metadata', processed)
 
     @classmethod
     def best_youtube_title(cls, title, at):
@@ -351,12 +448,13 @@ class PrepareVideoMetadata:
             return long_title
         return title
 
-    def make_video_metadata(self, video):
+    def make_video_metadata(self, video) -> bool:
         """
         Collect all metadata for a video and merge it into a single document, store this document in the JSON record.
+        :return: False if the talk has no YouTube video yet
         """
         # load record
-        record = SessionRecord.model_validate_json((self.records_path / f"{video['pretalx_id']}.json").read_text())
+        record = SessionRecord.model_validate(self.store.get('records', video['pretalx_id']))
         # update record with video info if necessary
         update_record = False
         youtube_channel = self.pretalx_youtube_channel_map[video["pretalx_id"]]
@@ -364,7 +462,7 @@ class PrepareVideoMetadata:
             youtube_video_id = self.pretalx_youtube_id_map[video["pretalx_id"]]
         except KeyError:
             logger.warning(f'No YouTube video ID found for {video["pretalx_id"]}-{video["title"]}, skipping')
-            return
+            return False
 
         youtube_title = self.best_youtube_title(record.title, self.at)
         recorded_date = record.pretalx_session.session.slot.start
@@ -405,7 +503,7 @@ class PrepareVideoMetadata:
             update_record = True
 
         if update_record:
-            (self.records_path / f'{record.pretalx_id}.json').write_text(record.model_dump_json(indent=4))
+            self.store.put('records', record.pretalx_id, record.model_dump(mode='json'))
             logger.info(f'Saved updated record of {record.pretalx_id}')
 
         recorded_iso: str = record.recorded_date.strftime("%d.%m.%Y")
@@ -419,9 +517,10 @@ class PrepareVideoMetadata:
             recording_details=BaseRecordingDetails(**{"recording_date": recorded_iso}),
         )
 
-        (self.video_records_path / f'{record.pretalx_id}.json').open("w").write(
-            youtube_video_ressource.model_dump_json(indent=4))
+        self.store.put('video_records', record.pretalx_id, youtube_video_ressource.model_dump(mode='json'),
+                       state='video_records', channel=youtube_channel)
         print("=" * 50)
+        return True
 
     def render_description(self, description: str, record: SessionRecord):
         """ Provides commonly used values for rendering the description"""
@@ -442,12 +541,11 @@ class PrepareVideoMetadata:
         """ Customize this method to fit your description needs: add or alter attributes used in the template """
         return description_kwargs
 
-    def send_all_video_metadata(self, destination_channel: str):
-        logger.info(f"Updating metadata for channel {destination_channel}")
-        ytclient = YT()
-        for youtube_video in self.video_records_path.glob("*.json"):
-            video = YoutubeVideoResource.model_validate_json(youtube_video.read_text())
-            pretalx_id = self.youtube_id_pretalx_map.get(video.id)
+    def queued_videos(self, destination_channel: str) -> dict[str, dict]:
+        """ The video records of a channel queued for a metadata update {pretalx ID: data}"""
+        queued = {}
+        for _, data in self.store.items('video_records', state='video_records'):
+            pretalx_id = self.youtube_id_pretalx_map.get(data['id'])
             if not pretalx_id:
                 # no pretalx id found, skip
                 continue
@@ -458,43 +556,100 @@ class PrepareVideoMetadata:
             if channel != destination_channel:
                 # wrong channel, skip
                 continue
-            try:
-                ytclient.update_video_metadata(
-                    video_id=video.id,
-                    title=video.snippet.title,
-                    description=video.snippet.description,
-                    category_id=video.snippet.category_id,
-                    privacy_status=video.status.privacy_status,
-                    publish_date=video.status.publish_at
-                )
-                youtube_video.rename(ytclient.video_records_path_updated / youtube_video.name)
-                logger.info(f"Updated video: {pretalx_id}, {video.id}")
-            except Exception as e:
-                logger.error(f"Failed to update video {video.id}: {e}")
-                continue
+            queued[pretalx_id] = data
+        return queued
 
-    def update_video_metadata(self, states: str | list[str], func: callable):
-        """ update record files with video metadata created already.
+    @classmethod
+    def update_units(cls, count: int, diff_only: bool | None = None) -> int:
+        """ The quota units `send_all_video_metadata` needs at most for `count` videos"""
+        diff_only = conf.youtube.diff_only if diff_only is None else diff_only
+        units = count * COSTS["videos.update"]
+        if diff_only:
+            units += -(-count // 50) * COSTS["videos.list"]
+        return units
+
+    def send_all_video_metadata(self, destination_channel: str, batch_size: int | None = None,
+                                diff_only: bool | None = None, pretalx_ids: Iterable[str] | None = None
+                                ) -> dict[str, int]:
+        """ Send the queued metadata of a channel to YouTube in batch requests.
+        Updated videos move to 'video_records_updated', failed ones stay queued with the error in `update_error`.
+        :param batch_size: videos per batch request, defaults to `youtube.batch_size`
+        :param diff_only: skip videos YouTube already has the same metadata for, defaults to `youtube.diff_only`
+        :param pretalx_ids: only these of the queued videos
+        :return: number of videos updated, failed and skipped
+        :raises QuotaExceededError: if updates were deferred to the next quota reset, after all other videos were
+        sent; the deferred videos stay queued
+        """
+        diff_only = conf.youtube.diff_only if diff_only is None else diff_only
+        logger.info(f"Updating metadata for channel {destination_channel}")
+        ytclient = YT()
+        queued = self.queued_videos(destination_channel)
+        if pretalx_ids is not None:
+            selected = set(pretalx_ids)
+            queued = {pretalx_id: data for pretalx_id, data in queued.items() if pretalx_id in selected}
+        bodies = {}
+        for pretalx_id, data in queued.items():
+            video = YoutubeVideoResource.model_validate(data)
+            bodies[pretalx_id] = ytclient.video_update_body(
+                video_id=video.id,
+                title=video.snippet.title,
+                description=video.snippet.description,
+                category_id=video.snippet.category_id,
+                privacy_status=video.status.privacy_status,
+                publish_date=video.status.publish_at
+            )
+
+        result = {'updated': 0, 'failed': 0, 'skipped': 0, 'deferred': 0}
+        if diff_only and bodies:
+            # a list call costs 1 quota unit for 50 videos, an update 50 units per video
+            current = ytclient.list_videos([body["id"] for body in bodies.values()])
+            for pretalx_id, body in list(bodies.items()):
+                if body["id"] in current and not changed_fields(body, current[body["id"]]):
+                    del bodies[pretalx_id]
+                    data = queued.pop(pretalx_id)
+                    data.pop('update_error', None)
+                    self.store.put('video_records', pretalx_id, data, state='video_records_updated')
+                    logger.info(f"Skipped video {pretalx_id}, {body['id']}: metadata at YouTube is up to date")
+                    result['skipped'] += 1
+
+        def updated(pretalx_id: str, _response: dict | None, exception: Exception | None):
+            data = queued[pretalx_id]
+            if exception is None:
+                data.pop('update_error', None)
+                self.store.put('video_records', pretalx_id, data, state='video_records_updated')
+                logger.info(f"Updated video: {pretalx_id}, {data['id']}")
+                result['updated'] += 1
+                return
+            data['update_error'] = {'error': str(exception), 'at': datetime.now(UTC).isoformat()}
+            self.store.put('video_records', pretalx_id, data)
+            if isinstance(exception, QuotaExceededError):
+                result['deferred'] += 1
+            else:
+                logger.error(f"Failed to update video {data['id']}: {exception}")
+                result['failed'] += 1
+
+        ytclient.update_videos_metadata(bodies, updated, batch_size)
+        logger.info(f"Updated {result['updated']} videos of channel {destination_channel}, "
+                    f"{result['failed']} failed, {result['skipped']} skipped as unchanged, "
+                    f"{result['deferred']} deferred to the next quota reset")
+        if result['deferred']:
+            raise QuotaExceededError(f"{result['deferred']} video updates of channel {destination_channel} "
+                                     f"deferred until {next_reset().isoformat()}")
+        return result
+
+    def update_video_metadata(self, states: str | list[str], func: Callable[[str, dict], None]):
+        """ update video records with video metadata created already, the state of a record is kept.
         :param states: str or list of str, values: 'video_records', 'video_records_updated'
-        :param func: custom method to apply to the record
+        :param func: custom method to apply to the record, called with the pretalx ID and the data to change in place
         """
         if isinstance(states, str):
             states = [states]
         for state in states:
             if state not in ('video_records', 'video_records_updated'):
                 continue
-            for record in (self.video_records_path.parent / state).glob("*.json"):
-                func(record)
-
-    @classmethod
-    def update_publish_date(cls, record: Path, publish_date: datetime):
-        """ Sets the publishing date at YouTube for videos"""
-        with record.open("r") as f:
-            record_data = json.load(f)
-        record_data["status"]["publish_at"] = publish_date.isoformat()
-        print("Updated publish date to", publish_date.isoformat())
-        with record.open("w") as f:
-            json.dump(record_data, f, indent=4)
+            for pretalx_id, data in list(self.store.items('video_records', state=state)):
+                func(pretalx_id, data)
+                self.store.put('video_records', pretalx_id, data, state=state)
 
     def update_publish_dates(self, states: str | list[str] | tuple[str] = ('video_records', 'video_records_updated'),
                              start: datetime | None = None,
@@ -511,13 +666,14 @@ class PrepareVideoMetadata:
         for state in states:
             if state not in ('video_records', 'video_records_updated'):
                 continue
-            records.extend(list((self.video_records_path.parent / state).glob("*.json")))
+            records.extend(self.store.keys('video_records', state=state))
         random.shuffle(records)
-        for record, publish_at in zip(records, gen, strict=False):
-            self.update_publish_date(record, publish_at)
+        for pretalx_id, publish_at in zip(records, gen, strict=False):
+            record_data = self.store.get('video_records', pretalx_id)
+            record_data["status"]["publish_at"] = publish_at.isoformat()
             # move to queue for YouTube metadata updates
-            record.rename(self.video_records_path / record.name)
-            logger.info(f"Updated publish date for {record.name} in the video file."
+            self.store.put('video_records', pretalx_id, record_data, state='video_records')
+            logger.info(f"Updated publish date for {pretalx_id} to {publish_at.isoformat()}. "
                         "Please do not forget to publish the update.")
 
     @staticmethod
@@ -88,3 +88,4 @@ class SessionRecord(BaseModel, validate_assignment=True):
     youtube_online_metadata: dict | None = Field(None, description='Metadata as released on YouTube.')
     linked_in_response: dict | None = Field(None, description='Metadata as released on LinkedIn.')
     linked_in_post: str | None = Field(None, description='Post as released on LinkedIn.')
+    source_hash: str = Field('', description='Hash of the pretalx data the record was created from.')
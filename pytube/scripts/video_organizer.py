@@ -8,10 +8,14 @@ from pathlib import Path
 from typing import Any
 
 from handlers.records import Records
+from handlers.state import ProcessedState
+from handlers.verify import Verifier
 
 from pytube import conf, logger
 
 records = Records()
+state = ProcessedState()
+verifier = Verifier()
 
 
 def split_pycon_pydata(video: dict):
@@ -83,14 +87,24 @@ def move_videos_to_upload_channel():
             continue
         move_us.add((video_map[code], code, tracks_map[code],))
         logger.debug(f'{code} -> {tracks_map[code]}')
-        for record in move_us:
-            logger.info(f'Moving {record[1]} to {record[2]}')
-            src = record[0]
-            dst = conf.dirs.video_dir / 'uploads' / record[2] / record[0].name
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copyfile(src, dst)
-            with (conf.dirs.video_dir / 'downloads/processed.txt').open("a") as f:
-                f.write_text(f'{record[1]}\n')
+    for record in move_us:
+        if state.has(record[1], 'copied'):
+            continue
+        if not state.has(record[1], 'verified'):
+            logger.warning(f'Video {record[1]} is not verified, not copied')
+            continue
+        logger.info(f'Moving {record[1]} to {record[2]}')
+        src = record[0]
+        dst = conf.dirs.video_dir / 'uploads' / record[2] / record[0].name
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dst)
+        # marked as copied once the copy is verified, the next copy starts meanwhile
+        # a bad copy is removed, so it is copied again by the next run
+        verifier.submit(verifier.verify_copy, src, dst,
+                        on_success=lambda digest, r=record, d=dst: state.mark(
+                            r[1], 'copied', path=str(d), channel=r[2], md5=digest),
+                        on_failure=lambda e, d=dst: d.unlink(missing_ok=True))  # noqa: ARG005
+    verifier.wait()
 
 
 if __name__ == '__main__':
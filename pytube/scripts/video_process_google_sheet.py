@@ -1,10 +1,14 @@
 """
 Read Google Sheet with videos
 """
-import time
+from concurrent.futures import ThreadPoolExecutor
 
 import gspread
+import numpy as np
 import pandas as pd
+from handlers.manifest import diff_manifest, save_changes
+from handlers.ratelimit import backoff, parse_retry_after
+from handlers.sheets import SheetCache
 from models.talk import Talk
 from pytanis import GSheetsClient
 
@@ -15,95 +19,163 @@ SPREADSHEET_ID = conf.spreadsheets.ids
 WORKSHEET_NAMES = conf.spreadsheets.sheets
 
 
+def retryable(error: gspread.exceptions.APIError) -> bool:
+    """Rate limits and server errors are worth a retry, anything else is not."""
+    return error.response.status_code == 429 or error.response.status_code >= 500  # noqa: PLR2004
+
+
+def retry_after(error: gspread.exceptions.APIError) -> float | None:
+    return parse_retry_after(error.response.headers.get('Retry-After'))
+
+
+def values_to_df(values: list[list[str]]) -> pd.DataFrame:
+    """Worksheet values (header row first) to a DataFrame, empty rows and columns removed like `gsheet_as_df`"""
+    if not values:
+        return pd.DataFrame()
+    width = max(len(row) for row in values)
+    rows = [row + [''] * (width - len(row)) for row in values]
+    df = pd.DataFrame(rows[1:], columns=rows[0]).replace('', np.nan)
+    df.dropna(how='all', inplace=True, axis=0)
+    df.dropna(how='all', inplace=True, axis=1)
+    return df
+
+
+def drive_modified_time(spreadsheet: gspread.Spreadsheet) -> str | None:
+    """The Drive modifiedTime of a spreadsheet, if the client can provide it (requires Drive metadata access)."""
+    if not hasattr(spreadsheet, 'get_lastUpdateTime'):
+        return None
+    try:
+        return spreadsheet.get_lastUpdateTime()
+    except Exception as e:
+        logger.debug(f"No modifiedTime for {spreadsheet.id}: {e}")
+        return None
+
+
+def fetch_spreadsheet(gsheets_client: GSheetsClient, cache: SheetCache, room: str, spreadsheet_id: str,
+                      days: list[str]) -> None:
+    """Refresh the worksheets `days` of a spreadsheet in the cache, if it changed at the source.
+    All existing worksheets are fetched in a single batched values request, missing ones are cached empty."""
+
+    @backoff(gspread.exceptions.APIError, retries=conf.spreadsheets.retries, base=5, cap=120,
+             retry_after=retry_after, retry_if=retryable)
+    def open_spreadsheet():
+        return gsheets_client.gc.open_by_key(spreadsheet_id)
+
+    @backoff(gspread.exceptions.APIError, retries=conf.spreadsheets.retries, base=5, cap=120,
+             retry_after=retry_after, retry_if=retryable)
+    def worksheet_titles(spreadsheet) -> set[str]:
+        return {worksheet.title for worksheet in spreadsheet.worksheets()}
+
+    @backoff(gspread.exceptions.APIError, retries=conf.spreadsheets.retries, base=5, cap=120,
+             retry_after=retry_after, retry_if=retryable)
+    def batch_get(spreadsheet, titles):
+        return spreadsheet.values_batch_get(["'{}'".format(title.replace("'", "''")) for title in titles])
+
+    try:
+        spreadsheet = open_spreadsheet()
+        modified_time = drive_modified_time(spreadsheet)
+        if modified_time and cache.is_fresh(room, days, modified_time):
+            cache.touch(room, modified_time)
+            return
+        logger.info(f"Reading {room} {', '.join(days)}")
+        # a single missing worksheet fails the whole batch request
+        titles = worksheet_titles(spreadsheet)
+        existing = [day for day in days if day in titles]
+        if missing := [day for day in days if day not in titles]:
+            logger.warning(f"{room} has no worksheets {', '.join(missing)}")
+        response = batch_get(spreadsheet, existing) if existing else {}
+    except Exception as e:
+        logger.error(f"Error reading {room} {e}")
+        return
+    value_ranges = response.get('valueRanges', [])
+    sheets = {day: values_to_df([]) for day in days}
+    sheets.update({day: values_to_df(value_range.get('values', []))
+                   for day, value_range in zip(existing, value_ranges, strict=True)})
+    cache.update(room, sheets, modified_time)
+
+
 def load_sheets() -> dict[tuple[str, str], pd.DataFrame]:
     """ Load Google Sheets into DataFrames
-    If the file exists, read it, otherwise read from Google Sheets.
-    There is a limit on the number of reads for the Google Sheets API.
+    Sheets are cached locally in a single Parquet file, see `SheetCache`.
+    Spreadsheets fetched more than `spreadsheets.max_age_minutes` ago are refreshed if they changed.
+    There is a limit on the number of reads for the Google Sheets API:
+    all worksheets of a spreadsheet are requested at once, spreadsheets are fetched in parallel.
     """
-    data = {}
-    gsheets_client = GSheetsClient()
     logger.info("Reading Google Sheets")
-    for room, spreadsheet_id in SPREADSHEET_ID.items():
-        for day in WORKSHEET_NAMES:
-            f = conf.dirs.work_dir / f"sheets/{day}_{room}.xlsx"
-            tries = 0
-            if f.exists():
-                data[(day, room)] = pd.read_excel(f)
-                logger.info(f"Skipping {room} {day}, file exists")
-                continue
-
-            logger.info(f"Reading {room} {day}")
-            while True:
-                try:
-                    sheet_data = gsheets_client.gsheet_as_df(spreadsheet_id, day)
-                    data[(day, room)] = sheet_data
-                    try:
-                        sheet_data.to_excel(f, index=False)
-                        logger.info(f"Saved {room} {day}")
-                    except Exception as e:
-                        logger.error(f"Error saving {room} {day} {e}")
-                    try:
-                        sheet_data.to_excel(f, index=False)
-                        logger.info(f"Saved {room} {day}")
-                    except Exception as e:
-                        logger.error(f"Error saving {room} {day} {e}")
-                    break
-                except gspread.exceptions.APIError as e:
-                    if tries > 3:  # noqa PLR2004
-                        logger.error(f"Too many tries: giving up {room} {day} {e}")
-                        break
-                    logger.error(f"APIError reading {room} {day} {e}")
-                    logger.info("Retrying in 60 seconds")
-                    tries += 1
-                    time.sleep(60)
-                except Exception as e:
-                    logger.error(f"Error reading {room} {day} {e}")
-    return data
-
-
-def process_sheets():
+    cache = SheetCache()
+    days = list(WORKSHEET_NAMES)
+    stale = [room for room in SPREADSHEET_ID if not cache.is_fresh(room, days)]
+    for room in SPREADSHEET_ID:
+        if room not in stale:
+            logger.info(f"Skipping {room}, cached sheets are fresh")
+    if stale:
+        gsheets_client = GSheetsClient()
+        with ThreadPoolExecutor(max_workers=conf.spreadsheets.max_workers) as pool:
+            list(pool.map(lambda room: fetch_spreadsheet(gsheets_client, cache, room, SPREADSHEET_ID[room], days),
+                          stale))
+        cache.save()
+    return {(day, room): cache.sheets[(day, room)]
+            for room in SPREADSHEET_ID for day in days if (day, room) in cache.sheets}
+
+
+def vimeo_ids_from_links(links: pd.Series) -> pd.Series:
+    """Vectorized `vimeo_id_from_link`: the first path segment of each link"""
+    return links.str.extract(r"^(?:[A-Za-z][A-Za-z0-9+.-]*://[^/?#]*)?[^/?#]*/([^/?#]*)", expand=False).fillna("")
+
+
+def build_manifest(sheets: dict[tuple[str, str], pd.DataFrame],
+                   validate: bool = False) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Combine all sheets into the manifest of talks to process and the rows skipped, both with the `Talk` fields.
+    Rows are checked on whole columns at once.
+    :param sheets: {(day, room): sheet} as returned by `load_sheets`
+    :param validate: build a `Talk` for each valid row, not required for the manifest files
+    :return: manifest, skipped rows
+    """
+    columns = list(Talk.model_fields)
+    frames = []
+    for (day, room), df in sheets.items():
+        # the same columns are expected for all sheets
+        frames.append(df.set_axis(["title", "speaker", "pretalx_id", "vimeo_link"], axis=1)
+                      .fillna("").astype(str).assign(room=room, day=day))
+    if not frames:
+        return pd.DataFrame(columns=columns), pd.DataFrame(columns=columns)
+    data = pd.concat(frames, ignore_index=True)
+    data = data.assign(description="", vimeo_id=vimeo_ids_from_links(data["vimeo_link"]),
+                       vimeo_metadata=None, download_path=None, vimeo_download_link="")[columns]
+    # heuristic to skip empty or opt-out comments
+    valid = (data["pretalx_id"].str.strip().str.len() == 6) & data["vimeo_link"].str.contains("vimeo.com", regex=False)  # noqa PLR2004
+    manifest, skipped = data[valid].reset_index(drop=True), data[~valid].reset_index(drop=True)
+    if validate:
+        manifest = pd.DataFrame([Talk(**row).model_dump() for row in manifest.to_dict(orient="records")],
+                                columns=columns)
+    return manifest, skipped
+
+
+def process_sheets(validate: bool = False):
     """
     Process the Google Sheets to a list of Talks for further processing
     Produced a manifest.xlsx and manifest_skipped.xlsx
     Manifest.xlsx contains the list of talks to process.
     Skipped_manifest.xlsx contains the list of lines that were skipped to doublecheck.
+    manifest_changes.json collects the talks added, removed or changed per stage until the stage processed them.
+    :param validate: validate each talk with the `Talk` model
     :return:
     """
     data_collected = load_sheets()
-    talks = []
-    skipped = []
-    for (day, room), df in data_collected.items():
-        logger.info(f"Processing {room} {day}")
-        # the same columns are expected for all sheets
-        df.columns = ["talk", "speakers", "pretalx_id", "vimeo_link"]
-        df = df.fillna("")  # noqa PLW2901
-        for i, row in df.iterrows():
-            try:
-                t = Talk(
-                    title=row["talk"],
-                    speaker=row["speakers"],
-                    pretalx_id=row["pretalx_id"],
-                    room=room,
-                    day=day,
-                    vimeo_link=row["vimeo_link"],
-                )
-            except Exception as e:
-                logger.error(f"Error processing {room} {day} {i} {e}")
-                skipped.append(row)
-                continue
-            if not t.pretalx_id or len(t.pretalx_id.strip()) != 6 or "vimeo.com" not in t.vimeo_link:  # noqa PLR2004
-                # heuristic to skip empty or opt-out comments
-                logger.error(f"Missing pretalx_id {t.title} {t.speaker}")
-                skipped.append(t)
-                continue
-            talks.append(t)
-            logger.debug(f"Processed {t.title} {t.speaker} {t.pretalx_id} {t.vimeo_link}")
-        logger.info(f"Processed {len(talks)} talks for {room} {day}")
-    manifest = pd.DataFrame([t.model_dump() for t in talks])
+    manifest, skipped = build_manifest(data_collected, validate=validate)
+    for title, speaker in zip(skipped["title"], skipped["speaker"], strict=True):
+        logger.error(f"Missing pretalx_id {title} {speaker}")
+    for (room, day), count in manifest.groupby(["room", "day"], sort=False).size().items():
+        logger.info(f"Processed {count} talks for {room} {day}")
+    manifest_file = conf.dirs.work_dir / "manifest.json"
+    previous = pd.read_json(manifest_file, orient="records", dtype=False) if manifest_file.exists() else pd.DataFrame()
+    changes = diff_manifest(previous, manifest)
+    changes.log()
+    save_changes(changes)
     manifest.to_excel(conf.dirs.work_dir / "manifest.xlsx", index=False)
     manifest.to_json(conf.dirs.work_dir / "manifest.json", orient="records")
-    manifest_skipped = pd.DataFrame([t.model_dump() for t in skipped])
-    manifest_skipped.to_excel(conf.dirs.work_dir / "manifest_skipped.xlsx", index=False)
+    skipped.to_excel(conf.dirs.work_dir / "manifest_skipped.xlsx", index=False)
     logger.info("Done")
     return manifest.to_dict(orient="records")
 
@@ -1,30 +1,56 @@
 import json
+import signal
 import threading
-
-import requests
+from contextlib import nullcontext
+from pathlib import Path
+
+from handlers.downloads import (
+    DownloadEngine,
+    LinkExpiredError,
+    download_file,
+    download_file_segmented,
+)
+from handlers.manifest import acknowledge, read_manifest
+from handlers.ratelimit import TokenBucket
+from handlers.state import ProcessedState
+from handlers.verify import Verifier
+from handlers.vimeo import DownloadLinkResolver, VimeoCatalog, pick_download
 from models.talk import Talk
+from omegaconf import OmegaConf
 from vimeo import VimeoClient
 
 from pytube import conf, logger
 
-
-def read_manifest():
-    f = conf.dirs.work_dir / 'manifest.json'
-    with f.open() as r:
-        manifest = json.load(r)
-    return manifest
-
-
 client = VimeoClient(
     token=conf.vimeo.access_token,
     key=conf.vimeo.client_id,
     secret=conf.vimeo.client_secret,
 )
+state = ProcessedState()
+catalog = VimeoCatalog(client)
+resolver = DownloadLinkResolver(catalog)
+verifier = Verifier()
+
+
+def mbit_to_bytes(mbit: float | None) -> float | None:
+    return mbit * 1000 ** 2 / 8 if mbit else None
+
+
+# bandwidth shared by all download workers, `downloads.max_mbit` (0 = unlimited)
+bandwidth = TokenBucket(mbit_to_bytes(conf.downloads.max_mbit))
+
 
+def reload_bandwidth_limit(*_) -> None:
+    """Apply `downloads.max_mbit` from `config_local.yaml` to running downloads, e.g. via `kill -HUP <pid>`"""
+    local_conf = OmegaConf.load(conf.dirs.root / 'config_local.yaml')
+    max_mbit = OmegaConf.select(local_conf, 'downloads.max_mbit', default=conf.downloads.max_mbit)
+    bandwidth.rate = mbit_to_bytes(max_mbit)
+    logger.info(f'Bandwidth limit: {f"{max_mbit} Mbit/s" if max_mbit else "unlimited"}')
 
-def get_list_of__all_video_online():
-    response = client.get('https://api.vimeo.com/me/videos')
-    return response.json()
+
+def get_list_of__all_video_online() -> list[dict]:
+    catalog.sync()
+    return list(catalog.videos.values())
 
 
 def save_list_of__all_video_online():
@@ -33,25 +59,43 @@ def save_list_of__all_video_online():
 
 
 def get_video_metadata(video_id: str) -> dict:
-    video_metadata = client.get(f'https://api.vimeo.com/videos/{video_id}')
-    return video_metadata.json()
+    """Video metadata from the synced catalog, see `VimeoCatalog`"""
+    return catalog.get(video_id)
 
 
-def extract_download_link(video_metadata: dict, rendition: str = '1080p', quality: str = 'hd'):
-    download_links = [x for x in video_metadata['download'] if x['quality'] == quality and x['rendition'] == rendition]
-    if not download_links:
+def extract_download(video_metadata: dict, renditions: list[str] | None = None) -> dict | None:
+    """The download entry of the first available rendition, incl. link, size and md5 checksum
+    :param renditions: renditions in order of preference, default from the config
+    """
+    download = pick_download(video_metadata, list(renditions or conf.vimeo.renditions))
+    if not download:
         logger.error(f"No download links found for video {video_metadata['uri'].split('/')[-1]}")
+    return download
+
+
+def extract_download_link(video_metadata: dict, renditions: list[str] | None = None):
+    download = extract_download(video_metadata, renditions)
+    if not download:
         return
-    download_link = download_links[0]['link']
-    return download_link
+    return download['link']
 
 
-def download_videos(record, idx, total, semaphore):
-    with semaphore:
-        download_video(record, idx, total)
+def fetch_download(vimeo_download: dict, download: Path) -> int:
+    """Download a Vimeo download entry, segmented if it is large enough"""
+    vimeo_size = vimeo_download.get('size')
+    buffer_size = conf.downloads.buffer_size_mb * 1024 ** 2
+    if conf.downloads.segments > 1 and vimeo_size and vimeo_size >= conf.downloads.segment_min_size_mb * 1024 ** 2:
+        return download_file_segmented(vimeo_download['link'], download, size=vimeo_size,
+                                       md5=vimeo_download.get('md5'), segments=conf.downloads.segments,
+                                       buffer_size=buffer_size, limiter=bandwidth)
+    return download_file(vimeo_download['link'], download, size=vimeo_size,
+                         md5=vimeo_download.get('md5'), buffer_size=buffer_size, limiter=bandwidth)
 
 
-def download_video(record, idx, total):
+def download_video(record, idx, total, engine: DownloadEngine | None = None) -> int | None:
+    """Download the recording of a manifest record.
+    :return: bytes downloaded, None if skipped
+    """
     record = Talk(**record)
     logger.info(f'Processing {idx}/{total}: {record.pretalx_id, record.vimeo_link}')
 
@@ -59,55 +103,95 @@ def download_video(record, idx, total):
         return
     download = conf.dirs.video_dir / 'downloads' / f'{record.pretalx_id}' / f'{record.pretalx_id}-{record.title[:50].strip()}.mp4'
 
-    try:
-        # text file once the video is processed
-        processed = (conf.dirs.video_dir / 'downloads/processed.txt').read_text().splitlines()
-    except FileNotFoundError:
-        processed = []
-    if record.pretalx_id in processed:
+    if state.has(record.pretalx_id, 'copied'):
         logger.info(f'Skipping {record.pretalx_id}, already processed.')
-        return
+        return None
 
     if download.exists():
         logger.info(f'Skipping {record.pretalx_id}, downloaded already.')
-        return
+        return None
 
     record.download_path = download
-    vimeo_metadata_dir = conf.dirs.video_dir / 'vimeo'
-    vimeo_metadata_dir.mkdir(parents=True, exist_ok=True)
-    vimeo_metafile = vimeo_metadata_dir / f'{record.pretalx_id}.json'
     record.vimeo_metadata = get_video_metadata(record.vimeo_id)
-    json.dump(record.vimeo_metadata, vimeo_metafile.open('w'), indent=4)
-    record.vimeo_download_link = extract_download_link(record.vimeo_metadata)
-    response = requests.get(record.vimeo_download_link, stream=True)
-    if response.status_code != 200:  # noqa PLR2004
-        logger.error(f'Failed to download video: {response.status_code}')
-        return
-    download.parent.mkdir(parents=True, exist_ok=True)
-    with download.open('wb') as f:
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                f.write(chunk)
+    vimeo_download = resolver.resolve(record.vimeo_id)
+    if not vimeo_download:
+        raise RuntimeError(f'No download link for video {record.vimeo_id}')
+    # a segmented download counts as a single transfer against the per-host limit
+    with engine.host_slot(vimeo_download['link']) if engine else nullcontext():
+        # the job may have waited for its slot, refresh the link if it is about to expire
+        vimeo_download = resolver.resolve(record.vimeo_id)
+        record.vimeo_download_link = vimeo_download['link']
+        try:
+            size = fetch_download(vimeo_download, download)
+        except LinkExpiredError:
+            logger.info(f'Download link of {record.pretalx_id} expired, retrying with a fresh link')
+            vimeo_download = resolver.resolve(record.vimeo_id, refresh=True)
+            record.vimeo_download_link = vimeo_download['link']
+            size = fetch_download(vimeo_download, download)
+    vimeo_md5 = vimeo_download.get('md5')
+    state.mark(record.pretalx_id, 'downloaded', path=str(download), size=vimeo_download.get('size'), md5=vimeo_md5)
     logger.info(f'Downloaded video to {download.name}')
-
-
-def manifest_to_slowly_download_jobs(max_threads=3):
-    manifest = read_manifest()
-    jobs = []
-    for idx, record in enumerate(manifest, 1):
-        jobs.append((record, idx, len(manifest)))
-
-    semaphore = threading.Semaphore(max_threads)
-    threads = []
-    for idx, record, total in jobs:
-        # Create a Thread object targeting the task function
-        thread = threading.Thread(target=download_videos, args=(idx, record, total, semaphore))
-        threads.append(thread)
-        thread.start()
-
-    # Wait for all threads to complete
-    for thread in threads:
-        thread.join()
+    if vimeo_md5:
+        # the checksum was verified before the download was renamed
+        verifier.add(download, vimeo_md5.lower())
+        state.mark(record.pretalx_id, 'verified', md5=vimeo_md5.lower())
+    else:
+        verify_download(record.pretalx_id)
+    return size
+
+
+def verify_download(pretalx_id: str) -> None:
+    """Queue the check of a download against the size and checksum recorded when it was downloaded."""
+    info = state.get(pretalx_id)['downloaded']
+    path = Path(info['path'])
+
+    def rejected(error: Exception) -> None:  # noqa: ARG001
+        # a download that is not ok is moved away and fetched again by the next run
+        verifier.quarantine(path)
+        state.clear(pretalx_id, 'downloaded', 'verified')
+
+    verifier.submit(verifier.verify, path, size=info.get('size'), md5=info.get('md5'),
+                    on_success=lambda digest: state.mark(pretalx_id, 'verified', md5=digest),
+                    on_failure=rejected)
+
+
+def verify_downloads(force: bool = False) -> tuple[int, int]:
+    """Check all downloads, files verified before and unchanged since are not hashed again.
+    :param force: also check downloads already marked as verified
+    :return: number of files ok, failed
+    """
+    for pretalx_id in list(state):
+        if state.has(pretalx_id, 'downloaded') and (force or not state.has(pretalx_id, 'verified')):
+            verify_download(pretalx_id)
+    return verifier.wait()
+
+
+def recording_day_first(record: dict) -> tuple[int, str]:
+    """Download priority: oldest recording day first, in the order of the sheets in the config."""
+    days = list(conf.spreadsheets.sheets)
+    day = days.index(record['day']) if record.get('day') in days else len(days)
+    return day, record.get('room', '')
+
+
+def manifest_to_slowly_download_jobs(max_threads: int | None = None, changed_only: bool = False):
+    """Download all recordings in the manifest on a fixed-size worker pool.
+    :param changed_only: only talks added or changed since the downloads last processed the manifest
+    """
+    engine = DownloadEngine(
+        download_video,
+        max_workers=max_threads or conf.downloads.max_workers,
+        max_per_host=conf.downloads.max_per_host,
+        priority=recording_day_first,
+    )
+    if hasattr(signal, 'SIGHUP') and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, reload_bandwidth_limit)
+    # one paged request per 100 videos instead of one metadata request per talk
+    catalog.sync()
+    summary = engine.run(read_manifest('downloads' if changed_only else None))
+    verifier.wait()
+    # failed downloads stay pending for the next run
+    acknowledge('downloads', [*summary.downloaded, *summary.skipped])
+    return summary
 
 
 if __name__ == '__main__':
@@ -1,9 +1,11 @@
 from datetime import UTC, datetime, timedelta
+from functools import partial
 
+from handlers.quota import QuotaScheduler, quota_ledger
 from handlers.youtube import YT, PrepareVideoMetadata
 from usr.usr import slugify
 
-from pytube import conf
+from pytube import conf, logger
 
 
 class CustomPrepareVideoMetadata(PrepareVideoMetadata):
@@ -25,13 +27,26 @@ def prepare_metadata(template_file: str, at: str):
     Sets periodical publishing dates for the videos.
     :param template_file: The jinja2 template in `./templates` to use for the metadata.
     :param at: The event name to in the template.
+    :return: the metadata updates deferred to the next quota reset
     """
     meta = CustomPrepareVideoMetadata(template_file, at)
     meta.make_all_video_metadata()
     meta.update_publish_dates(states=['video_records', 'video_records_updated'],
                               start=datetime.now(tz=UTC) + timedelta(minutes=5), delta=timedelta(hours=4))
+    # one operation per batch of videos, those that do not fit into today's quota stay queued for the next run
+    scheduler = QuotaScheduler(quota_ledger())
+    batch_size = conf.youtube.batch_size
     for channel in conf.youtube.channels:
-        meta.send_all_video_metadata(destination_channel=channel)
+        pretalx_ids = list(meta.queued_videos(channel))
+        for start in range(0, len(pretalx_ids), batch_size):
+            chunk = pretalx_ids[start:start + batch_size]
+            scheduler.add(f"metadata updates of {channel} {start + 1}-{start + len(chunk)}",
+                          units=meta.update_units(len(chunk)),
+                          func=partial(meta.send_all_video_metadata, destination_channel=channel, pretalx_ids=chunk))
+    deferred = scheduler.run()
+    if deferred:
+        logger.warning(f"Deferred until the next quota reset: {', '.join(deferred)}")
+    return deferred
 
 
 if __name__ == "__main__":
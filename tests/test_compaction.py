@@ -0,0 +1,32 @@
+from pytube.handlers.compaction import compact_info, count_tokens, share, truncate_tokens
+
+
+def test_share_keeps_short_items():
+    assert share([10, 100, 100], 110) == [10, 50, 50]  # noqa: PLR2004
+    assert share([10, 20], 100) == [10, 20]  # noqa: PLR2004
+
+
+def test_truncate_tokens():
+    text = ' '.join(['word'] * 200)
+    short = truncate_tokens(text, 20)
+    assert short.endswith('…')
+    assert count_tokens(short) <= 22  # noqa: PLR2004
+    assert truncate_tokens('short', 20) == 'short'
+
+
+def test_compact_info_unchanged_within_budget():
+    speakers = [('Ada', 'Engineer', 'Short bio.')]
+    text, saved = compact_info('Title', speakers, 'Abstract.', 'Description.', budget=1000)
+    assert saved == 0
+    assert text == compact_info('Title', speakers, 'Abstract.', 'Description.')[0]
+    assert 'Short bio.' in text and 'Description.' in text
+
+
+def test_compact_info_keeps_abstract_first():
+    abstract = 'The abstract of the talk.'
+    speakers = [('Ada', 'Engineer', 'bio ' * 300), ('Bob', None, 'Short bio.')]
+    text, saved = compact_info('Title', speakers, abstract, 'description ' * 500, budget=200)
+    assert saved > 0
+    assert abstract in text
+    assert 'Short bio.' in text
+    assert count_tokens(text) <= 220  # noqa: PLR2004
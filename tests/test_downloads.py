@@ -0,0 +1,186 @@
+import hashlib
+import io
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+
+from pytube.handlers.downloads import (
+    DownloadEngine,
+    byte_ranges,
+    download_file,
+    download_file_segmented,
+    part_path,
+    progress_path,
+)
+
+
+def test_download_engine_priority_and_summary():
+    order = []
+
+    def worker(record, idx, total, engine):  # noqa: ARG001
+        order.append(record['pretalx_id'])
+        if record['pretalx_id'] == 'FAILED':
+            raise RuntimeError('boom')
+        if record['pretalx_id'] == 'SKIPPD':
+            return None
+        return 100
+
+    records = [
+        {'pretalx_id': 'DAY2AA', 'day': 2},
+        {'pretalx_id': 'FAILED', 'day': 1},
+        {'pretalx_id': 'SKIPPD', 'day': 3},
+        {'pretalx_id': 'DAY1AA', 'day': 1},
+    ]
+    engine = DownloadEngine(worker, max_workers=1, priority=lambda r: r['day'])
+    summary = engine.run(records)
+
+    # stable for equal priorities
+    assert order == ['FAILED', 'DAY1AA', 'DAY2AA', 'SKIPPD']
+    assert summary.downloaded == ['DAY1AA', 'DAY2AA']
+    assert summary.skipped == ['SKIPPD']
+    assert summary.failed == {'FAILED': 'boom'}
+    assert summary.bytes_downloaded == 200  # noqa: PLR2004
+
+
+def test_download_engine_limits_connections_per_host():
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def worker(record, idx, total, engine):  # noqa: ARG001
+        nonlocal active, peak
+        with engine.host_slot(record['url']):
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            time.sleep(0.02)
+            with lock:
+                active -= 1
+        return 1
+
+    records = [{'pretalx_id': str(i), 'url': 'https://vod.example.com/video.mp4'} for i in range(8)]
+    summary = DownloadEngine(worker, max_workers=4, max_per_host=2).run(records)
+
+    assert peak == 2  # noqa: PLR2004
+    assert len(summary.downloaded) == 8  # noqa: PLR2004
+
+
+class FakeResponse:
+    def __init__(self, data: bytes, status_code: int = 200, headers: dict | None = None):
+        self.raw = io.BytesIO(data)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+def test_download_file_resumes_part_file(tmp_path):
+    data = b'0123456789' * 500
+    target = tmp_path / 'video.mp4'
+    part_path(target).write_bytes(data[:1234])
+    response = FakeResponse(data[1234:], status_code=206, headers={'Content-Range': f'bytes 1234-4999/{len(data)}'})
+
+    with patch('pytube.handlers.downloads.requests.get', return_value=response) as mock_get:
+        transferred = download_file('https://vod.example.com/v.mp4', target, size=len(data),
+                                    md5=hashlib.md5(data).hexdigest(), buffer_size=1024)
+
+    assert mock_get.call_args.kwargs['headers'] == {'Range': 'bytes=1234-'}
+    assert transferred == len(data) - 1234
+    assert target.read_bytes() == data
+    assert not part_path(target).exists()
+
+
+def test_download_file_keeps_incomplete_and_deletes_corrupt(tmp_path):
+    data = b'x' * 1000
+    target = tmp_path / 'video.mp4'
+
+    with patch('pytube.handlers.downloads.requests.get', return_value=FakeResponse(data[:600])), \
+            pytest.raises(RuntimeError, match='Incomplete'):
+        download_file('https://vod.example.com/v.mp4', target, size=len(data))
+    assert part_path(target).stat().st_size == 600  # noqa: PLR2004
+    assert not target.exists()
+
+    with patch('pytube.handlers.downloads.requests.get', return_value=FakeResponse(b'y' * 1000)), \
+            pytest.raises(RuntimeError, match='checksum'):
+        download_file('https://vod.example.com/v.mp4', target, size=len(data), md5=hashlib.md5(data).hexdigest())
+    assert not part_path(target).exists()
+    assert not target.exists()
+
+
+def test_byte_ranges():
+    assert byte_ranges(10, 3) == [(0, 3), (4, 7), (8, 9)]
+    assert byte_ranges(8, 4) == [(0, 1), (2, 3), (4, 5), (6, 7)]
+
+
+def test_download_file_segmented_fetches_missing_ranges(tmp_path):
+    data = bytes(range(256)) * 40
+    target = tmp_path / 'keynote.mp4'
+    requested = []
+    dropped = []
+
+    def fake_get(url, headers, **kwargs):  # noqa: ARG001
+        start, end = (int(x) for x in headers['Range'].removeprefix('bytes=').split('-'))
+        requested.append(start)
+        if start == 0 and not dropped:
+            dropped.append(start)
+            # first attempt of the first range drops the connection
+            return FakeResponse(data[start:start + 10], 206, {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+        return FakeResponse(data[start:end + 1], 206, {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+
+    with patch('pytube.handlers.downloads.requests.get', side_effect=fake_get), \
+            pytest.raises(RuntimeError, match='Incomplete range'):
+        download_file_segmented('https://vod.example.com/v.mp4', target, size=len(data), segments=4)
+    assert not target.exists()
+
+    requested.clear()
+    with patch('pytube.handlers.downloads.requests.get', side_effect=fake_get):
+        download_file_segmented('https://vod.example.com/v.mp4', target, size=len(data),
+                                md5=hashlib.md5(data).hexdigest(), segments=4)
+
+    # only the failed range is fetched again
+    assert requested == [0]
+    assert target.read_bytes() == data
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_download_file_segmented_retry_after_all_ranges_failed(tmp_path):
+    data = bytes(range(256)) * 40
+    target = tmp_path / 'keynote.mp4'
+
+    def fake_get(url, headers, **kwargs):  # noqa: ARG001
+        start, end = (int(x) for x in headers['Range'].removeprefix('bytes=').split('-'))
+        return FakeResponse(data[start:end + 1], 206, {'Content-Range': f'bytes {start}-{end}/{len(data)}'})
+
+    with patch('pytube.handlers.downloads.requests.get', return_value=FakeResponse(b'', 503)), \
+            pytest.raises(RuntimeError, match='Range request failed'):
+        download_file_segmented('https://vod.example.com/v.mp4', target, size=len(data), segments=4)
+    # the preallocated file is marked as segmented although no range completed
+    assert part_path(target).stat().st_size == len(data)
+    assert progress_path(part_path(target)).exists()
+
+    with patch('pytube.handlers.downloads.requests.get', side_effect=fake_get):
+        download_file_segmented('https://vod.example.com/v.mp4', target, size=len(data),
+                                md5=hashlib.md5(data).hexdigest(), segments=4)
+    assert target.read_bytes() == data
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_download_file_restarts_preallocated_part(tmp_path):
+    data = b'0123456789' * 500
+    target = tmp_path / 'video.mp4'
+    part = part_path(target)
+    with part.open('wb') as f:
+        f.truncate(len(data))
+    progress_path(part).write_text('{"ranges": [[0, 4999]], "done": []}')
+
+    with patch('pytube.handlers.downloads.requests.get', return_value=FakeResponse(data)) as mock_get:
+        download_file('https://vod.example.com/v.mp4', target, size=len(data), md5=hashlib.md5(data).hexdigest())
+
+    assert mock_get.call_args.kwargs['headers'] == {}
+    assert target.read_bytes() == data
+    assert list(tmp_path.iterdir()) == [target]
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from pytube.handlers.llmbatch import BatchJob
+
+
+def test_batch_job_round_trip_and_idempotent_ingest(tmp_path):
+    job = BatchJob(tmp_path)
+    job.write({'S1:teaser': {'messages': [{'role': 'user', 'content': 'one'}], 'max_tokens': 50},
+               'S2:teaser': {'messages': [{'role': 'user', 'content': 'two'}], 'max_tokens': 50}}, model='gpt-x')
+    line = json.loads(job.requests_path.read_text().splitlines()[0])
+    assert line['url'] == '/v1/chat/completions'
+    assert line['body']['model'] == 'gpt-x'
+
+    job.run_locally(lambda body: body['messages'][0]['content'].upper())
+    ingested = {}
+    assert job.ingest(ingested.__setitem__) == 2  # noqa: PLR2004
+    assert ingested == {'S1:teaser': 'ONE', 'S2:teaser': 'TWO'}
+    # results are ingested only once, also by a new instance after a restart
+    assert BatchJob(tmp_path).ingest(ingested.__setitem__) == 0
+
+
+def test_batch_job_skips_failed_requests(tmp_path):
+    job = BatchJob(tmp_path)
+    job.write({'S1:teaser': {}}, model='gpt-x')
+    job.results_path.write_text(json.dumps({'custom_id': 'S1:teaser', 'response': None,
+                                            'error': {'code': 'server_error'}}) + '\n')
+    assert job.ingest(lambda *_: None) == 0
+    assert job.ingested() == set()
+
+
+def test_batch_job_keeps_pending_batch(tmp_path):
+    job = BatchJob(tmp_path)
+    with pytest.raises(RuntimeError, match='No batch submitted'):
+        job.download(client=None)
+    job.write({'S1:teaser': {}}, model='gpt-x')
+    job.state['batch_id'] = 'batch_1'
+    job.save()
+    with pytest.raises(RuntimeError, match='not ingested yet'):
+        BatchJob(tmp_path).write({'S2:teaser': {}}, model='gpt-x')
+
+    job.run_locally(lambda _: 'text')
+    job.ingest(lambda *_: None)
+    # all results ingested, a new batch can be written
+    assert BatchJob(tmp_path).write({'S2:teaser': {}}, model='gpt-x') == 1
@@ -0,0 +1,52 @@
+import pandas as pd
+
+from pytube import conf
+from pytube.handlers.manifest import acknowledge, diff_manifest, load_changes, save_changes
+
+
+def test_diff_manifest():
+    previous = pd.DataFrame({
+        'pretalx_id': ['AAAAAA', 'BBBBBB', 'CCCCCC', 'DDDDDD'],
+        'title': ['A', 'B', 'C', 'D'],
+        'vimeo_link': ['https://vimeo.com/1', 'https://vimeo.com/2', 'https://vimeo.com/3', 'https://vimeo.com/4'],
+        'speaker': ['a', 'b', 'c', 'd'],
+    })
+    current = pd.DataFrame({
+        'pretalx_id': ['AAAAAA', 'BBBBBB', 'CCCCCC', 'EEEEEE'],
+        'title': ['A', 'B fixed', 'C', 'E'],
+        'vimeo_link': ['https://vimeo.com/1', 'https://vimeo.com/2', 'https://vimeo.com/33', 'https://vimeo.com/5'],
+        'speaker': ['a changed', 'b', 'c', 'e'],
+    })
+    changes = diff_manifest(previous, current)
+    assert changes.added == ['EEEEEE']
+    assert changes.removed == ['DDDDDD']
+    assert sorted(changes.changed) == ['BBBBBB', 'CCCCCC']
+    assert changes.updated == {'BBBBBB', 'CCCCCC', 'EEEEEE'}
+
+
+def test_diff_manifest_first_run():
+    current = pd.DataFrame({'pretalx_id': ['AAAAAA'], 'title': ['A'], 'vimeo_link': ['https://vimeo.com/1']})
+    changes = diff_manifest(pd.DataFrame(), current)
+    assert changes.added == ['AAAAAA']
+    assert not diff_manifest(current, current)
+
+
+def test_pending_changes_are_kept_until_acknowledged(monkeypatch, tmp_path):
+    monkeypatch.setitem(conf.dirs, 'work_dir', tmp_path)
+    first = pd.DataFrame({'pretalx_id': ['AAAAAA', 'BBBBBB'], 'title': ['A', 'B'], 'vimeo_link': ['1', '2']})
+    second = pd.DataFrame({'pretalx_id': ['AAAAAA', 'CCCCCC'], 'title': ['A fixed', 'C'], 'vimeo_link': ['1', '3']})
+    save_changes(diff_manifest(pd.DataFrame(), first))
+    acknowledge('downloads', ['AAAAAA', 'BBBBBB'])
+    # the video metadata was not made between the runs, the changes of both runs are pending for it
+    save_changes(diff_manifest(first, second))
+
+    downloads = load_changes('downloads')
+    assert downloads.changed == ['AAAAAA']
+    assert downloads.added == ['CCCCCC']
+    assert downloads.removed == ['BBBBBB']
+    video_metadata = load_changes('video_metadata')
+    assert video_metadata.added == ['AAAAAA', 'CCCCCC']
+    assert video_metadata.removed == []
+
+    acknowledge('video_metadata', ['CCCCCC'])
+    assert load_changes('video_metadata').updated == {'AAAAAA'}
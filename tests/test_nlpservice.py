@@ -0,0 +1,80 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import httpx
+import openai
+import pytest
+
+from pytube.handlers import nlpservice
+from pytube.handlers.llmcache import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    cache = ResponseCache(tmp_path / 'llm_cache.sqlite', max_mb=1)
+    monkeypatch.setattr(nlpservice, '_cache', cache)
+    return cache
+
+
+def rate_limit_error() -> openai.RateLimitError:
+    response = httpx.Response(429, headers={'retry-after': '0'},
+                              request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+    return openai.RateLimitError('Rate limit reached', response=response, body=None)
+
+
+def completion(text: str) -> MagicMock:
+    response = MagicMock()
+    response.choices[0].message.content = text
+    return response
+
+
+def test_complete_retries_rate_limits():
+    create = MagicMock(side_effect=[rate_limit_error(), rate_limit_error(), completion('Watch this!')])
+    with patch.object(nlpservice.client.chat.completions, 'create', create), \
+            patch('pytube.handlers.ratelimit.time.sleep') as sleep:
+        assert nlpservice.teaser_text('title: a talk') == 'Watch this!'
+    assert create.call_count == 3  # noqa: PLR2004
+    # backoff twice, plus waits of the rate limiters
+    assert sleep.call_count >= 2  # noqa: PLR2004
+
+
+def test_complete_does_not_retry_bad_requests():
+    response = httpx.Response(400, request=httpx.Request('POST', 'https://api.openai.com/v1/chat/completions'))
+    create = MagicMock(side_effect=openai.BadRequestError('Bad request', response=response, body=None))
+    with patch.object(nlpservice.client.chat.completions, 'create', create), pytest.raises(openai.BadRequestError):
+        nlpservice.sized_text('title: a talk')
+    assert create.call_count == 1
+
+
+def test_complete_answers_repeated_requests_from_cache(cache):
+    create = MagicMock(side_effect=[completion('first'), completion('second')])
+    with patch.object(nlpservice.client.chat.completions, 'create', create):
+        assert nlpservice.teaser_text('title: a talk', use_cache=True) == 'first'
+        assert nlpservice.teaser_text('title: a talk', use_cache=True) == 'first'
+        assert create.call_count == 1
+        # a different input or max_tokens is a new request
+        assert nlpservice.teaser_text('title: a talk', max_tokens=60, use_cache=True) == 'second'
+    assert cache.hits == 1
+
+
+def test_response_cache_evicts_least_recently_used(tmp_path):
+    cache = ResponseCache(tmp_path / 'cache.sqlite', max_mb=2.5 / 1024)
+    cache.put('a', 'x' * 1024)
+    cache.put('b', 'x' * 1024)
+    assert cache.get('a') is not None
+    cache.put('c', 'x' * 1024)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+def test_descriptions_in_one_call_with_fallback_for_invalid_texts():
+    response = json.dumps({'teaser': 'Watch this!', 'short': '', 'long': 'word ' * 1000})
+    create = MagicMock(side_effect=[completion(response), completion('short text'), completion('long text')])
+    with patch.object(nlpservice.client.chat.completions, 'create', create):
+        texts = nlpservice.descriptions('title: a talk', use_cache=False)
+    assert texts == {'teaser': 'Watch this!', 'short': 'short text', 'long': 'long text'}
+    first, short, long = create.call_args_list
+    assert first.kwargs['response_format'] == {'type': 'json_object'}
+    assert short.kwargs['max_tokens'] == 100  # noqa: PLR2004
+    assert long.kwargs['max_tokens'] == 300  # noqa: PLR2004
@@ -0,0 +1,74 @@
+import json
+from datetime import UTC, datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from pytube.handlers.quota import (
+    QuotaExceededError,
+    QuotaLedger,
+    QuotaScheduler,
+    next_reset,
+    quota_day,
+)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return QuotaLedger(tmp_path / 'youtube_quota.jsonl', project='test', daily_limit=200)
+
+
+def test_quota_day_and_reset_in_pacific_time():
+    # 06:30 UTC is still the previous day in California
+    now = datetime(2025, 4, 24, 6, 30, tzinfo=UTC)
+    assert quota_day(now) == '2025-04-23'
+    assert next_reset(now) == datetime(2025, 4, 24, 7, 0, tzinfo=UTC)
+
+
+def test_ledger_charges_and_persists(ledger):
+    request = MagicMock()
+    request.execute.return_value = {'items': []}
+    assert ledger.execute(request, 'search.list') == {'items': []}
+    ledger.charge('videos.list', count=3)
+    assert ledger.usage() == {'search.list': 100, 'videos.list': 3}
+    assert ledger.remaining() == 97  # noqa: PLR2004
+    assert ledger.affordable('videos.update') == 1
+
+    with pytest.raises(QuotaExceededError):
+        ledger.execute(request, 'search.list')
+    assert request.execute.call_count == 1
+
+    # usage of other days and projects does not count
+    with ledger.path.open('a') as f:
+        f.write(json.dumps({'project': 'test', 'day': '2000-01-01', 'method': 'videos.update', 'units': 50}) + '\n')
+        f.write(json.dumps({'project': 'other', 'day': quota_day(), 'method': 'videos.update', 'units': 50}) + '\n')
+    reloaded = QuotaLedger(ledger.path, project='test', daily_limit=200)
+    assert reloaded.used() == 103  # noqa: PLR2004
+    assert reloaded.used('2000-01-01') == 50  # noqa: PLR2004
+
+
+def test_ledger_exhausted_by_youtube(ledger):
+    request = MagicMock()
+    request.execute.side_effect = RuntimeError('<HttpError 403 "quotaExceeded">')
+    with pytest.raises(QuotaExceededError):
+        ledger.execute(request, 'videos.list')
+    assert ledger.remaining() == 0
+
+
+def test_scheduler_runs_by_priority_and_defers(ledger):
+    done = []
+    scheduler = QuotaScheduler(ledger)
+
+    def operation(name, units):
+        def run():
+            ledger.charge('videos.update', units=units)
+            done.append(name)
+        return run
+
+    scheduler.add('playlist sync', 100, operation('playlist sync', 100), priority=2)
+    scheduler.add('update', 150, operation('update', 150), priority=1)
+    scheduler.add('status check', 1, operation('status check', 1), priority=0)
+
+    assert scheduler.run() == ['playlist sync']
+    assert done == ['status check', 'update']
+    assert len(scheduler) == 1
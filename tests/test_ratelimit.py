@@ -0,0 +1,86 @@
+from unittest.mock import patch
+
+import pytest
+
+from pytube.handlers.ratelimit import TokenBucket, backoff, backoff_delay, parse_retry_after
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_limits_average_rate():
+    clock = FakeClock()
+    with patch('pytube.handlers.ratelimit.time', clock):
+        bucket = TokenBucket(rate=1000)
+        for _ in range(10):
+            bucket.consume(500)
+    # 5000 tokens at 1000 tokens/s, starting with an empty bucket
+    assert clock.now == 5.0  # noqa: PLR2004
+
+
+def test_token_bucket_allows_bursts_larger_than_capacity():
+    clock = FakeClock()
+    with patch('pytube.handlers.ratelimit.time', clock):
+        bucket = TokenBucket(rate=100, capacity=100)
+        clock.now = 10.0  # idle: bucket is full, but capped at capacity
+        assert bucket.consume(100) == 0
+        assert bucket.consume(300) == 3.0  # noqa: PLR2004
+
+
+def test_token_bucket_rate_can_change_at_runtime():
+    clock = FakeClock()
+    with patch('pytube.handlers.ratelimit.time', clock):
+        bucket = TokenBucket(rate=None)
+        assert bucket.consume(10 ** 9) == 0
+        bucket.rate = 1000
+        assert bucket.consume(1000) == 1.0
+        bucket.rate = 0
+        assert bucket.consume(10 ** 9) == 0
+
+
+class RateLimitError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def test_backoff_retries_and_honours_retry_after():
+    calls = []
+
+    @backoff(RateLimitError, retries=3, base=1, cap=10, retry_after=lambda e: e.retry_after)
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:  # noqa: PLR2004
+            raise RateLimitError(429, retry_after=30)
+        return 'ok'
+
+    with patch('pytube.handlers.ratelimit.time.sleep') as mock_sleep:
+        assert flaky() == 'ok'
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [30, 30]
+
+
+def test_backoff_gives_up_on_non_retryable_errors():
+    @backoff(RateLimitError, retries=3, retry_if=lambda e: e.status == 429)  # noqa: PLR2004
+    def forbidden():
+        raise RateLimitError(403)
+
+    with patch('pytube.handlers.ratelimit.time.sleep') as mock_sleep, pytest.raises(RateLimitError):
+        forbidden()
+    mock_sleep.assert_not_called()
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(attempt, base=1, cap=8) for attempt in range(10) for _ in range(20)]
+    assert all(0 <= d <= 8 for d in delays)  # noqa: PLR2004
+    assert parse_retry_after('12') == 12  # noqa: PLR2004
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    assert parse_retry_after(None) is None
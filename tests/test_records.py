@@ -0,0 +1,134 @@
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from pydantic import BaseModel
+
+from pytube import conf
+from pytube.handlers.llmbatch import BatchJob
+from pytube.handlers.records import Records, answer_index, compile_qmap, enrich
+from pytube.models.sessions import SpeakerInfo
+
+
+class Item(BaseModel):
+    code: str
+    name: str
+
+
+def test_load_all_writes_files_and_maps(tmp_path, monkeypatch):
+    monkeypatch.setitem(conf.dirs, 'work_dir', tmp_path)
+    client = SimpleNamespace(
+        submissions=lambda *_, **__: (2, iter([Item(code='S1', name='talk 1'), Item(code='S2', name='talk 2')])),
+        speakers=lambda *_, **__: (1, iter([Item(code='P1', name='speaker 1')])),
+    )
+    with patch('pytube.handlers.records.PretalxClient', return_value=client):
+        records = Records(reload=True)
+    records.load_all()
+
+    assert json.loads((tmp_path / 'pretalx/S2.json').read_text()) == {'code': 'S2', 'name': 'talk 2'}
+    assert json.loads((tmp_path / 'confirmed_sessions_map.json').read_text()) == records.confirmed_sessions_map
+    assert records.speakers_map == {'P1': {'code': 'P1', 'name': 'speaker 1'}}
+
+    # rebuilding the map from the files gives the same result
+    (tmp_path / 'confirmed_sessions_map.json').unlink()
+    Records.create_confirmed_sessions_map()
+    assert json.loads((tmp_path / 'confirmed_sessions_map.json').read_text()) == records.confirmed_sessions_map
+
+
+def test_enrich_speaker_from_answer_index():
+    answers = answer_index([
+        {'question': {'id': 1}, 'answer': ' ACME Inc. '},
+        {'question': {'id': 2}, 'answer': 'linkedin.com/in/jane'},
+        {'question': {'id': 2}, 'answer': 'ignored, the first answer counts'},
+        {'question': {'id': 3}, 'answer': 'not a url'},
+    ])
+    assert answers[1] == 'ACME Inc.'
+    setters = compile_qmap({'company': 1, 'linkedin': 2, 'github': 3, 'not_a_field': 4}, SpeakerInfo)
+    assert [attr for attr, _, _ in setters] == ['company', 'linkedin', 'github']
+
+    speaker = enrich(SpeakerInfo(code='P1', name='Jane'), setters, answers)
+    assert speaker.company.name == 'ACME Inc.'
+    assert speaker.linkedin == 'linkedin.com/in/jane'
+
+
+def test_create_records_skips_unchanged_sessions(tmp_path, monkeypatch):
+    monkeypatch.setitem(conf.dirs, 'work_dir', tmp_path)
+    session = {
+        'code': 'S1', 'speakers': [{'code': 'P1', 'name': 'Jane'}], 'title': 'Talk',
+        'submission_type': {'en': 'Talk'}, 'submission_type_id': 1, 'state': 'confirmed',
+        'abstract': 'abstract', 'description': 'description', 'do_not_record': False, 'is_featured': False,
+        'content_locale': 'en', 'slot_count': 1, 'resources': [],
+    }
+    with patch('pytube.handlers.records.PretalxClient'):
+        records = Records(qmap={})
+    records._confirmed_sessions_map = {'S1': session}
+    records._speakers_map = {'P1': {'code': 'P1', 'name': 'Jane'}}
+
+    assert records.create_records() == {'created': 1, 'updated': 0, 'skipped': 0}
+    record_file = tmp_path / 'records/S1.json'
+    mtime = record_file.stat().st_mtime_ns
+    assert records.create_records() == {'created': 0, 'updated': 0, 'skipped': 1}
+    assert record_file.stat().st_mtime_ns == mtime
+
+    session['title'] = 'Talk, fixed'
+    assert records.create_records() == {'created': 0, 'updated': 1, 'skipped': 0}
+    assert json.loads(record_file.read_text())['title'] == 'Talk, fixed'
+
+
+class FakeRecord(SimpleNamespace):
+    def model_dump(self, **_):
+        return {'title': self.title, 'sm_teaser_text': self.sm_teaser_text,
+                'sm_short_text': self.sm_short_text, 'sm_long_text': self.sm_long_text}
+
+
+@pytest.fixture
+def description_records(tmp_path, monkeypatch):
+    """Records in a temporary work dir, stored records are validated as `FakeRecord` without speakers"""
+    monkeypatch.setitem(conf.dirs, 'work_dir', tmp_path)
+    with patch('pytube.handlers.records.PretalxClient'):
+        records = Records(qmap={})
+
+    def validate(data):
+        return FakeRecord(speakers=[], abstract='', description='', **{
+            'sm_teaser_text': '', 'sm_short_text': '', 'sm_long_text': '', **data})
+
+    with patch('pytube.handlers.records.SessionRecord.model_validate', side_effect=validate):
+        yield records
+
+
+def test_add_descriptions_saves_each_record(description_records, monkeypatch):
+    records = description_records
+    monkeypatch.setitem(conf.openai, 'single_call', False)
+    records.store.put('records', 'S1', {'title': 'Talk', 'sm_short_text': 'kept'})
+    records.store.put('records', 'S2', {'title': 'Other talk'})
+
+    with patch('pytube.handlers.records.teaser_text', return_value='teaser'), \
+            patch('pytube.handlers.records.sized_text', side_effect=lambda _, max_tokens, **__: f'{max_tokens} tokens'):
+        records.add_descriptions(max_workers=2)
+
+    assert records.store.get('records', 'S1') == {
+        'title': 'Talk', 'sm_teaser_text': 'teaser', 'sm_short_text': 'kept', 'sm_long_text': '300 tokens'}
+    assert records.store.get('records', 'S2')['sm_short_text'] == '100 tokens'
+
+    # complete records are not saved again
+    with patch.object(records.store, 'put') as mock_put:
+        records.add_descriptions(max_workers=2)
+    mock_put.assert_not_called()
+
+
+def test_description_batch_with_local_stand_in(description_records, tmp_path, monkeypatch):
+    records = description_records
+    monkeypatch.setitem(conf.openai, 'single_call', True)
+    records.store.put('records', 'S1', {'title': 'Talk', 'sm_teaser_text': 'kept'})
+    records.store.put('records', 'S2', {'title': 'Done', 'sm_teaser_text': 'a', 'sm_short_text': 'b',
+                                        'sm_long_text': 'c'})
+
+    job = records.prepare_description_batch(job=BatchJob(tmp_path / 'batch'))
+    assert [r['custom_id'] for r in job.requests()] == ['S1:descriptions']
+    job.run_locally(lambda _: json.dumps({'short': 'short text', 'long': 'long text'}))
+    assert records.ingest_description_batch(job) == 1
+    assert records.ingest_description_batch(job) == 0
+
+    assert records.store.get('records', 'S1') == {
+        'title': 'Talk', 'sm_teaser_text': 'kept', 'sm_short_text': 'short text', 'sm_long_text': 'long text'}
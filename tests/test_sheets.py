@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+import pandas as pd
+
+from pytube.handlers.sheets import SheetCache
+
+
+def test_sheet_cache_round_trip_keeps_headers_per_sheet(tmp_path):
+    monday = pd.DataFrame({'Talk': ['A', 'B'], 'Speaker': ['x', None], 'ID': ['ABC123', 'DEF456'],
+                           'Link': ['https://vimeo.com/1', '']})
+    tuesday = pd.DataFrame({'Link': ['https://vimeo.com/2'], 'Title': ['C'], 'Code': ['GHI789']})
+    cache = SheetCache(tmp_path / 'sheets.parquet', max_age=timedelta(hours=1))
+    cache.update('room1', {'Monday': monday}, modified_time='2024-04-22T10:00:00Z')
+    cache.update('room2', {'Tuesday': tuesday})
+    cache.save()
+
+    loaded = SheetCache(tmp_path / 'sheets.parquet', max_age=timedelta(hours=1))
+    assert list(loaded.sheets[('Monday', 'room1')].columns) == ['Talk', 'Speaker', 'ID', 'Link']
+    assert list(loaded.sheets[('Tuesday', 'room2')].columns) == ['Link', 'Title', 'Code']
+    assert loaded.sheets[('Monday', 'room1')]['ID'].tolist() == ['ABC123', 'DEF456']
+    assert loaded.sheets[('Monday', 'room1')]['Speaker'].isna().tolist() == [False, True]
+
+
+def test_sheet_cache_freshness(tmp_path):
+    cache = SheetCache(tmp_path / 'sheets.parquet', max_age=timedelta(hours=1))
+    assert not cache.is_fresh('room1', ['Monday'])
+
+    cache.update('room1', {'Monday': pd.DataFrame({'a': ['1']})}, modified_time='rev1')
+    assert cache.is_fresh('room1', ['Monday'])
+    assert not cache.is_fresh('room1', ['Monday', 'Tuesday'])
+    assert cache.is_fresh('room1', ['Monday'], modified_time='rev1')
+    assert not cache.is_fresh('room1', ['Monday'], modified_time='rev2')
+
+    cache.max_age = timedelta(0)
+    assert not cache.is_fresh('room1', ['Monday'])
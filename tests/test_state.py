@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+
+from pytube.handlers.state import ProcessedState
+
+
+def test_processed_state_persists_and_replays(tmp_path):
+    path = tmp_path / 'state.jsonl'
+    state = ProcessedState(path)
+    state.mark('ABC123', 'downloaded', size=42)
+    state.mark('ABC123', 'copied', channel='pycon')
+
+    reloaded = ProcessedState(path)
+    assert reloaded.has('ABC123', 'downloaded')
+    assert reloaded.has('ABC123', 'copied')
+    assert not reloaded.has('ABC123', 'verified')
+    assert reloaded.get('ABC123')['downloaded']['size'] == 42  # noqa: PLR2004
+    assert 'XYZ999' not in reloaded
+
+    with pytest.raises(ValueError, match='Unknown state'):
+        state.mark('ABC123', 'uploaded')
+
+
+def test_processed_state_imports_processed_txt(tmp_path):
+    (tmp_path / 'processed.txt').write_text('ABC123\nDEF456\n')
+    state = ProcessedState(tmp_path / 'state.jsonl')
+    assert state.has('ABC123', 'copied')
+    assert state.has('DEF456', 'copied')
+    assert (tmp_path / 'state.jsonl').exists()
+
+
+def test_processed_state_concurrent_writers(tmp_path):
+    path = tmp_path / 'state.jsonl'
+    state = ProcessedState(path)
+    threads = [threading.Thread(target=lambda i=i: [state.mark(f'{i:03d}{j:03d}', 'downloaded') for j in range(50)])
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reloaded = ProcessedState(path)
+    assert all(reloaded.has(f'{i:03d}{j:03d}', 'downloaded') for i in range(8) for j in range(50))
+
+
+def test_processed_state_clear(tmp_path):
+    path = tmp_path / 'state.jsonl'
+    state = ProcessedState(path)
+    state.mark('ABC123', 'downloaded')
+    state.mark('ABC123', 'verified')
+    state.clear('ABC123', 'downloaded', 'verified')
+    assert not state.has('ABC123', 'verified')
+
+    state.mark('ABC123', 'downloaded', size=42)
+    reloaded = ProcessedState(path)
+    assert reloaded.has('ABC123', 'downloaded')
+    assert not reloaded.has('ABC123', 'verified')
+
+    with pytest.raises(ValueError, match='Unknown states'):
+        state.clear('ABC123', 'uploaded')
@@ -0,0 +1,71 @@
+from datetime import UTC, datetime, timedelta
+
+import pytest
+
+from pytube.handlers.store import JsonDirStore, RecordStore, SqliteStore, migrate
+
+
+def video(youtube_id: str, publish_at: datetime | None = None) -> dict:
+    return {'id': youtube_id, 'snippet': {'title': youtube_id, 'description': ''},
+            'status': {'publish_at': publish_at.isoformat() if publish_at else None}}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'json':
+        return JsonDirStore(tmp_path)
+    return SqliteStore(tmp_path / 'records.sqlite')
+
+
+def test_store_states_and_due_videos(store):
+    now = datetime.now(UTC)
+    store.put('records', 'AAAAAA', {'pretalx_id': 'AAAAAA', 'youtube_channel': 'pycon'})
+    store.put('records', 'BBBBBB', {'pretalx_id': 'BBBBBB', 'youtube_channel': 'pydata'})
+    store.put('video_records', 'AAAAAA', video('yt-a', now - timedelta(hours=1)), channel='pycon')
+    store.put('video_records', 'BBBBBB', video('yt-b', now - timedelta(hours=2)), channel='pydata')
+    store.put('video_records', 'CCCCCC', video('yt-c'), channel='pycon')
+
+    assert store.keys('video_records') == ['AAAAAA', 'BBBBBB', 'CCCCCC']
+    for key in ('AAAAAA', 'BBBBBB', 'CCCCCC'):
+        store.set_state('video_records', key, 'video_records_updated')
+    assert store.state('video_records', 'AAAAAA') == 'video_records_updated'
+    assert store.keys('video_records', state='video_records') == []
+
+    due = store.find('video_records', state='video_records_updated', due_before=now)
+    assert [key for key, _ in due] == ['BBBBBB', 'AAAAAA']
+    due = store.find('video_records', state='video_records_updated', channel='pycon', due_before=now)
+    assert [data['id'] for _, data in due] == ['yt-a']
+    assert [key for key, _ in store.find('video_records', youtube_id='yt-c')] == ['CCCCCC']
+
+    # updating the data keeps the state
+    store.put('video_records', 'AAAAAA', video('yt-a', now + timedelta(days=1)))
+    assert store.state('video_records', 'AAAAAA') == 'video_records_updated'
+    assert [key for key, _ in store.find('video_records', channel='pycon', due_before=now)] == []
+
+    with pytest.raises(KeyError):
+        store.set_state('video_records', 'XXXXXX', 'video_published')
+
+
+def test_migrate_json_to_sqlite_and_back(tmp_path):
+    source = JsonDirStore(tmp_path / 'json')
+    source.put('records', 'AAAAAA', {'pretalx_id': 'AAAAAA', 'youtube_channel': 'pycon', 'title': 'Grüße'})
+    source.put('video_records', 'AAAAAA', video('yt-a'), state='video_published')
+
+    target = SqliteStore(tmp_path / 'records.sqlite')
+    assert migrate(source, target) == 2  # noqa: PLR2004
+    # the channel of the video record is taken from the session record
+    assert [key for key, _ in target.find('video_records', channel='pycon', state='video_published')] == ['AAAAAA']
+
+    target.export_json(tmp_path / 'export')
+    exported = JsonDirStore(tmp_path / 'export')
+    assert exported.get('records', 'AAAAAA')['title'] == 'Grüße'
+    assert exported.state('video_records', 'AAAAAA') == 'video_published'
+
+
+def test_incomplete_store_fails_on_construction():
+    class GetOnlyStore(RecordStore):
+        def get(self, collection, key):  # noqa: ARG002
+            return None
+
+    with pytest.raises(TypeError, match='abstract'):
+        GetOnlyStore()
@@ -0,0 +1,67 @@
+import hashlib
+import os
+from unittest.mock import patch
+
+import pytest
+
+from pytube.handlers.verify import IntegrityError, Verifier
+
+
+def test_verifier_checks_size_and_checksum(tmp_path):
+    video = tmp_path / 'downloads' / 'video.mp4'
+    video.parent.mkdir()
+    video.write_bytes(b'recording' * 100)
+    md5 = hashlib.md5(video.read_bytes()).hexdigest()
+    verifier = Verifier(tmp_path / 'digests.json')
+
+    assert verifier.verify(video, size=900, md5=md5.upper()) == md5
+    with pytest.raises(IntegrityError, match='size'):
+        verifier.verify(video, size=901)
+    with pytest.raises(IntegrityError, match='checksum'):
+        verifier.verify(video, md5='0' * 32)
+
+
+def test_verifier_reuses_digest_of_unchanged_files(tmp_path):
+    video = tmp_path / 'video.mp4'
+    video.write_bytes(b'a' * 100)
+    Verifier(tmp_path / 'digests.json').digest(video)
+
+    verifier = Verifier(tmp_path / 'digests.json')
+    with patch('pytube.handlers.verify.file_md5', return_value='0' * 32) as mock_md5:
+        verifier.digest(video)
+        mock_md5.assert_not_called()
+
+        # same size, but modified
+        video.write_bytes(b'b' * 100)
+        os.utime(video, ns=(0, 0))
+        verifier.digest(video)
+        mock_md5.assert_called_once()
+
+
+def test_verifier_pool_checks_copies(tmp_path):
+    src, good, bad = tmp_path / 'src.mp4', tmp_path / 'good.mp4', tmp_path / 'bad.mp4'
+    src.write_bytes(b'x' * 1000)
+    good.write_bytes(b'x' * 1000)
+    bad.write_bytes(b'x' * 999 + b'y')
+    verified = []
+    verifier = Verifier(tmp_path / 'digests.json')
+
+    verifier.submit(verifier.verify_copy, src, good, on_success=verified.append)
+    verifier.submit(verifier.verify_copy, src, bad, on_success=verified.append)
+
+    assert verifier.wait() == (1, 1)
+    assert verified == [hashlib.md5(b'x' * 1000).hexdigest()]
+
+
+def test_verifier_quarantines_failed_files(tmp_path):
+    video = tmp_path / 'downloads' / 'ABC123' / 'video.mp4'
+    video.parent.mkdir(parents=True)
+    video.write_bytes(b'x' * 999)
+    verifier = Verifier(tmp_path / 'digests.json')
+
+    verifier.submit(verifier.verify, video, size=1000, on_failure=lambda _: verifier.quarantine(video))
+
+    assert verifier.wait() == (0, 1)
+    assert not video.exists()
+    assert (tmp_path / 'quarantine' / 'downloads' / 'ABC123' / 'video.mp4').read_bytes() == b'x' * 999
+    assert verifier.quarantine(video) is None
@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from pytube.handlers.sheets import SheetCache
+from pytube.models.talk import Talk, vimeo_id_from_link
+from pytube.scripts.video_process_google_sheet import (
+    build_manifest,
+    fetch_spreadsheet,
+    vimeo_ids_from_links,
+)
+
+
+def test_vimeo_ids_match_talk_model():
+    links = ['https://vimeo.com/938668780/a661aaf938?share=copy', 'https://vimeo.com/123', 'vimeo.com/456/x',
+             'https://vimeo.com', 'opt-out', '']
+    assert vimeo_ids_from_links(pd.Series(links)).tolist() == [vimeo_id_from_link(link) for link in links]
+
+
+def test_build_manifest_splits_valid_and_skipped_rows():
+    sheet = pd.DataFrame({
+        'Talk': ['A', 'B', 'C', 'D'],
+        'Speaker': ['x', 'y', None, 'z'],
+        'ID': ['ABC123', 'opt-out', ' DEF456 ', 'GHI789'],
+        'Link': ['https://vimeo.com/1/a', 'https://vimeo.com/2', 'https://vimeo.com/3', None],
+    })
+    manifest, skipped = build_manifest({('Monday', 'room1'): sheet}, validate=True)
+
+    assert list(manifest.columns) == list(Talk.model_fields)
+    assert manifest['title'].tolist() == ['A', 'C']
+    assert manifest['vimeo_id'].tolist() == ['1', '3']
+    assert manifest['speaker'].tolist() == ['x', '']
+    assert skipped['title'].tolist() == ['B', 'D']
+    assert skipped[['room', 'day']].drop_duplicates().values.tolist() == [['room1', 'Monday']]
+
+
+def test_fetch_spreadsheet_skips_missing_worksheets(tmp_path):
+    class FakeSpreadsheet:
+        def worksheets(self):
+            return [SimpleNamespace(title='Monday'), SimpleNamespace(title="Tuesday's")]
+
+        def values_batch_get(self, ranges):
+            assert ranges == ["'Monday'", "'Tuesday''s'"]
+            return {'valueRanges': [{'values': [['Talk', 'ID'], ['A', 'ABC123']]},
+                                    {'values': [['Talk', 'ID'], ['B', 'DEF456']]}]}
+
+    client = SimpleNamespace(gc=SimpleNamespace(open_by_key=lambda key: FakeSpreadsheet()))  # noqa: ARG005
+    cache = SheetCache(tmp_path / 'sheets.parquet')
+    fetch_spreadsheet(client, cache, 'room1', 'sheet-id', ['Monday', 'Wednesday', "Tuesday's"])
+
+    assert cache.sheets[('Monday', 'room1')]['ID'].tolist() == ['ABC123']
+    assert cache.sheets[("Tuesday's", 'room1')]['ID'].tolist() == ['DEF456']
+    assert cache.sheets[('Wednesday', 'room1')].empty
+    assert cache.is_fresh('room1', ['Monday', 'Wednesday', "Tuesday's"])
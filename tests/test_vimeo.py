@@ -0,0 +1,98 @@
+from datetime import UTC, datetime, timedelta
+from unittest.mock import MagicMock
+
+from pytube.handlers.vimeo import DownloadLinkResolver, VimeoCatalog
+
+
+def fake_client(pages: dict[str, dict]) -> MagicMock:
+    client = MagicMock()
+
+    def get(url):
+        response = MagicMock()
+        response.json.return_value = pages[url.split('?')[0] + ('?page=2' if 'page=2' in url else '')]
+        return response
+
+    client.get.side_effect = get
+    return client
+
+
+T1, T2, T3 = '2024-04-22T10:00:00+00:00', '2024-04-23T10:00:00+00:00', '2024-04-24T10:00:00+00:00'
+
+
+def video(video_id, modified):
+    return {'uri': f'/videos/{video_id}', 'modified_time': modified, 'download': []}
+
+
+def test_catalog_sync_pages_and_caches(tmp_path):
+    client = fake_client({
+        '/me/videos': {'data': [video('3', T3), video('2', T2)], 'paging': {'next': '/me/videos?page=2'}},
+        '/me/videos?page=2': {'data': [video('1', T1)], 'paging': {'next': None}},
+    })
+    catalog = VimeoCatalog(client, tmp_path / 'catalog.json')
+    assert catalog.sync() == 3  # noqa: PLR2004
+    assert client.get.call_count == 2  # noqa: PLR2004
+    assert 'fields=uri,download,modified_time' in client.get.call_args_list[0].args[0]
+
+    # answered from the cache on disk
+    cached = VimeoCatalog(MagicMock(), tmp_path / 'catalog.json')
+    assert cached.get('2') == video('2', T2)
+    cached.client.get.assert_not_called()
+
+
+def test_catalog_sync_stops_at_watermark(tmp_path):
+    catalog = VimeoCatalog(MagicMock(), tmp_path / 'catalog.json')
+    catalog.videos = {'2': video('2', T2), '1': video('1', T1)}
+    catalog.watermark = T2
+    catalog.client = fake_client({
+        '/me/videos': {'data': [video('3', T3), video('2', T2)], 'paging': {'next': '/me/videos?page=2'}},
+        '/me/videos?page=2': {'data': [video('1', T1)], 'paging': {'next': None}},
+    })
+    assert catalog.sync() == 1
+    assert catalog.client.get.call_count == 2  # noqa: PLR2004
+    assert set(catalog.videos) == {'1', '2', '3'}
+    assert VimeoCatalog(MagicMock(), tmp_path / 'catalog.json').watermark == T3
+
+
+def test_catalog_sync_pages_past_fetched_videos(tmp_path):
+    catalog = VimeoCatalog(MagicMock(), tmp_path / 'catalog.json')
+    catalog.client.get.return_value.json.return_value = video('3', T3)
+    catalog.get('3')
+    assert catalog.watermark is None
+
+    # the video fetched on its own is no reason to stop paging
+    catalog.client = fake_client({
+        '/me/videos': {'data': [video('3', T3), video('2', T2)], 'paging': {'next': '/me/videos?page=2'}},
+        '/me/videos?page=2': {'data': [video('1', T1)], 'paging': {'next': None}},
+    })
+    assert catalog.sync() == 2  # noqa: PLR2004
+    assert set(catalog.videos) == {'1', '2', '3'}
+    assert catalog.watermark == T3
+
+
+def download(rendition, expires):
+    return {'rendition': rendition, 'quality': 'hd', 'link': f'https://vod.example.com/{rendition}?exp={expires}',
+            'expires': expires.isoformat()}
+
+
+def test_resolver_falls_back_through_renditions(tmp_path):
+    later = datetime.now(UTC) + timedelta(hours=2)
+    catalog = VimeoCatalog(MagicMock(), tmp_path / 'catalog.json')
+    catalog.videos = {'1': {'uri': '/videos/1', 'download': [download('source', later), download('720p', later)]}}
+    resolver = DownloadLinkResolver(catalog, renditions=['1080p', '720p', 'source'], refresh_margin=300)
+
+    assert resolver.resolve('1')['rendition'] == '720p'
+    catalog.client.get.assert_not_called()
+
+
+def test_resolver_refreshes_expiring_links(tmp_path):
+    soon = datetime.now(UTC) + timedelta(seconds=60)
+    later = datetime.now(UTC) + timedelta(hours=2)
+    catalog = VimeoCatalog(MagicMock(), tmp_path / 'catalog.json')
+    catalog.videos = {'1': {'uri': '/videos/1', 'download': [download('1080p', soon)]}}
+    catalog.client.get.return_value.json.return_value = {'uri': '/videos/1', 'download': [download('1080p', later)]}
+    resolver = DownloadLinkResolver(catalog, renditions=['1080p'], refresh_margin=300)
+
+    resolved = resolver.resolve('1')
+    assert resolved['expires'] == later.isoformat()
+    assert catalog.videos['1']['download'][0]['expires'] == later.isoformat()
+    catalog.client.get.assert_called_once_with('/videos/1?fields=uri,download,modified_time')
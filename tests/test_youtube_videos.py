@@ -1,10 +1,11 @@
+import json
 from datetime import datetime, timedelta
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from pytube.handlers.youtube import YT, PrepareVideoMetadata
+from pytube.handlers.youtube import YT, PrepareVideoMetadata, changed_fields
 
 
 @patch('src.youtube_videos.YT.check_macos_sequoia')
@@ -152,3 +153,149 @@ def test_check_macos_sequoia(mock_mac_ver, mock_system):
     mock_system.return_value = "Windows"
     mock_mac_ver.return_value = ("", ("", "", ""), "")
     assert YT.check_macos_sequoia() is False
+
+
+class FakeBatch:
+    """Stand-in for `BatchHttpRequest`, answers each request with the response of `respond(body)`"""
+    def __init__(self, callback, respond, batches):
+        self.callback = callback
+        self.respond = respond
+        self.requests = []
+        batches.append(self)
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        for request_id, body in self.requests:
+            try:
+                self.callback(request_id, self.respond(body), None)
+            except Exception as e:  # noqa: BLE001
+                self.callback(request_id, None, e)
+
+
+def fake_youtube(batches, failing=()):
+    def respond(body):
+        if body['id'] in failing:
+            raise RuntimeError(f'backendError {body["id"]}')
+        return body
+
+    youtube = MagicMock()
+    youtube.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, respond, batches)
+    youtube.videos().update.side_effect = lambda part, body: body  # noqa: ARG005
+    return youtube
+
+
+def test_video_update_body():
+    body = YT.video_update_body('yt-a', title='Title', category_id='28', privacy_status='unlisted',
+                                publish_date='2025-04-24T10:00:00+00:00')
+    assert body == {'id': 'yt-a', 'snippet': {'title': 'Title', 'categoryId': '28'},
+                    'status': {'privacyStatus': 'private', 'publishAt': '2025-04-24T10:00:00+0000'}}
+
+
+@pytest.fixture
+def queued_videos(monkeypatch, tmp_path):
+    """Five queued video records, CODE04 of the pydata channel, the others of pycon"""
+    from pytube import conf
+    from pytube.handlers.store import get_store
+
+    monkeypatch.setitem(conf.dirs, 'work_dir', tmp_path)
+    monkeypatch.setitem(conf.dirs, 'video_dir', tmp_path)
+    monkeypatch.setitem(conf.records, 'backend', 'json')
+    monkeypatch.setitem(conf.youtube, 'channels', {'pycon': {}, 'pydata': {}})
+    for channel in conf.youtube.channels:
+        (tmp_path / f'youtube_{channel}_playlist.json').write_text('[]')
+    keys = [f'CODE{i:02d}' for i in range(5)]
+    (tmp_path / 'pretalx_yt_map.json').write_text(json.dumps({key: f'yt-{key}' for key in keys}))
+    (tmp_path / 'tracks_map.json').write_text(json.dumps({key: 'pycon' for key in keys} | {'CODE04': 'pydata'}))
+    store = get_store()
+    for key in keys:
+        store.put('video_records', key, {'id': f'yt-{key}', 'snippet': {'title': key, 'description': ''}},
+                  state='video_records')
+    return store
+
+
+def test_send_all_video_metadata_in_batches(queued_videos):
+    store = queued_videos
+    batches = []
+    meta = PrepareVideoMetadata(template_file='', at='')
+    with patch.object(YT, 'youtube', fake_youtube(batches, failing={'yt-CODE01'})):
+        result = meta.send_all_video_metadata('pycon', batch_size=3, diff_only=False)
+
+    assert result == {'updated': 3, 'failed': 1, 'skipped': 0, 'deferred': 0}
+    assert [len(batch.requests) for batch in batches] == [3, 1]
+    assert store.keys('video_records', state='video_records') == ['CODE01', 'CODE04']
+    assert 'backendError' in store.get('video_records', 'CODE01')['update_error']['error']
+    assert store.keys('video_records', state='video_records_updated') == ['CODE00', 'CODE02', 'CODE03']
+
+
+def test_send_all_video_metadata_diff_only(queued_videos):
+    store = queued_videos
+    batches = []
+    youtube = fake_youtube(batches)
+    current = [{'id': f'yt-CODE0{i}', 'snippet': {'title': f'CODE0{i}', 'categoryId': '28'},
+                'status': {'privacyStatus': 'unlisted'}} for i in range(4)]
+    current[2]['snippet']['title'] = 'Old title'
+    youtube.videos().list.return_value.execute.return_value = {'items': current}
+    meta = PrepareVideoMetadata(template_file='', at='')
+    with patch.object(YT, 'youtube', youtube):
+        result = meta.send_all_video_metadata('pycon', diff_only=True)
+
+    assert result == {'updated': 1, 'failed': 0, 'skipped': 3, 'deferred': 0}
+    assert [request_id for request_id, _ in batches[0].requests] == ['CODE02']
+    assert store.keys('video_records', state='video_records_updated') == ['CODE00', 'CODE01', 'CODE02', 'CODE03']
+
+
+def test_changed_fields():
+    body = YT.video_update_body('yt-a', title='Title', publish_date='2025-04-24T10:00:00+00:00')
+    current = {'snippet': {'title': 'Title'}, 'status': {'privacyStatus': 'private', 'publishAt': '2025-04-24T10:00:00Z'}}
+    assert changed_fields(body, current) == []
+    current['status']['privacyStatus'] = 'unlisted'
+    assert changed_fields(body, current) == ['status.privacyStatus']
+
+
+def test_send_all_video_metadata_defers_beyond_quota(queued_videos):
+    from handlers.quota import QuotaExceededError, QuotaScheduler, quota_ledger
+
+    store = queued_videos
+    ledger = quota_ledger()
+    ledger.charge('videos.update', units=ledger.daily_limit - 100)
+    batches = []
+    meta = PrepareVideoMetadata(template_file='', at='')
+    with patch.object(YT, 'youtube', fake_youtube(batches)), pytest.raises(QuotaExceededError):
+        meta.send_all_video_metadata('pycon', diff_only=False)
+
+    assert ledger.remaining() == 0
+    assert store.keys('video_records', state='video_records') == ['CODE02', 'CODE03', 'CODE04']
+    assert 'deferred until' in store.get('video_records', 'CODE03')['update_error']['error']
+
+    # the scheduler keeps the remaining updates for the next quota reset
+    scheduler = QuotaScheduler(ledger)
+    chunk = list(meta.queued_videos('pycon'))
+    assert chunk == ['CODE02', 'CODE03']
+    assert meta.update_units(len(chunk), diff_only=True) == 101  # noqa: PLR2004
+    scheduler.add('pycon', units=meta.update_units(len(chunk), diff_only=False),
+                  func=lambda: meta.send_all_video_metadata('pycon', diff_only=False, pretalx_ids=chunk))
+    assert scheduler.run() == ['pycon']
+    assert len(scheduler) == 1
+
+
+def test_update_video_metadata_with_sqlite_store(queued_videos, monkeypatch):
+    from pytube import conf
+    from pytube.handlers.store import get_store
+
+    monkeypatch.setitem(conf.records, 'backend', 'sqlite')
+    store = get_store()
+    for key, data in queued_videos.items('video_records'):
+        store.put('video_records', key, data, state='video_records')
+    store.set_state('video_records', 'CODE00', 'video_records_updated')
+
+    meta = PrepareVideoMetadata(template_file='', at='')
+
+    def add_tag(_pretalx_id, data):
+        data['snippet']['tags'] = ['python']
+
+    meta.update_video_metadata('video_records_updated', add_tag)
+    assert store.get('video_records', 'CODE00')['snippet']['tags'] == ['python']
+    assert store.state('video_records', 'CODE00') == 'video_records_updated'
+    assert 'tags' not in store.get('video_records', 'CODE01')['snippet']